@@ -0,0 +1,96 @@
+"""
+Evaluation of the compression of the lessons retrieved by the thinking agent.
+
+The thinking agent answers the same questions with the full lessons and with the compressed ones.
+The report compares the prompt tokens and the latency of both runs, and the cosine similarity of
+their answers as a proxy of the answer quality: a low similarity points at the cases to read.
+"""
+import time
+from dataclasses import asdict, dataclass
+
+import numpy as np
+from pydantic_ai.usage import UsageLimits
+
+from src.api.evaluation.router_fusion import ROUTING_CASES, percentile
+from src.llm_agent.agent import thinking_grammar_agent
+from src.llm_agent.doc_compression import docs_compression
+from src.llm_agent.embedding_batcher import embedding_batcher
+from src.schemas.schemas import RouterAgentDeps
+
+COMPRESSION_CASES = [case.prompt for case in ROUTING_CASES if case.message_type == "thinking_grammar_answer"] + [
+    "как образуется прошедшее время глаголов?",
+    "в чем разница между -아서 и -고?",
+    "когда используется вежливый стиль 합니다?",
+    "объясни косвенную речь в корейском",
+]
+
+
+@dataclass
+class AnswerOutcome:
+    """
+    Answer of the thinking agent with its prompt tokens and latency
+    """
+    answer: str
+    prompt_tokens: int
+    seconds: float
+
+
+async def run_thinking_agent(deps: RouterAgentDeps, prompt: str, compressed: bool) -> AnswerOutcome:
+    started = time.perf_counter()
+    with docs_compression(compressed):
+        response = await thinking_grammar_agent.run(
+            user_prompt=prompt,
+            deps=deps,
+            usage_limits=UsageLimits(request_limit=2),
+        )
+    return AnswerOutcome(response.output, response.usage().request_tokens or 0, time.perf_counter() - started)
+
+
+def flow_report(outcomes: list[AnswerOutcome]) -> dict:
+    seconds = [outcome.seconds for outcome in outcomes]
+    return {
+        "mean_prompt_tokens": round(sum(outcome.prompt_tokens for outcome in outcomes) / len(outcomes), 1),
+        "latency_ms": {
+            "mean": round(sum(seconds) / len(seconds) * 1000, 1),
+            "p50": round(percentile(seconds, 50) * 1000, 1),
+            "p95": round(percentile(seconds, 95) * 1000, 1),
+        },
+    }
+
+
+async def evaluate_docs_compression(deps: RouterAgentDeps, prompts: list[str] = None) -> dict:
+    """
+    Answer every prompt with the full and the compressed lessons, one prompt at a time
+    """
+    prompts = prompts or COMPRESSION_CASES
+    full, compressed = [], []
+    for prompt in prompts:
+        # Alternate the order to spread a warming-up or a rate limit over both runs
+        if len(full) % 2:
+            compressed.append(await run_thinking_agent(deps, prompt, True))
+            full.append(await run_thinking_agent(deps, prompt, False))
+        else:
+            full.append(await run_thinking_agent(deps, prompt, False))
+            compressed.append(await run_thinking_agent(deps, prompt, True))
+
+    similarities = []
+    for a, b in zip(full, compressed):
+        first = np.asarray(await embedding_batcher.embed(deps.openai_client, a.answer))
+        second = np.asarray(await embedding_batcher.embed(deps.openai_client, b.answer))
+        similarities.append(float(first @ second / ((np.linalg.norm(first) * np.linalg.norm(second)) or 1.0)))
+
+    return {
+        "cases": len(prompts),
+        "full": flow_report(full),
+        "compressed": flow_report(compressed),
+        "answer_similarity": {
+            "mean": round(sum(similarities) / len(similarities), 3),
+            "min": round(min(similarities), 3),
+        },
+        "answers": [
+            {"prompt": prompt, "similarity": round(similarity, 3), "full": asdict(a), "compressed": asdict(b)}
+            for prompt, similarity, a, b in sorted(
+                zip(prompts, similarities, full, compressed), key=lambda case: case[1]
+            )
+        ],
+    }
@@ -6,6 +6,7 @@ from pydantic_ai.agent import  Agent
 from qdrant_client.http.models import Prefetch, SparseVector, FusionQuery, Fusion
 
 from src.config.settings import Config
+from src.llm_agent.llm_scheduler import openai_model
 from src.schemas.schemas import GrammarEntryV2, RetrievedGrammar, RouterAgentDeps
 
 load_dotenv()
@@ -15,7 +16,7 @@ import asyncio
 from typing import List
 
 llm_filter_agent = Agent(
-    model="openai:gpt-4.1",
+    model=openai_model("gpt-4.1"),
     instrument=True,
     output_type=List[int],
     instructions="""
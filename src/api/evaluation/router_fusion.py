@@ -0,0 +1,184 @@
+"""
+Evaluation of the fused router against the two-step router -> query rewriter flow.
+
+Both flows run on the same labelled prompts. The report compares how often they classify a message
+the same way and correctly, how often the extracted grammar pattern matches the expected one, and
+the latency and tokens of the routing (the rewriter only runs for grammar searches, as in /invoke).
+"""
+import time
+from dataclasses import asdict, dataclass
+
+from pydantic_ai.usage import UsageLimits
+
+from src.llm_agent.agent import fused_router_agent, query_rewriter_agent, router_agent
+from src.llm_agent.single_flight import normalize_key
+from src.schemas.schemas import FusedRouterAgentResult, RouterAgentResult
+
+
+@dataclass
+class RoutingCase:
+    """
+    A user prompt with its expected message type and grammar pattern ("None" for the other types)
+    """
+    prompt: str
+    message_type: str
+    grammar_pattern: str = "None"
+
+
+ROUTING_CASES = [
+    RoutingCase("아/어 보이다", "direct_grammar_search", "-아/어 보이다"),
+    RoutingCase("грамматика 이/가", "direct_grammar_search", "이/가"),
+    RoutingCase("объясни грамматику -는 것 같다", "direct_grammar_search", "-는 것 같다"),
+    RoutingCase("가고 싶어요", "direct_grammar_search", "-고 싶다"),
+    RoutingCase("расскажи про -(으)ㄹ 수 있다", "direct_grammar_search", "-(으)ㄹ 수 있다"),
+    RoutingCase("что значит -아/어서", "direct_grammar_search", "-아/어서"),
+    RoutingCase("объясни грамматику 는 동안", "direct_grammar_search", "-는 동안"),
+    RoutingCase("грамматика -(으)면", "direct_grammar_search", "-(으)면"),
+    RoutingCase("будущее время в корейском", "direct_grammar_search", "будущее время"),
+    RoutingCase("дательный падеж", "direct_grammar_search", "дательный падеж"),
+    RoutingCase("разница между 은/는 и 이/가", "thinking_grammar_answer"),
+    RoutingCase("когда использовать 을, а когда 를?", "thinking_grammar_answer"),
+    RoutingCase("почему в 먹었어요 используется 었?", "thinking_grammar_answer"),
+    RoutingCase("чем отличается -아서 от -니까?", "thinking_grammar_answer"),
+    RoutingCase("приведи еще примеры", "thinking_grammar_answer"),
+    RoutingCase("привет! как дела?", "casual_answer"),
+    RoutingCase("какая сегодня погода в Сеуле?", "casual_answer"),
+    RoutingCase("спасибо за помощь", "casual_answer"),
+]
+
+
+@dataclass
+class RoutingOutcome:
+    """
+    Result of one flow on one case
+    """
+    message_type: str
+    grammar_pattern: str
+    seconds: float
+    tokens: int
+
+
+def normalize_pattern(pattern: str) -> str:
+    """
+    Compare patterns regardless of case, spaces and the leading dash of endings
+    """
+    return normalize_key(pattern).replace(" ", "").lstrip("-")
+
+
+def run_tokens(result) -> int:
+    usage = result.usage()
+    return (usage.request_tokens or 0) + (usage.response_tokens or 0)
+
+
+async def run_two_step(prompt: str) -> RoutingOutcome:
+    started = time.perf_counter()
+    router_response = await router_agent.run(
+        user_prompt=prompt,
+        usage_limits=UsageLimits(request_limit=3),
+        output_type=RouterAgentResult,
+    )
+    tokens = run_tokens(router_response)
+    message_type = router_response.output.message_type
+
+    grammar_pattern = "None"
+    if message_type == "direct_grammar_search":
+        rewriter_response = await query_rewriter_agent.run(user_prompt=prompt, usage_limits=UsageLimits(request_limit=2))
+        tokens += run_tokens(rewriter_response)
+        grammar_pattern = rewriter_response.output
+
+    return RoutingOutcome(message_type, grammar_pattern, time.perf_counter() - started, tokens)
+
+
+async def run_fused(prompt: str) -> RoutingOutcome:
+    started = time.perf_counter()
+    response = await fused_router_agent.run(
+        user_prompt=prompt,
+        usage_limits=UsageLimits(request_limit=3),
+        output_type=FusedRouterAgentResult,
+    )
+    output = response.output
+    grammar_pattern = output.grammar_pattern if output.message_type == "direct_grammar_search" else "None"
+    return RoutingOutcome(output.message_type, grammar_pattern, time.perf_counter() - started, run_tokens(response))
+
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    Nearest-rank percentile
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))]
+
+
+def compare_routing(
+        cases: list[RoutingCase],
+        two_step: list[RoutingOutcome],
+        fused: list[RoutingOutcome],
+) -> dict:
+    """
+    Agreement, accuracy, rewrite quality, latency and tokens of both flows on the same cases
+    """
+    grammar_cases = [i for i, case in enumerate(cases) if case.message_type == "direct_grammar_search"]
+
+    def flow_report(outcomes: list[RoutingOutcome]) -> dict:
+        seconds = [outcome.seconds for outcome in outcomes]
+        correct_patterns = sum(
+            normalize_pattern(outcomes[i].grammar_pattern) == normalize_pattern(cases[i].grammar_pattern)
+            for i in grammar_cases
+        )
+        return {
+            "classification_accuracy": round(
+                sum(outcome.message_type == case.message_type for case, outcome in zip(cases, outcomes)) / len(cases), 3
+            ),
+            "pattern_accuracy": round(correct_patterns / len(grammar_cases), 3) if grammar_cases else 0.0,
+            "latency_ms": {
+                "mean": round(sum(seconds) / len(seconds) * 1000, 1),
+                "p50": round(percentile(seconds, 50) * 1000, 1),
+                "p95": round(percentile(seconds, 95) * 1000, 1),
+            },
+            "mean_tokens": round(sum(outcome.tokens for outcome in outcomes) / len(outcomes), 1),
+        }
+
+    both_grammar = [
+        i for i in range(len(cases))
+        if two_step[i].message_type == fused[i].message_type == "direct_grammar_search"
+    ]
+    disagreements = [
+        {"expected": asdict(cases[i]), "two_step": asdict(two_step[i]), "fused": asdict(fused[i])}
+        for i in range(len(cases))
+        if two_step[i].message_type != fused[i].message_type
+        or normalize_pattern(two_step[i].grammar_pattern) != normalize_pattern(fused[i].grammar_pattern)
+    ]
+
+    return {
+        "cases": len(cases),
+        "classification_agreement": round(
+            sum(a.message_type == b.message_type for a, b in zip(two_step, fused)) / len(cases), 3
+        ),
+        "pattern_agreement": round(
+            sum(normalize_pattern(two_step[i].grammar_pattern) == normalize_pattern(fused[i].grammar_pattern)
+                for i in both_grammar) / len(both_grammar), 3
+        ) if both_grammar else 0.0,
+        "two_step": flow_report(two_step),
+        "fused": flow_report(fused),
+        "disagreements": disagreements,
+    }
+
+
+async def evaluate_router_fusion(cases: list[RoutingCase] = None) -> dict:
+    """
+    Run both flows on every case, one case at a time so that the latencies are comparable
+    """
+    cases = cases or ROUTING_CASES
+    two_step, fused = [], []
+    for case in cases:
+        # Alternate the order to spread a warming-up or a rate limit over both flows
+        if len(two_step) % 2:
+            fused.append(await run_fused(case.prompt))
+            two_step.append(await run_two_step(case.prompt))
+        else:
+            two_step.append(await run_two_step(case.prompt))
+            fused.append(await run_fused(case.prompt))
+
+    return compare_routing(cases, two_step, fused)
@@ -5,10 +5,11 @@ from pydantic_ai import Agent
 
 from src.llm_agent.agent import thinking_grammar_agent
 from src.llm_agent.agent_tools import retrieve_docs_tool
+from src.llm_agent.llm_scheduler import openai_model
 from src.schemas.schemas import RouterAgentDeps, TelegramMessage, RetrievedDoc
 
 hyde_agent = Agent(
-    model="openai:gpt-4.1-mini",
+    model=openai_model("gpt-4.1-mini"),
     instrument=True,
     instructions="""
 Ты - профессиональный преподаватель корейского языка. Учитывая вопрос пользователя, сгенерируйте гипотетический ответ,
@@ -18,7 +19,7 @@ hyde_agent = Agent(
 )
 
 hyde_direct = Agent(
-    model="openai:gpt-4.1-mini",
+    model=openai_model("gpt-4.1-mini"),
     instrument=True,
     instructions="""
 Ты - профессиональный преподаватель корейского языка. Сгенерируйте гипотетическое определение на грамматику из запроса пользователя. 
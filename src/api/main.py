@@ -1,31 +1,66 @@
+import asyncio
+import json
 import logfire
 import os
+from functools import partial
 
 from aiogram import Bot
 from fastapi import FastAPI, BackgroundTasks, HTTPException
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.params import Depends
 from fastembed import SparseTextEmbedding, LateInteractionTextEmbedding
-from openai import AsyncOpenAI
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
 from pydantic_ai.messages import ModelResponse, TextPart, ModelRequest, UserPromptPart
 from pydantic_ai.usage import UsageLimits
 from pydantic_ai.agent import AgentRunResult
 from qdrant_client import AsyncQdrantClient
+from qdrant_client.http.models import FieldCondition, Filter, MatchValue
+from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.api.evaluation.reranker import QwenReranker
-from src.api.routers import evaluation
+from src.api.routers import answer_cache as answer_cache_router, evaluation, grammars
+from src.api.routers.grammars import grammar_card
 from src.config.settings import Config
-from src.db.crud import get_message_history, update_message_history, get_user_ids
-from src.db.database import get_db
+from src.db.crud import get_message_history, update_message_history, get_user_ids, get_translation_memory_stats, \
+    get_recent_message_blob_data
+from src.db.database import async_session, get_db
 from src.llm_agent.agent import router_agent, thinking_grammar_agent, system_agent, query_rewriter_agent, \
-    translation_agent, conversation_agent, learning_agent
-from src.llm_agent.agent_tools import retrieve_grammars_tool
+    translation_agent, conversation_agent, learning_agent, fused_router_agent, ROUTER_MODE
+from src.llm_agent.agent_tools import retrieve_grammars_for_query, retrieve_grammars_tool
+from src.llm_agent.answer_cache import answer_cache
+from src.llm_agent.circuit_breaker import CircuitOpenError, StateChangeNotifier, circuit_breaker_stats, \
+    circuit_breakers
+from src.llm_agent.context_builder import CONTEXT_TOKEN_BUDGETS, build_context, update_summary
+from src.llm_agent.corpus import get_corpus_version, set_corpus_version
+from src.llm_agent.deadline import DEGRADATIONS, REQUEST_DEADLINE_SECONDS, Deadline, deadline_stats
+from src.llm_agent.doc_compression import compression_stats
+from src.llm_agent.embedding_batcher import embedding_batcher
+from src.llm_agent.fuzzy_grammar import FUZZY_GRAMMAR_LOOKUP, FuzzyGrammarLookup, transliterate_layout
+from src.llm_agent.grammar_patterns import LOCAL_PATTERN_EXTRACTOR, GrammarPatternExtractor, display_name, \
+    load_grammar_names
+from src.llm_agent.hedging import hedged, hedging_stats
+# INFO: openai_client is shared with the agents, its requests are scheduled per model
+from src.llm_agent.llm_scheduler import Priority, llm_priority, llm_scheduler, openai_client
+from src.llm_agent.pipeline_metrics import measure_pipeline, pipeline_stage, record_usage, timed_task
+from src.llm_agent.retrieval_cache import RETRIEVAL_CACHE, retrieval_cache
+from src.llm_agent.rewrite_cache import rewrite_cache
+from src.llm_agent.single_flight import normalize_key, query_rewriter_flight, single_flight_stats
+from src.llm_agent.speculation import SPECULATIVE_ROUTING, speculate, speculation_stats
+from src.llm_agent.translation_memory import ChunkedTranslation, translate_with_memory, translation_memory_stats
+from src.llm_agent.warmup import WARMUP, WARMUP_HISTORY_BLOBS, mine_history, warmup_job
 from src.schemas.schemas import (
+    FusedRouterAgentResult,
+    GrammarRef,
+    RetrievedGrammar,
     RouterAgentDeps,
     RouterAgentResult,
     TelegramMessage,
 )
+from src.tgbot.misc.utils import send_admin_message
+from src.utils.corpus_artifact import load_corpus_artifact
 from src.utils.json_to_telegram_md import grammar_entry_to_markdown
+from src.utils.prometheus import StatsCollector
 
 app = FastAPI()
 
@@ -36,7 +71,6 @@ os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
 cache_directory = os.path.expanduser("~/.cache/huggingface/hub")
 
-openai_client = AsyncOpenAI()
 qdrant_client = AsyncQdrantClient(
     # IMPORTANT: Use qdrant_host_docker if running in docker
     # host=config.qdrant_host_docker,
@@ -46,12 +80,89 @@ qdrant_client = AsyncQdrantClient(
 
 # reranking_model = QwenReranker()
 
-logfire.configure(token=config.logfire_api_key, environment="local")
+# Compiled grammar corpus (mmap), built with `python -m src.utils.corpus_artifact`
+corpus_artifact = load_corpus_artifact()
+if corpus_artifact:
+    set_corpus_version(corpus_artifact.corpus_version)
+
+# INFO: Retrieval results are cached as grammar IDs, read back from the artifact; shared between the workers with Redis
+retrieval_cache.artifact = corpus_artifact
+if config.use_redis:
+    retrieval_cache.redis = Redis.from_url(config.redis.dsn())
+
+# INFO: Conjugated grammar forms ("가고 싶어요") are resolved locally, the query rewriter only gets the rest
+grammar_names = load_grammar_names(corpus_artifact)
+grammar_pattern_extractor = GrammarPatternExtractor(grammar_names)
+# INFO: Mistyped names ("-고 십다") and Korean typed with the Latin layout ("rhtlvek") are corrected before the search
+fuzzy_grammar_lookup = FuzzyGrammarLookup(grammar_names)
+
+# INFO: Fallbacks while a circuit breaker is open: grammar cards by name without Qdrant, the last known
+# users without Postgres, see src.llm_agent.circuit_breaker
+corpus_ids_by_pattern = {
+    display_name(name): grammar_id for grammar_id, name in zip(corpus_artifact.ids(), corpus_artifact.grammar_names())
+} if corpus_artifact else {}
+known_user_ids: set[int] = set()
+UNAVAILABLE_ANSWER = (
+    "Сервис временно перегружен, сейчас я могу найти грамматику только по ее названию. "
+    "Попробуйте повторить запрос через минуту."
+)
+
+circuit_notifier = StateChangeNotifier(lambda text: send_admin_message(bot, text, "⚡ Circuit breaker"))
+for breaker in circuit_breakers.values():
+    breaker.listeners.append(circuit_notifier)
+
+# INFO: Without a token logfire stays local, /metrics doesn't depend on it
+logfire.configure(token=config.logfire_api_key, environment="local", send_to_logfire="if-token-present")
 logfire.instrument_openai(openai_client)
 logfire.instrument_fastapi(app)
 logfire.instrument_pydantic_ai()
 
 app.include_router(evaluation.router)
+app.include_router(grammars.router)
+app.include_router(answer_cache_router.router)
+
+# In-process stats exposed on /metrics next to the pipeline metrics
+REGISTRY.register(StatsCollector("answer_cache", answer_cache.stats, counters=("hits", "misses")))
+REGISTRY.register(StatsCollector(
+    "translation_memory",
+    translation_memory_stats.as_dict,
+    counters=("requests", "segments", "hits", "llm_requests", "saved_tokens"),
+))
+REGISTRY.register(StatsCollector(
+    "single_flight", single_flight_stats, counters=("calls", "executed", "coalesced"), label="flight"
+))
+REGISTRY.register(StatsCollector(
+    "llm_scheduler", lambda: llm_scheduler.stats()["models"], counters=("rate_limited",), label="model"
+))
+REGISTRY.register(StatsCollector(
+    "speculation", speculation_stats.as_dict, counters=("requests", "accepted", "rejected", "cancelled", "wasted_tokens")
+))
+REGISTRY.register(StatsCollector(
+    "grammar_patterns", grammar_pattern_extractor.stats, counters=("hits", "misses")
+))
+REGISTRY.register(StatsCollector(
+    "fuzzy_grammar", fuzzy_grammar_lookup.stats, counters=("lookups", "hits", "transliterated")
+))
+REGISTRY.register(StatsCollector(
+    "deadline", deadline_stats.as_dict, counters=("requests", "degraded", "exceeded", *DEGRADATIONS),
+))
+REGISTRY.register(StatsCollector(
+    "circuit_breaker", circuit_breaker_stats, counters=("calls", "failures", "opened", "fallbacks"), label="dependency"
+))
+REGISTRY.register(StatsCollector(
+    "hedging", hedging_stats, counters=("calls", "hedged", "hedge_wins"), label="call_class"
+))
+REGISTRY.register(StatsCollector(
+    "retrieval_cache", retrieval_cache.stats, counters=("hits", "redis_hits", "misses", "qdrant_fetches", "warmed")
+))
+REGISTRY.register(StatsCollector(
+    "docs_compression", compression_stats.as_dict, counters=("calls", "bm25_calls", "tokens_in", "tokens_out")
+))
+REGISTRY.register(StatsCollector("rewrite_cache", rewrite_cache.stats, counters=("hits", "misses")))
+REGISTRY.register(StatsCollector("warmup", warmup_job.as_dict, counters=("completed", "failed")))
+REGISTRY.register(StatsCollector(
+    "embedding_batcher", embedding_batcher.stats, counters=("texts", "batches", "cache_hits")
+))
 
 # INFO: Can be used with the remote cluster
 # qdrant_client = QdrantClient(
@@ -82,23 +193,194 @@ except Exception:
     late_interaction_model = LateInteractionTextEmbedding(config.late_interaction_model)
 
 
+def resolve_pattern(user_prompt: str, local_logfire=logfire) -> str | None:
+    """
+    Grammar pattern of the prompt resolved without the LLM: conjugated forms, then mistyped names
+    """
+    search_query = None
+    if LOCAL_PATTERN_EXTRACTOR:
+        search_query = grammar_pattern_extractor.extract(transliterate_layout(user_prompt))
+        if search_query:
+            local_logfire.info("Local grammar pattern: {pattern}", pattern=search_query)
+
+    if search_query is None and FUZZY_GRAMMAR_LOOKUP:
+        candidates = fuzzy_grammar_lookup.lookup(user_prompt)
+        if candidates:
+            search_query = candidates[0].pattern
+            local_logfire.info(
+                "Fuzzy grammar candidates: {candidates}",
+                candidates=[(candidate.pattern, candidate.distance) for candidate in candidates],
+            )
+    return search_query
+
+
+async def rewrite_query(user_prompt: str) -> str:
+    """
+    Grammar pattern of the prompt by the query rewriter, "None" if it isn't about a grammar
+    """
+    search_query = rewrite_cache.get(user_prompt)
+    if search_query is not None:
+        return search_query
+
+    async def rewrite():
+        response = await query_rewriter_agent.run(
+            user_prompt=user_prompt,
+            usage_limits=UsageLimits(request_limit=2),
+        )
+        return record_usage("query_rewriter", response)
+
+    # INFO: Identical concurrent prompts (e.g. after a class assignment) share a single rewrite
+    search_query = (await query_rewriter_flight.do(normalize_key(user_prompt), rewrite)).output
+    rewrite_cache.put(user_prompt, search_query)
+    return search_query
+
+
+def corpus_grammars(pattern: str) -> list[RetrievedGrammar] | None:
+    """
+    Grammar card of a resolved pattern from the corpus artifact, served while Qdrant is unavailable
+    """
+    # The rewritten query may differ from the display name ("-는 동안" for "-는 동안(에)")
+    grammar_id = corpus_ids_by_pattern.get(pattern) or corpus_ids_by_pattern.get(
+        grammar_pattern_extractor.extract(pattern)
+    )
+    if grammar_id is None:
+        return None
+    return [RetrievedGrammar(id=grammar_id, content=corpus_artifact.entry(grammar_id), score=1.0)]
+
+
+async def warm_prompt(deps: RouterAgentDeps, user_prompt: str) -> None:
+    """
+    Replay the grammar search of a prompt: question embedding, rewrite, retrieval and the card of a single result
+    """
+    await embedding_batcher.embed(openai_client, user_prompt)
+    search_query = resolve_pattern(user_prompt) or await rewrite_query(user_prompt)
+    if search_query == "None":
+        return
+    grammars = await retrieve_grammars_tool(deps, search_query, user_prompt)
+    if grammars and len(grammars) == 1:
+        await grammar_card(grammars[0].id)
+
+
+async def warm_selection(title: str) -> None:
+    """
+    Render the card of a selected grammar, by its "<grammar_name_kr> - <grammar_name_rus>" title
+    """
+    if corpus_artifact:
+        # The artifact cards are pre-rendered
+        return
+    grammar_name_kr = title.split(" - ", 1)[0]
+    with circuit_breakers["qdrant"].guard():
+        points, _ = await qdrant_client.scroll(
+            collection_name=config.qdrant_collection_name_final,
+            scroll_filter=Filter(must=[FieldCondition(key="grammar_name_kr", match=MatchValue(value=grammar_name_kr))]),
+            limit=1,
+            with_payload=False,
+        )
+    if points:
+        await grammar_card(str(points[0].id))
+
+
+async def warm_caches() -> None:
+    """
+    Fill the caches with the most frequent queries of Redis and of the message history, see src.llm_agent.warmup
+    """
+    steps = []
+    deps = RouterAgentDeps(
+        openai_client=openai_client,
+        qdrant_client=qdrant_client,
+        sparse_embedding=sparse_embedding,
+        # INFO: The retrieval doesn't use the session, the history is read with its own
+        session=None,
+        late_interaction_model=late_interaction_model,
+    )
+    try:
+        if RETRIEVAL_CACHE and retrieval_cache.redis is not None:
+            corpus_version = await get_corpus_version(qdrant_client)
+            steps.append(("retrieval", lambda: retrieval_cache.warm(
+                corpus_version, lambda query: retrieve_grammars_for_query(deps, query)
+            )))
+
+        if WARMUP:
+            async with async_session() as session:
+                history = mine_history(await get_recent_message_blob_data(session, WARMUP_HISTORY_BLOBS))
+            logfire.info(
+                "Warm-up: {prompts} prompts and {selections} selections from the history",
+                prompts=len(history.prompts), selections=len(history.selections),
+            )
+            steps += [("prompt", partial(warm_prompt, deps, prompt)) for prompt in history.prompts]
+            steps += [("card", partial(warm_selection, title)) for title in history.selections]
+    except Exception as e:
+        logfire.error(f"Warm-up could not read the query history: {e}")
+
+    # INFO: User requests arriving meanwhile are served before the warm-up calls
+    with llm_priority(Priority.BACKGROUND):
+        await warmup_job.run(steps)
+
+
+@app.on_event("startup")
+async def start_warmup():
+    """Warm the caches in the background, /ready reports the progress"""
+    app.state.warmup = asyncio.create_task(warm_caches())
+
+
 @app.get("/")
 async def root():
     return {"message": "Works"}
 
+
+@app.get("/ready")
+async def ready():
+    """Readiness of the instance: 503 with the progress until the cache warm-up is done or its budget is spent"""
+    return JSONResponse(warmup_job.as_dict(), status_code=200 if warmup_job.ready else 503)
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics of the pipelines, caches and the LLM scheduler"""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.post("/invoke")
+@measure_pipeline("invoke")
 async def process_message(
     message: TelegramMessage,
     background_tasks: BackgroundTasks,
     session: AsyncSession = Depends(get_db),
 ):
+    """
+    Answer a message within REQUEST_DEADLINE_SECONDS, "degradations" lists the steps skipped or
+    downgraded to stay within it
+    """
+    deadline = Deadline(REQUEST_DEADLINE_SECONDS)
+    deadline_stats.requests += 1
+    try:
+        async with deadline.bounded():
+            response = await answer_message(message, background_tasks, session, deadline)
+    except TimeoutError:
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
+
+    response["degradations"] = deadline.degradations
+    return response
+
+
+async def answer_message(
+    message: TelegramMessage,
+    background_tasks: BackgroundTasks,
+    session: AsyncSession,
+    deadline: Deadline,
+) -> dict:
     local_logfire = logfire.with_tags(str(message.user.user_id))
     local_logfire.info(f'User message "{message}"')
 
     mode = "casual_answer"
 
     # IMPORTANT: Check if user is registered
-    allowed_users = await get_user_ids(session)
+    try:
+        with circuit_breakers["postgres"].guard():
+            allowed_users = await get_user_ids(session)
+        known_user_ids.clear()
+        known_user_ids.update(allowed_users)
+    except CircuitOpenError:
+        allowed_users = known_user_ids
     if message.user.user_id not in allowed_users:
         raise HTTPException(status_code=403,
                             detail="User not registered")
@@ -109,47 +391,101 @@ async def process_message(
         sparse_embedding=sparse_embedding,
         # reranking_model=reranking_model,
         session=session,
-        late_interaction_model=late_interaction_model
+        late_interaction_model=late_interaction_model,
+        deadline=deadline,
     )
 
     # Retrieve message history if present
-    message_history = await get_message_history(session, message.user)
-
-    router_agent_response: AgentRunResult = await router_agent.run(
-        user_prompt=message.user_prompt,
-        usage_limits=UsageLimits(request_limit=3),
-        output_type=RouterAgentResult,
-        message_history=message_history[-2:],
-    )
+    history_loaded = True
+    try:
+        with circuit_breakers["postgres"].guard():
+            message_history = await get_message_history(session, message.user)
+    except CircuitOpenError:
+        deadline.degrade("skip_history")
+        message_history = []
+        history_loaded = False
+
+    # INFO: The fused router also extracts the grammar pattern, the query rewriter is skipped
+    fused_routing = ROUTER_MODE == "fused"
+
+    async def route() -> AgentRunResult:
+        # INFO: A router call slower than its recent p95 is duplicated when HEDGED_REQUESTS is set
+        agent = fused_router_agent if fused_routing else router_agent
+        with pipeline_stage("router"):
+            response = await hedged("fused_router" if fused_routing else "router", lambda: agent.run(
+                user_prompt=message.user_prompt,
+                usage_limits=UsageLimits(request_limit=3),
+                output_type=FusedRouterAgentResult if fused_routing else RouterAgentResult,
+                message_history=message_history[-2:],
+            ))
+        return record_usage("fused_router" if fused_routing else "router", response)
+
+    async def search_grammars(search_query: str | None = None) -> tuple[str, list | None]:
+        if search_query is None:
+            search_query = resolve_pattern(message.user_prompt, local_logfire)
+
+        if search_query is None:
+            with pipeline_stage("rewriter"):
+                search_query = await rewrite_query(message.user_prompt)
+            # INFO: Exported as {"prompt", "rewrite"} to measure the local extractor, see src.llm_agent.grammar_patterns
+            local_logfire.info("Rewritten query: {rewrite}", rewrite=search_query, prompt=message.user_prompt)
+
+        if search_query == "None":
+            return search_query, None
+        if not circuit_breakers["qdrant"].available():
+            deadline.degrade("corpus_card")
+            return search_query, corpus_grammars(search_query)
+        grammars = await retrieve_grammars_tool(deps, search_query, message.user_prompt)
+        return search_query, grammars
+
+    grammar_search = None
+    if not circuit_breakers["openai_chat"].available():
+        # INFO: Without the LLM only the grammar patterns resolved locally are answered
+        deadline.degrade("no_router")
+        local_pattern = resolve_pattern(message.user_prompt, local_logfire)
+        if local_pattern is None:
+            deadline.degrade("unavailable")
+            return {"llm_response": UNAVAILABLE_ANSWER, "mode": "unavailable"}
+        router_output = FusedRouterAgentResult(
+            message_type="direct_grammar_search",
+            short_reasoning="Resolved locally, the router is unavailable",
+            grammar_pattern=local_pattern,
+        )
+    elif SPECULATIVE_ROUTING and not fused_routing:
+        # INFO: The grammar search starts with the router and is cancelled for the other message types
+        router_agent_response, grammar_search = await speculate(
+            route(),
+            search_grammars,
+            lambda response: response.output.message_type == "direct_grammar_search",
+        )
+        router_output = router_agent_response.output
+    else:
+        router_output = (await route()).output
 
-    router_answer = f"Сообщение: {message.user_prompt}, тип: {router_agent_response.output.message_type}"
+    router_answer = f"Сообщение: {message.user_prompt}, тип: {router_output.message_type}"
     local_logfire.info(
         "Router agent response: {response}",
         response=router_answer,
     )
 
 
-    if router_agent_response.output.message_type == "direct_grammar_search":
-        query_rewriter_response = await query_rewriter_agent.run(
-            user_prompt=message.user_prompt,
-            usage_limits=UsageLimits(request_limit=2),
-        )
-        local_logfire.info(f"Rewritten query: {query_rewriter_response.output}")
+    if router_output.message_type == "direct_grammar_search":
+        grammar_pattern = router_output.grammar_pattern if isinstance(router_output, FusedRouterAgentResult) else None
+        search_query, retrieved_grammars = grammar_search or await search_grammars(grammar_pattern)
 
-        if query_rewriter_response.output == "None":
+        if search_query == "None":
             # INFO: answer directly if no grammars are found
             mode = "no_grammar"
-            router_agent_response.output.message_type = "thinking_grammar_answer"
+            router_output.message_type = "thinking_grammar_answer"
 
         else:
 
-            retrieved_grammars = await retrieve_grammars_tool(deps, query_rewriter_response.output, message.user_prompt)
             if retrieved_grammars:
 
                 # Provide a single grammar
                 if len(retrieved_grammars) == 1:
                     mode = "single_grammar"
-                    response = {"llm_response": retrieved_grammars, "mode": mode}
+                    response = {"llm_response": [retrieved_grammars[0].content], "mode": mode}
 
                     # Update chat history with user message and a single grammar
                     with local_logfire.span("update_message_history"):
@@ -160,19 +496,36 @@ async def process_message(
 
                         user_message = ModelRequest(parts=[UserPromptPart(content=message.user_prompt)])
 
-                        formatted_response = grammar_entry_to_markdown(response["llm_response"][0].model_dump())
+                        grammar_id = retrieved_grammars[0].id
+                        if corpus_artifact and grammar_id in corpus_artifact:
+                            formatted_response = corpus_artifact.card_html(grammar_id)
+                        else:
+                            formatted_response = grammar_entry_to_markdown(response["llm_response"][0].model_dump())
                         model_response = ModelResponse(parts=[TextPart(content=formatted_response, part_kind="text")])
 
                         new_messages.append(user_message)
                         new_messages.append(model_response)
 
-                        background_tasks.add_task(update_message_history, session, message.user, new_messages)
+                        background_tasks.add_task(timed_task("history_write", update_message_history), session, message.user, new_messages)
                         local_logfire.info(f"new_messages: {new_messages}")
 
                 # Provide multiple grammars
+                # INFO: Only IDs and titles are returned, the bot fetches the full card on selection
                 else:
                     mode = "multiple_grammars"
-                    response = {"llm_response": retrieved_grammars, "mode": mode}
+                    grammar_refs = [
+                        GrammarRef(
+                            id=grammar.id,
+                            grammar_name_kr=grammar.content.grammar_name_kr,
+                            grammar_name_rus=grammar.content.grammar_name_rus,
+                        )
+                        for grammar in retrieved_grammars
+                    ]
+                    response = {
+                        "llm_response": grammar_refs,
+                        "mode": mode,
+                        "corpus_version": await get_corpus_version(qdrant_client),
+                    }
 
                     # Update chat history with user message and grammar choice
                     with local_logfire.span("update_message_history"):
@@ -184,7 +537,7 @@ async def process_message(
                         user_message = ModelRequest(parts=[UserPromptPart(content=message.user_prompt)])
 
                         model_message = f"Найдено {len(retrieved_grammars)} грамматик по вашему запросу. Выберите одну:\n"
-                        for i, grammar in enumerate(retrieved_grammars):
+                        for i, grammar in enumerate(grammar_refs):
                             title = f"{grammar.grammar_name_kr.strip()} - {grammar.grammar_name_rus.strip()}\n"
                             model_message += title
 
@@ -193,17 +546,22 @@ async def process_message(
                         new_messages.append(user_message)
                         new_messages.append(model_response)
 
-                        background_tasks.add_task(update_message_history, session, message.user, new_messages)
+                        background_tasks.add_task(timed_task("history_write", update_message_history), session, message.user, new_messages)
                         local_logfire.info(f"new_messages: {new_messages}")
 
                 return response
 
             else:
                 mode = "no_grammars"
-                router_agent_response.output.message_type = "thinking_grammar_answer"
+                router_output.message_type = "thinking_grammar_answer"
 
 
-    if router_agent_response.output.message_type == "thinking_grammar_answer":
+    # INFO: The answers below need the LLM
+    if not circuit_breakers["openai_chat"].available():
+        deadline.degrade("unavailable")
+        return {"llm_response": UNAVAILABLE_ANSWER, "mode": "unavailable"}
+
+    if router_output.message_type == "thinking_grammar_answer":
 
         # # Retrieval
         # retrieved_docs: list[RetrievedDoc | None] = await retrieve_docs_tool(
@@ -215,37 +573,67 @@ async def process_message(
 
         # Generation
         # TODO: Проверить Dependencies system_prompt
-        thinking_grammar_response = await thinking_grammar_agent.run(
-            user_prompt=message.user_prompt,
-            deps=deps,
-            usage_limits=UsageLimits(request_limit=2),
-            message_history=message_history,
-        )
-        local_logfire.info("Thinking agent response: {response}", response=thinking_grammar_response.output, _tags=[""])
+        # INFO: First-turn questions don't depend on the history, so their answers are shared between users.
+        # Without the history a follow-up can't be told from a first turn, the cache is skipped
+        cached_answer = None
+        use_answer_cache = history_loaded and not message_history
+        if use_answer_cache and not circuit_breakers["openai_embeddings"].available():
+            deadline.degrade("skip_answer_cache")
+            use_answer_cache = False
+        if use_answer_cache:
+            corpus_version = await get_corpus_version(qdrant_client)
+            with pipeline_stage("embed"):
+                question_embedding = await answer_cache.embed(openai_client, message.user_prompt)
+            cached_answer, similarity = answer_cache.lookup(question_embedding, corpus_version)
+            local_logfire.info(
+                "Answer cache {result}: similarity {similarity:.3f}",
+                result="hit" if cached_answer else "miss",
+                similarity=similarity,
+            )
+
+        if cached_answer:
+            thinking_grammar_answer = cached_answer.answer
+        else:
+            with pipeline_stage("generation"):
+                thinking_grammar_response = await thinking_grammar_agent.run(
+                    user_prompt=message.user_prompt,
+                    deps=deps,
+                    usage_limits=UsageLimits(request_limit=2),
+                    message_history=message_history,
+                )
+            record_usage("thinking_grammar", thinking_grammar_response)
+            thinking_grammar_answer = thinking_grammar_response.output
+
+            if use_answer_cache:
+                answer_cache.put(message.user_prompt, thinking_grammar_answer, question_embedding, corpus_version)
+
+        local_logfire.info("Thinking agent response: {response}", response=thinking_grammar_answer, _tags=[""])
 
         # Update chat history with new messages
         with local_logfire.span("update_message_history"):
             user_message = ModelRequest(parts=[UserPromptPart(content=message.user_prompt)])
-            model_response = ModelResponse(parts=[TextPart(content=thinking_grammar_response.output)])
+            model_response = ModelResponse(parts=[TextPart(content=thinking_grammar_answer)])
 
             # new_messages = thinking_grammar_response.new_messages()
             new_messages = [user_message, model_response]
-            background_tasks.add_task(update_message_history, session, message.user, new_messages)
+            background_tasks.add_task(timed_task("history_write", update_message_history), session, message.user, new_messages)
             local_logfire.info(f"new_messages: {new_messages}")
 
         # "mode" will be "no_grammar" only if message type was converted from direct_grammar_search
         if not mode == "no_grammars":
             mode = "thinking_grammar_answer"
 
-        return {"llm_response": thinking_grammar_response.output, "mode": mode}
-
-    if router_agent_response.output.message_type == "casual_answer":
-        casual_response = await system_agent.run(
-            user_prompt=message.user_prompt,
-            usage_limits=UsageLimits(request_limit=2),
-            output_type=str,
-            message_history=message_history,
-        )
+        return {"llm_response": thinking_grammar_answer, "mode": mode}
+
+    if router_output.message_type == "casual_answer":
+        with pipeline_stage("generation"):
+            casual_response = await system_agent.run(
+                user_prompt=message.user_prompt,
+                usage_limits=UsageLimits(request_limit=2),
+                output_type=str,
+                message_history=message_history,
+            )
+        record_usage("system", casual_response)
         local_logfire.info("System agent response: {response}", response=casual_response.output)
 
         with local_logfire.span("update_message_history"):
@@ -255,7 +643,7 @@ async def process_message(
             # new_messages = casual_response.new_messages()
             new_messages = [user_message, model_response]
 
-            background_tasks.add_task(update_message_history, session, message.user, new_messages)
+            background_tasks.add_task(timed_task("history_write", update_message_history), session, message.user, new_messages)
             local_logfire.info(f"new_messages: {new_messages}")
 
         mode = "casual_answer"
@@ -263,11 +651,12 @@ async def process_message(
 
 
     else:
-        local_logfire.error(f"Unknown message type: {router_agent_response.output.message_type}")
+        local_logfire.error(f"Unknown message type: {router_output.message_type}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
 @app.post("/translate")
+@measure_pipeline("translate")
 async def translate_message(
     message: TelegramMessage,
     session: AsyncSession = Depends(get_db)
@@ -282,21 +671,109 @@ async def translate_message(
         raise HTTPException(status_code=403, detail="User not registered")
 
     try:
-        translation_response = await translation_agent.run(
-            user_prompt=message.user_prompt,
-            usage_limits=UsageLimits(request_limit=2),
-        )
-        
-        local_logfire.info("Translation response: {response}", response=translation_response.output)
+        # INFO: Only sentences missing in the translation memory are sent to the LLM
+        with pipeline_stage("generation"):
+            translation, report = await translate_with_memory(session, translation_agent, message.user_prompt)
+
+        local_logfire.info("Translation response: {response}", response=translation)
 
-        return {"translation": translation_response.output}
+        return {"translation": translation, "translation_memory": report}
 
     except Exception as e:
         local_logfire.error(f"Translation error: {e}")
         raise HTTPException(status_code=500, detail="Translation service error")
 
 
+@app.post("/translate/stream")
+async def translate_message_stream(
+    message: TelegramMessage,
+    session: AsyncSession = Depends(get_db)
+):
+    """
+    Translate long texts in parts, streamed as NDJSON lines in order:
+    {"text": ...} for every translated part, then {"translation_memory": ...} or {"error": ...}
+    """
+    local_logfire = logfire.with_tags(str(message.user.user_id))
+    local_logfire.info(f'Streamed translation request: "{message.user_prompt}"')
+
+    allowed_users = await get_user_ids(session)
+    if message.user.user_id not in allowed_users:
+        raise HTTPException(status_code=403, detail="User not registered")
+
+    async def stream_parts():
+        # INFO: The request session is closed before the response is streamed, so the stream uses its own
+        async with async_session() as stream_session:
+            translation = ChunkedTranslation(stream_session, translation_agent, message.user_prompt)
+            try:
+                async for part in translation.stream():
+                    yield json.dumps({"text": part}, ensure_ascii=False) + "\n"
+                yield json.dumps({"translation_memory": translation.report}) + "\n"
+            except Exception as e:
+                local_logfire.error(f"Translation error: {e}")
+                yield json.dumps({"error": "Translation service error"}) + "\n"
+
+    return StreamingResponse(stream_parts(), media_type="application/x-ndjson")
+
+
+@app.get("/translate/stats")
+async def translation_stats(session: AsyncSession = Depends(get_db)):
+    """Translation memory hit rate and saved tokens, for this process and in total"""
+    return {
+        "process": translation_memory_stats.as_dict(),
+        "total": await get_translation_memory_stats(session),
+    }
+
+
+@app.get("/single-flight/stats")
+async def coalescing_stats():
+    """Number of retrieval and LLM calls collapsed into in-flight identical calls, since the start of the process"""
+    return single_flight_stats()
+
+
+@app.get("/speculation/stats")
+async def speculation_stats_endpoint():
+    """Tokens wasted on rejected speculative grammar searches against the latency saved on the accepted ones"""
+    return speculation_stats.as_dict()
+
+
+@app.get("/deadline/stats")
+async def deadline_stats_endpoint():
+    """Requests degraded to stay within their deadline, per degradation, and requests over it"""
+    return deadline_stats.as_dict()
+
+
+@app.get("/circuit-breakers/stats")
+async def circuit_breakers_stats():
+    """State, failures and requests served by the fallbacks of the circuit breaker of every dependency"""
+    return circuit_breaker_stats()
+
+
+@app.get("/hedging/stats")
+async def hedging_stats_endpoint():
+    """Hedged calls per call class, with their p99 latency against the p99 of the first attempts"""
+    return hedging_stats()
+
+
+@app.get("/retrieval-cache/stats")
+async def retrieval_cache_stats():
+    """Grammar retrievals served from the process cache or from Redis, and queries warmed on startup"""
+    return retrieval_cache.stats()
+
+
+@app.get("/docs-compression/stats")
+async def docs_compression_stats():
+    """Tokens of the lessons retrieved by the thinking agent before and after their compression"""
+    return compression_stats.as_dict()
+
+
+@app.get("/llm-scheduler/stats")
+async def llm_scheduler_stats():
+    """Concurrency limits, queues and queue wait times of the OpenAI calls per model and priority"""
+    return {**llm_scheduler.stats(), "embedding_batches": embedding_batcher.stats()}
+
+
 @app.post("/conversation")
+@measure_pipeline("conversation")
 async def conversation_message(
     message: TelegramMessage,
     background_tasks: BackgroundTasks,
@@ -311,15 +788,18 @@ async def conversation_message(
     if message.user.user_id not in allowed_users:
         raise HTTPException(status_code=403, detail="User not registered")
 
-    # Get message history for context
-    message_history = await get_message_history(session, message.user)
+    # INFO: Recent turns within the token budget, older ones are replaced by a rolling summary
+    with pipeline_stage("context"):
+        context = await build_context(session, message.user.user_id, CONTEXT_TOKEN_BUDGETS["conversation"])
 
     try:
-        conversation_response = await conversation_agent.run(
-            user_prompt=message.user_prompt,
-            usage_limits=UsageLimits(request_limit=2),
-            message_history=message_history,
-        )
+        with pipeline_stage("generation"):
+            conversation_response = await conversation_agent.run(
+                user_prompt=message.user_prompt,
+                usage_limits=UsageLimits(request_limit=2),
+                message_history=context.messages,
+            )
+        record_usage("conversation", conversation_response)
         
         local_logfire.info("Conversation response: {response}", response=conversation_response.output)
 
@@ -329,7 +809,8 @@ async def conversation_message(
             model_response = ModelResponse(parts=[TextPart(content=conversation_response.output)])
             
             new_messages = [user_message, model_response]
-            background_tasks.add_task(update_message_history, session, message.user, new_messages)
+            background_tasks.add_task(timed_task("history_write", update_message_history), session, message.user, new_messages)
+            background_tasks.add_task(update_summary, session, message.user.user_id, context)
             local_logfire.info(f"new_messages: {new_messages}")
 
         return {"response": conversation_response.output}
@@ -339,6 +820,7 @@ async def conversation_message(
         raise HTTPException(status_code=500, detail="Conversation service error")
 
 @app.post("/learning")
+@measure_pipeline("learning")
 async def learning_message(
         message: TelegramMessage,
         background_tasks: BackgroundTasks,
@@ -353,15 +835,18 @@ async def learning_message(
     if message.user.user_id not in allowed_users:
         raise HTTPException(status_code=403, detail="User not registered")
 
-    # Get message history for context
-    message_history = await get_message_history(session, message.user)
+    # INFO: Recent turns within the token budget, older ones are replaced by a rolling summary
+    with pipeline_stage("context"):
+        context = await build_context(session, message.user.user_id, CONTEXT_TOKEN_BUDGETS["learning"])
 
     try:
-        learning_response = await learning_agent.run(
-            user_prompt=message.user_prompt,
-            usage_limits=UsageLimits(request_limit=2),
-            message_history=message_history,
-        )
+        with pipeline_stage("generation"):
+            learning_response = await learning_agent.run(
+                user_prompt=message.user_prompt,
+                usage_limits=UsageLimits(request_limit=2),
+                message_history=context.messages,
+            )
+        record_usage("learning", learning_response)
 
         local_logfire.info("Learning response: {response}", response=learning_response.output)
 
@@ -371,7 +856,8 @@ async def learning_message(
             model_response = ModelResponse(parts=[TextPart(content=learning_response.output)])
 
             new_messages = [user_message, model_response]
-            background_tasks.add_task(update_message_history, session, message.user, new_messages)
+            background_tasks.add_task(timed_task("history_write", update_message_history), session, message.user, new_messages)
+            background_tasks.add_task(update_summary, session, message.user.user_id, context)
             local_logfire.info(f"new_messages: {new_messages}")
 
         return {"response": learning_response.output}
@@ -0,0 +1,62 @@
+import os
+import secrets
+
+import logfire
+from fastapi import APIRouter, Depends, Header, HTTPException
+
+from src.llm_agent.answer_cache import answer_cache
+
+local_logfire = logfire.with_tags("answer-cache")
+
+# Shared secret of the API and the bot, without it the answer cache endpoints are disabled
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN", "")
+
+
+async def verify_admin(x_admin_token: str | None = Header(default=None)) -> None:
+    """
+    The cached questions are user prompts: only the bot may list or purge them, for the admins running
+    /answercache. The token only authenticates the bot, the API must stay on the internal network.
+    """
+    if not ADMIN_API_TOKEN or not secrets.compare_digest((x_admin_token or "").encode(), ADMIN_API_TOKEN.encode()):
+        local_logfire.warning("Answer cache access denied: missing or invalid admin token")
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+
+router = APIRouter(prefix="/answer-cache", tags=["answer-cache"], dependencies=[Depends(verify_admin)])
+
+
+@router.get("")
+async def inspect_answer_cache(limit: int = 20):
+    """Return the cache statistics and the most recently used entries"""
+    return {
+        "stats": answer_cache.stats(),
+        "entries": [
+            {
+                "id": entry.entry_id,
+                "question": entry.question,
+                "answer_preview": entry.answer[:200],
+                "corpus_version": entry.corpus_version,
+                "created_at": entry.created_at,
+                "hits": entry.hits,
+            }
+            for entry in answer_cache.entries()[:limit]
+        ],
+    }
+
+
+@router.delete("")
+async def purge_answer_cache():
+    """Remove all cached answers"""
+    removed = answer_cache.purge()
+    local_logfire.info(f"Purged {removed} cached answers")
+    return {"removed": removed}
+
+
+@router.delete("/{entry_id}")
+async def purge_answer_cache_entry(entry_id: str):
+    """Remove a single cached answer by its ID"""
+    if not answer_cache.purge(entry_id):
+        raise HTTPException(status_code=404, detail="Entry not found")
+
+    local_logfire.info(f"Purged cached answer {entry_id}")
+    return {"removed": 1}
@@ -5,15 +5,25 @@ from pydantic_ai.usage import UsageLimits
 
 from src.api.evaluation.eval_retrieve_grammars_tool import hybrid_retrieve_grammars, keyword_retrieve_grammars, \
     dense_retrieve_grammars
+from src.api.evaluation.docs_compression import evaluate_docs_compression
+from src.api.evaluation.router_fusion import evaluate_router_fusion
 from src.api.evaluation.strategies import STRATEGY_MAP, RagEvaluationStrategy, hyde_direct
 from src.config.settings import Config
 from src.db.crud import get_user_ids
 from src.db.database import get_db
 from src.llm_agent.agent import query_rewriter_agent
 from src.llm_agent.agent_tools import retrieve_grammars_tool
+from src.llm_agent.llm_scheduler import Priority, llm_priority
 from src.schemas.schemas import RouterAgentDeps, TelegramMessage
 
-router = APIRouter(prefix="/evaluate", tags=["evaluation"])
+
+async def evaluation_llm_priority():
+    """Queue the LLM calls of the evaluation runs behind the interactive traffic"""
+    with llm_priority(Priority.EVALUATION):
+        yield
+
+
+router = APIRouter(prefix="/evaluate", tags=["evaluation"], dependencies=[Depends(evaluation_llm_priority)])
 
 config = Config()
 
@@ -152,4 +162,35 @@ async def direct_search_eval(user_prompt: str, strategy: str):
 
         local_logfire.info(f"Final Retrieved Grammar List: {retrieved_grammars}")
 
-        return retrieved_grammars
\ No newline at end of file
+        return retrieved_grammars
+
+
+@router.post("/router_fusion")
+async def router_fusion_eval():
+    """
+    Compare the fused router with router + query rewriter: classification agreement, pattern accuracy, latency
+    """
+    with local_logfire.span("Router fusion evaluation"):
+        report = await evaluate_router_fusion()
+        local_logfire.info(f"Router fusion report: {report}")
+        return report
+
+
+@router.post("/docs_compression")
+async def docs_compression_eval(session: AsyncSession = Depends(get_db)):
+    """
+    Compare the thinking agent with the full and the compressed lessons: prompt tokens, latency, answer similarity
+    """
+    from src.api.main import openai_client, qdrant_client, sparse_embedding, late_interaction_model
+
+    deps = RouterAgentDeps(
+        openai_client=openai_client,
+        qdrant_client=qdrant_client,
+        sparse_embedding=sparse_embedding,
+        late_interaction_model=late_interaction_model,
+        session=session,
+    )
+    with local_logfire.span("Docs compression evaluation"):
+        report = await evaluate_docs_compression(deps)
+        local_logfire.info(f"Docs compression report: {report}")
+        return report
@@ -0,0 +1,74 @@
+import os
+from collections import OrderedDict
+
+import logfire
+from fastapi import APIRouter, HTTPException
+
+from src.config.settings import Config
+from src.llm_agent.corpus import get_corpus_version
+from src.schemas.schemas import GrammarEntryV2
+from src.utils.json_to_telegram_md import grammar_entry_to_markdown
+
+router = APIRouter(prefix="/grammars", tags=["grammars"])
+
+config = Config()
+
+local_logfire = logfire.with_tags("grammars")
+
+RENDERED_CARDS_MAX_SIZE = int(os.getenv("RENDERED_CARDS_MAX_SIZE", "1024"))
+
+# INFO: Cards of the grammars missing from the corpus artifact or re-indexed since it was built,
+# rendered once per (corpus_version, grammar_id)
+rendered_cards: OrderedDict[tuple[str, str], dict] = OrderedDict()
+
+
+async def grammar_card(grammar_id: str) -> dict | None:
+    """
+    Grammar entry and its rendered card, from the corpus artifact if it was built from the current corpus
+    or from Qdrant. None if there is no such grammar
+    """
+    from src.api.main import qdrant_client, corpus_artifact
+
+    corpus_version = await get_corpus_version(qdrant_client)
+    if corpus_artifact and corpus_artifact.corpus_version == corpus_version and grammar_id in corpus_artifact:
+        return {
+            "grammar": corpus_artifact.entry(grammar_id),
+            "card_html": corpus_artifact.card_html(grammar_id),
+            "corpus_version": corpus_version,
+        }
+
+    key = (corpus_version, grammar_id)
+    if key in rendered_cards:
+        rendered_cards.move_to_end(key)
+        return rendered_cards[key]
+
+    points = await qdrant_client.retrieve(
+        collection_name=config.qdrant_collection_name_final,
+        ids=[grammar_id],
+        with_payload=True,
+        with_vectors=False,
+    )
+    if not points:
+        return None
+
+    grammar = GrammarEntryV2(**points[0].payload)
+    card = {
+        "grammar": grammar,
+        "card_html": grammar_entry_to_markdown(grammar.model_dump()),
+        "corpus_version": key[0],
+    }
+    rendered_cards[key] = card
+    while len(rendered_cards) > RENDERED_CARDS_MAX_SIZE:
+        rendered_cards.popitem(last=False)
+    return card
+
+
+@router.get("/{grammar_id}")
+async def get_grammar(grammar_id: str):
+    """Return a full grammar entry by its ID and its rendered card, together with the current corpus version"""
+    card = await grammar_card(grammar_id)
+    if card is None:
+        local_logfire.warning(f"Grammar {grammar_id} not found")
+        raise HTTPException(status_code=404, detail="Grammar not found")
+
+    return card
@@ -0,0 +1,349 @@
+"""
+Synthetic Telegram load for the API.
+
+Replays a mix of TelegramMessage requests (direct grammar lookups, thinking questions, translations
+and conversation turns) with Poisson arrivals at a fixed rate, so the load doesn't slow down when the
+API does. Every rate of the run produces a JSON report with the throughput, the error rate and the
+latency percentiles overall, per scenario and per /invoke mode.
+
+The target is pluggable: a running API (--url), the API app in-process (--app, point it at the
+OpenAI stub and local Qdrant/Postgres), or a simulated API (--simulate) to check the generator itself.
+The messages must come from registered users, see --user-ids.
+
+Usage:
+    python -m src.benchmarks.load_generator --url http://localhost:8000 --rates 1,2,4,8 --duration 60
+    python -m src.benchmarks.load_generator --app --rates 5 --duration 30 --output report.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from dataclasses import dataclass
+from typing import Protocol
+
+import httpx
+
+from src.schemas.schemas import TelegramMessage, TelegramUser
+
+
+@dataclass
+class Scenario:
+    """
+    A kind of user message and the endpoint it is sent to
+    """
+    name: str
+    endpoint: str
+    prompts: list[str]
+
+
+SCENARIOS = {
+    scenario.name: scenario
+    for scenario in [
+        Scenario("direct_grammar", "/invoke", [
+            "грамматика -는데",
+            "아/어 보이다",
+            "объясни грамматику -(으)면",
+            "будущее время в корейском",
+            "-고 싶다",
+            "грамматика 이/가",
+            "что значит -아/어서",
+            "-(으)ㄹ 수 있다",
+        ]),
+        Scenario("thinking", "/invoke", [
+            "разница между 은/는 и 이/가",
+            "когда использовать 을, а когда 를?",
+            "почему в 먹었어요 используется 었?",
+            "примеры использования 는데 в разговорной речи",
+            "чем отличается -아서 от -니까?",
+        ]),
+        Scenario("translation", "/translate", [
+            "Я изучаю корейский язык уже два года.",
+            "저는 내일 친구를 만날 거예요. 같이 영화를 볼 거예요.",
+            "Как пройти до ближайшей станции метро?",
+            "한국 음식 중에서 뭘 제일 좋아해요?",
+        ]),
+        Scenario("conversation", "/conversation", [
+            "안녕하세요! 오늘 날씨가 어때요?",
+            "저는 주말에 등산을 했어요.",
+            "한국에 가 본 적이 있어요?",
+            "요즘 무슨 드라마를 봐요?",
+        ]),
+    ]
+}
+
+DEFAULT_MIX = {"direct_grammar": 0.4, "thinking": 0.3, "translation": 0.15, "conversation": 0.15}
+
+LOAD_TEST_USER_IDS = os.getenv("LOAD_TEST_USER_IDS", "")
+
+
+@dataclass
+class RequestResult:
+    """
+    Outcome of a single request of the run
+    """
+    scenario: str
+    mode: str
+    status: int
+    latency: float
+    error: str | None = None
+
+
+class Target(Protocol):
+    async def post(self, endpoint: str, payload: dict) -> tuple[int, dict | None]:
+        """Send the payload, return the status code and the JSON response"""
+
+
+class HttpTarget:
+    """
+    The API over HTTP, or in-process through its ASGI app
+
+    Args:
+        base_url: URL of the API
+        transport: Alternative transport, e.g. httpx.ASGITransport(app)
+        timeout: Seconds before a request is counted as failed
+    """
+
+    def __init__(self, base_url: str, transport: httpx.AsyncBaseTransport | None = None, timeout: float = 120):
+        self.client = httpx.AsyncClient(base_url=base_url, transport=transport, timeout=timeout)
+
+    @classmethod
+    def in_process(cls, app, timeout: float = 120) -> "HttpTarget":
+        return cls("http://api", transport=httpx.ASGITransport(app=app), timeout=timeout)
+
+    async def post(self, endpoint: str, payload: dict) -> tuple[int, dict | None]:
+        response = await self.client.post(endpoint, json=payload)
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, None
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+class SimulatedTarget:
+    """
+    Stand-in for the API with log-normal latencies per endpoint and random failures
+
+    Args:
+        latencies: Median latency in seconds per endpoint
+        sigma: Spread of the log-normal latency distribution
+        error_rate: Share of the requests failing with a 500
+        seed: Seed of the random generator
+    """
+
+    def __init__(
+            self,
+            latencies: dict[str, float] | None = None,
+            sigma: float = 0.5,
+            error_rate: float = 0.0,
+            seed: int | None = None,
+    ):
+        self.latencies = latencies or {"/invoke": 2.0, "/translate": 1.5, "/conversation": 1.5}
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+
+    async def post(self, endpoint: str, payload: dict) -> tuple[int, dict | None]:
+        median = self.latencies.get(endpoint, 1.0)
+        await asyncio.sleep(median * self._random.lognormvariate(0, self.sigma))
+        if self._random.random() < self.error_rate:
+            return 500, {"detail": "Internal Server Error"}
+        if endpoint == "/invoke":
+            mode = "thinking_grammar_answer" if len(payload["user_prompt"]) > 25 else "single_grammar"
+            return 200, {"llm_response": "...", "mode": mode}
+        return 200, {"response": "..."}
+
+    async def aclose(self) -> None:
+        pass
+
+
+def build_message(scenario: Scenario, user_id: int, rng: random.Random) -> dict:
+    user = TelegramUser(
+        user_id=user_id,
+        username="load_test",
+        first_name="Load",
+        last_name="Test",
+        chat_id=user_id,
+    )
+    return TelegramMessage(user=user, user_prompt=rng.choice(scenario.prompts)).model_dump()
+
+
+async def send(target: Target, scenario: Scenario, payload: dict) -> RequestResult:
+    started = time.perf_counter()
+    try:
+        status, body = await target.post(scenario.endpoint, payload)
+    except Exception as e:
+        return RequestResult(scenario.name, scenario.name, 0, time.perf_counter() - started, type(e).__name__)
+
+    latency = time.perf_counter() - started
+    mode = body.get("mode", scenario.name) if isinstance(body, dict) else scenario.name
+    error = None if status < 400 else f"HTTP {status}"
+    return RequestResult(scenario.name, mode, status, latency, error)
+
+
+async def run_load(
+        target: Target,
+        rate: float,
+        duration: float,
+        user_ids: list[int],
+        mix: dict[str, float] = None,
+        seed: int | None = None,
+) -> list[RequestResult]:
+    """
+    Send requests with Poisson arrivals at `rate` per second for `duration` seconds, then wait for all of them
+
+    Args:
+        target: API to load
+        rate: Mean number of requests per second
+        duration: Seconds during which new requests are started
+        user_ids: Registered users the messages are sent from
+        mix: Share of each scenario in the requests
+        seed: Seed for reproducible arrivals and messages
+    """
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed)
+    scenarios = [SCENARIOS[name] for name in mix]
+    weights = list(mix.values())
+
+    tasks = []
+    started = time.perf_counter()
+    next_arrival = 0.0
+    while True:
+        next_arrival += rng.expovariate(rate)
+        if next_arrival >= duration:
+            break
+        await asyncio.sleep(max(0.0, started + next_arrival - time.perf_counter()))
+
+        scenario = rng.choices(scenarios, weights)[0]
+        payload = build_message(scenario, rng.choice(user_ids), rng)
+        tasks.append(asyncio.create_task(send(target, scenario, payload)))
+
+    return list(await asyncio.gather(*tasks))
+
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    Nearest-rank percentile of sorted values
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))]
+
+
+def summarize(results: list[RequestResult], duration: float) -> dict:
+    """
+    Throughput, error rate and latency percentiles (ms) of the successful requests
+    """
+    latencies = sorted(result.latency * 1000 for result in results if result.error is None)
+    errors = sum(1 for result in results if result.error is not None)
+
+    statuses: dict[str, int] = {}
+    for result in results:
+        key = result.error if result.status == 0 else str(result.status)
+        statuses[key] = statuses.get(key, 0) + 1
+
+    return {
+        "requests": len(results),
+        "errors": errors,
+        "error_rate": round(errors / len(results), 4) if results else 0.0,
+        "throughput_rps": round((len(results) - errors) / duration, 3),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 1),
+            "p90": round(percentile(latencies, 90), 1),
+            "p95": round(percentile(latencies, 95), 1),
+            "p99": round(percentile(latencies, 99), 1),
+            "max": round(latencies[-1], 1) if latencies else 0.0,
+        },
+        "statuses": statuses,
+    }
+
+
+def build_report(results: list[RequestResult], rate: float, duration: float) -> dict:
+    """
+    Summary of a run overall, per scenario and per /invoke mode
+    """
+    def grouped(key: str) -> dict:
+        groups: dict[str, list[RequestResult]] = {}
+        for result in results:
+            groups.setdefault(getattr(result, key), []).append(result)
+        return {name: summarize(group, duration) for name, group in sorted(groups.items())}
+
+    return {
+        "rate": rate,
+        "duration": duration,
+        "total": summarize(results, duration),
+        "scenarios": grouped("scenario"),
+        "modes": grouped("mode"),
+    }
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    """
+    Parse "direct_grammar=0.5,thinking=0.5" into a mix of scenarios
+    """
+    mix = {}
+    for item in value.split(","):
+        name, weight = item.split("=", 1)
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Unknown scenario {name!r}, expected one of {list(SCENARIOS)}")
+        mix[name] = float(weight)
+    return mix
+
+
+async def main(args: argparse.Namespace) -> list[dict]:
+    if args.simulate:
+        target = SimulatedTarget(error_rate=args.simulated_error_rate, seed=args.seed)
+    elif args.app:
+        from src.api.main import app
+
+        target = HttpTarget.in_process(app, timeout=args.timeout)
+    else:
+        target = HttpTarget(args.url, timeout=args.timeout)
+
+    user_ids = [int(user_id) for user_id in args.user_ids.split(",") if user_id]
+
+    reports = []
+    try:
+        for rate in args.rates:
+            results = await run_load(target, rate, args.duration, user_ids, args.mix, args.seed)
+            report = build_report(results, rate, args.duration)
+            reports.append(report)
+            total = report["total"]
+            print(
+                f"{rate:g} rps: {total['throughput_rps']:g} rps served, {total['error_rate']:.1%} errors, "
+                f"p50 {total['latency_ms']['p50']:g} ms, p99 {total['latency_ms']['p99']:g} ms",
+                file=sys.stderr,
+            )
+    finally:
+        await target.aclose()
+
+    return reports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay synthetic Telegram messages against the API")
+    targets = parser.add_mutually_exclusive_group()
+    targets.add_argument("--url", default=f"http://{os.getenv('FASTAPI_HOST', 'localhost')}:{os.getenv('FASTAPI_PORT', '8000')}")
+    targets.add_argument("--app", action="store_true", help="Run the API app in-process")
+    targets.add_argument("--simulate", action="store_true", help="Use a simulated API")
+    parser.add_argument("--rates", type=lambda value: [float(rate) for rate in value.split(",")], default=[1.0],
+                        help="Comma-separated request rates per second, run one after another")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds per rate")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="e.g. direct_grammar=0.5,thinking=0.5")
+    parser.add_argument("--user-ids", default=LOAD_TEST_USER_IDS or "1", help="Comma-separated registered user IDs")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--simulated-error-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="Write the JSON reports to this file instead of stdout")
+    args = parser.parse_args()
+
+    reports = asyncio.run(main(args))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(reports, file, indent=2, ensure_ascii=False)
+    else:
+        print(json.dumps(reports, indent=2, ensure_ascii=False))
@@ -0,0 +1,477 @@
+"""
+Local stand-in for the OpenAI API, for hermetic benchmarks and tests.
+
+Implements the endpoints used by pydantic-ai and AsyncOpenAI:
+- /v1/chat/completions: text answers, structured outputs and tool calls (arguments generated from the
+  JSON schema of the tool), streamed at a fixed token rate when asked to;
+- /v1/embeddings: unit vectors derived from the hash of the text.
+
+Responses are deterministic: the same request always gets the same answer. Canned answers can be
+given per prompt pattern (--responses), and real responses can be recorded once through the upstream
+API (--recordings with --record) and replayed afterwards. Latencies follow a log-normal distribution,
+and 429/500 faults can be injected at random or by a requests-per-minute limit.
+
+Point the API at it with USE_OPENAI_STUB=true and OPENAI_STUB_URL.
+
+Usage:
+    python -m src.benchmarks.openai_stub --port 8100 --latency 0.8 --tokens-per-second 80 --rate-limit-rate 0.02
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+import uuid
+from dataclasses import dataclass, field
+
+import httpx
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+EMBEDDING_DIMENSIONS = {"text-embedding-3-large": 3072, "text-embedding-3-small": 1536, "text-embedding-ada-002": 1536}
+
+# Words of the generated text answers
+FILLER_WORDS = (
+    "грамматика используется когда говорящий хочет выразить намерение например 저는 내일 학교에 갈 거예요 "
+    "эта конструкция присоединяется к основе глагола и часто встречается в разговорной речи"
+).split()
+
+# Outputs of pydantic-ai, the other tools are tools of the agent
+FINAL_RESULT_TOOL = "final_result"
+
+
+@dataclass
+class StubConfig:
+    """
+    Behaviour of the stub
+
+    Args:
+        latency: Median seconds before the first token
+        latency_sigma: Spread of the log-normal latency distribution
+        tokens_per_second: Output rate of the completions
+        completion_tokens: Length of the generated text answers
+        embedding_latency: Median seconds of an embeddings request
+        rate_limit_rate: Share of the requests answered with a 429
+        error_rate: Share of the requests answered with a 500
+        requests_per_minute: Requests allowed per minute before answering with 429, 0 for no limit
+        call_tools: Call the agent tools once before giving the final result
+        responses: Canned answers, {"match": regex on the last user message, "content" or "arguments"}
+        recordings_path: File of the recorded responses, by request hash
+        record: Forward the requests missing in the recordings to the upstream API and record them
+        upstream_url: Upstream API for the recording
+        seed: Seed of the latencies and the faults
+    """
+    latency: float = 0.5
+    latency_sigma: float = 0.3
+    tokens_per_second: float = 100.0
+    completion_tokens: int = 150
+    embedding_latency: float = 0.05
+    rate_limit_rate: float = 0.0
+    error_rate: float = 0.0
+    requests_per_minute: int = 0
+    call_tools: bool = True
+    responses: list[dict] = field(default_factory=list)
+    recordings_path: str | None = None
+    record: bool = False
+    upstream_url: str = "https://api.openai.com/v1"
+    seed: int | None = None
+
+
+def request_hash(body: dict) -> str:
+    return hashlib.sha256(json.dumps(body, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def count_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def last_user_message(messages: list[dict]) -> str:
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            content = message.get("content")
+            if isinstance(content, list):
+                return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+            return content or ""
+    return ""
+
+
+def generate_text(seed: str, tokens: int) -> str:
+    rng = random.Random(seed)
+    return " ".join(rng.choice(FILLER_WORDS) for _ in range(max(1, tokens // 2)))
+
+
+def trailing_json_list(text: str) -> list | None:
+    """
+    The JSON list at the end of a prompt, e.g. the sentences of a translation request
+    """
+    start = text.rfind("\n[")
+    if start == -1:
+        start = 0 if text.startswith("[") else -1
+    if start == -1:
+        return None
+    try:
+        value = json.loads(text[start:])
+    except ValueError:
+        return None
+    return value if isinstance(value, list) else None
+
+
+class SchemaSampler:
+    """
+    Deterministic JSON values valid for a JSON schema, seeded by the prompt
+
+    Args:
+        schema: Root schema, with its $defs
+        prompt: Last user message, used for the seed and the string arguments
+    """
+
+    def __init__(self, schema: dict, prompt: str):
+        self.definitions = schema.get("$defs", {})
+        self.prompt = prompt
+        self.random = random.Random(prompt)
+
+    def sample(self, schema: dict):
+        if "$ref" in schema:
+            return self.sample(self.definitions[schema["$ref"].split("/")[-1]])
+        if "const" in schema:
+            return schema["const"]
+        if "enum" in schema:
+            return self.random.choice(schema["enum"])
+        for key in ("anyOf", "oneOf"):
+            if key in schema:
+                options = [option for option in schema[key] if option.get("type") != "null"] or schema[key]
+                return self.sample(options[0])
+
+        schema_type = schema.get("type", "object")
+        if schema_type == "object":
+            return {name: self.sample(prop) for name, prop in schema.get("properties", {}).items()}
+        if schema_type == "array":
+            items = schema.get("items", {})
+            if items.get("type") == "integer":
+                # Usually indexes into a list of the prompt, the first one always exists
+                return [0]
+            # As many items as the list in the prompt, e.g. one translation per sentence
+            source = trailing_json_list(self.prompt)
+            length = len(source) if source is not None else 1
+            return [self.sample(items) for _ in range(length)]
+        if schema_type == "string":
+            return generate_text(f"{self.prompt}{self.random.random()}", 12)
+        if schema_type == "integer":
+            return 0
+        if schema_type == "number":
+            return 0.0
+        if schema_type == "boolean":
+            return True
+        return None
+
+
+class TokenBucket:
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+        if self.level < 1:
+            return False
+        self.level -= 1
+        return True
+
+
+class OpenAIStub:
+    """
+    State of the stub server: configuration, random generator, rate limit, recordings and stats
+    """
+
+    def __init__(self, config: StubConfig):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.bucket = TokenBucket(config.requests_per_minute) if config.requests_per_minute else None
+        self.recordings: dict[str, dict] = {}
+        self.stats = {"chat_completions": 0, "embeddings": 0, "rate_limited": 0, "errors": 0, "replayed": 0}
+
+        if config.recordings_path and os.path.exists(config.recordings_path):
+            with open(config.recordings_path) as file:
+                self.recordings = json.load(file)
+
+    def latency(self, median: float) -> float:
+        return median * self.random.lognormvariate(0, self.config.latency_sigma)
+
+    def headers(self) -> dict[str, str]:
+        if not self.bucket:
+            return {}
+        return {
+            "x-ratelimit-limit-requests": str(self.bucket.capacity),
+            "x-ratelimit-remaining-requests": str(int(self.bucket.level)),
+        }
+
+    def fault(self) -> JSONResponse | None:
+        """
+        The injected error response of this request, if any
+        """
+        if self.bucket and not self.bucket.take():
+            self.stats["rate_limited"] += 1
+            return error_response(429, "rate_limit_exceeded", "Rate limit reached for requests", {
+                "retry-after-ms": str(int(60_000 / self.bucket.capacity)),
+            })
+        roll = self.random.random()
+        if roll < self.config.rate_limit_rate:
+            self.stats["rate_limited"] += 1
+            return error_response(429, "rate_limit_exceeded", "Rate limit reached for tokens", {"retry-after-ms": "500"})
+        if roll < self.config.rate_limit_rate + self.config.error_rate:
+            self.stats["errors"] += 1
+            return error_response(500, "server_error", "The server had an error while processing your request", {})
+        return None
+
+    def canned_message(self, body: dict) -> dict:
+        """
+        The assistant message answering the request: a canned answer, a tool call or generated text
+        """
+        messages = body.get("messages", [])
+        prompt = last_user_message(messages)
+        tools = {tool["function"]["name"]: tool["function"] for tool in body.get("tools", [])}
+
+        for response in self.config.responses:
+            if re.search(response["match"], prompt):
+                if "arguments" in response and FINAL_RESULT_TOOL in tools:
+                    return tool_call_message(FINAL_RESULT_TOOL, response["arguments"])
+                if "content" in response:
+                    return {"role": "assistant", "content": response["content"]}
+
+        agent_tools = [name for name in tools if not name.startswith(FINAL_RESULT_TOOL)]
+        called_tools = any(message.get("role") == "tool" for message in messages)
+        if self.config.call_tools and agent_tools and not called_tools:
+            name = agent_tools[0]
+            return tool_call_message(name, SchemaSampler(tools[name].get("parameters", {}), prompt).sample(
+                tools[name].get("parameters", {})
+            ))
+
+        output_tools = [name for name in tools if name.startswith(FINAL_RESULT_TOOL)]
+        if output_tools:
+            parameters = tools[output_tools[0]].get("parameters", {})
+            return tool_call_message(output_tools[0], SchemaSampler(parameters, prompt).sample(parameters))
+
+        return {"role": "assistant", "content": generate_text(prompt, self.config.completion_tokens)}
+
+    async def chat_completion(self, body: dict):
+        self.stats["chat_completions"] += 1
+        fault = self.fault()
+        if fault:
+            await asyncio.sleep(self.latency(self.config.latency) / 10)
+            return fault
+
+        key = request_hash(body)
+        if key in self.recordings:
+            self.stats["replayed"] += 1
+            recorded = self.recordings[key]
+            message = recorded["choices"][0]["message"]
+        elif self.config.record:
+            recorded = await self.forward("/chat/completions", {**body, "stream": False})
+            self.recordings[key] = recorded
+            self.save_recordings()
+            message = recorded["choices"][0]["message"]
+        else:
+            message = self.canned_message(body)
+
+        prompt_tokens = count_tokens(json.dumps(body.get("messages", []), ensure_ascii=False))
+        output = message.get("content") or json.dumps(message.get("tool_calls"), ensure_ascii=False)
+        completion_tokens = count_tokens(output)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        completion_id = f"chatcmpl-{key[:24]}"
+        finish_reason = "tool_calls" if message.get("tool_calls") else "stop"
+
+        first_token = self.latency(self.config.latency)
+        if body.get("stream"):
+            return StreamingResponse(
+                self.stream(completion_id, body["model"], message, usage, finish_reason, first_token, body),
+                media_type="text/event-stream",
+                headers=self.headers(),
+            )
+
+        await asyncio.sleep(first_token + completion_tokens / self.config.tokens_per_second)
+        return JSONResponse({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason, "logprobs": None}],
+            "usage": usage,
+        }, headers=self.headers())
+
+    async def stream(self, completion_id, model, message, usage, finish_reason, first_token, body):
+        def chunk(delta: dict, finish: str | None = None, with_usage: bool = False) -> str:
+            data = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+            }
+            if with_usage:
+                data["usage"] = usage
+            return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+        await asyncio.sleep(first_token)
+        yield chunk({"role": "assistant", "content": ""})
+
+        if message.get("tool_calls"):
+            for index, call in enumerate(message["tool_calls"]):
+                yield chunk({"tool_calls": [{**call, "index": index}]})
+        else:
+            content = message.get("content") or ""
+            # About 4 characters per token
+            for start in range(0, len(content), 4):
+                await asyncio.sleep(1 / self.config.tokens_per_second)
+                yield chunk({"content": content[start:start + 4]})
+
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+        yield chunk({}, finish_reason, with_usage=include_usage)
+        yield "data: [DONE]\n\n"
+
+    async def embeddings(self, body: dict):
+        self.stats["embeddings"] += 1
+        fault = self.fault()
+        if fault:
+            return fault
+
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        dimensions = body.get("dimensions") or EMBEDDING_DIMENSIONS.get(body["model"], 1536)
+
+        await asyncio.sleep(self.latency(self.config.embedding_latency))
+        data = [
+            {"object": "embedding", "index": index, "embedding": embed_text(text, dimensions)}
+            for index, text in enumerate(inputs)
+        ]
+        tokens = sum(count_tokens(str(text)) for text in inputs)
+        return JSONResponse({
+            "object": "list",
+            "data": data,
+            "model": body["model"],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }, headers=self.headers())
+
+    async def forward(self, path: str, body: dict) -> dict:
+        async with httpx.AsyncClient(timeout=120) as client:
+            response = await client.post(
+                f"{self.config.upstream_url}{path}",
+                json=body,
+                headers={"Authorization": f"Bearer {os.getenv('OPENAI_API_KEY', '')}"},
+            )
+            response.raise_for_status()
+            return response.json()
+
+    def save_recordings(self) -> None:
+        if self.config.recordings_path:
+            with open(self.config.recordings_path, "w") as file:
+                json.dump(self.recordings, file, ensure_ascii=False)
+
+
+def embed_text(text: str, dimensions: int) -> list[float]:
+    """
+    Unit vector seeded by the hash of the text, identical texts get identical vectors
+    """
+    seed = int.from_bytes(hashlib.sha256(str(text).encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).round(6).tolist()
+
+
+def tool_call_message(name: str, arguments) -> dict:
+    return {
+        "role": "assistant",
+        "content": None,
+        "tool_calls": [{
+            "id": f"call_{uuid.uuid5(uuid.NAMESPACE_OID, name + json.dumps(arguments, sort_keys=True)).hex[:24]}",
+            "type": "function",
+            "function": {"name": name, "arguments": json.dumps(arguments, ensure_ascii=False)},
+        }],
+    }
+
+
+def error_response(status: int, code: str, message: str, headers: dict[str, str]) -> JSONResponse:
+    return JSONResponse(
+        {"error": {"message": message, "type": code, "param": None, "code": code}},
+        status_code=status,
+        headers=headers,
+    )
+
+
+def create_app(config: StubConfig | None = None) -> FastAPI:
+    stub = OpenAIStub(config or StubConfig())
+    app = FastAPI(title="OpenAI stub")
+    app.state.stub = stub
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        return await stub.chat_completion(await request.json())
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        return await stub.embeddings(await request.json())
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [
+            {"id": model, "object": "model", "owned_by": "stub"}
+            for model in ["gpt-4.1", "gpt-4.1-mini", *EMBEDDING_DIMENSIONS]
+        ]}
+
+    @app.get("/stub/stats")
+    async def stats():
+        return stub.stats
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run a local OpenAI-compatible stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=0.5, help="Median seconds to the first token")
+    parser.add_argument("--latency-sigma", type=float, default=0.3)
+    parser.add_argument("--tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--completion-tokens", type=int, default=150)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 500")
+    parser.add_argument("--requests-per-minute", type=int, default=0)
+    parser.add_argument("--no-tool-calls", action="store_true", help="Never call the agent tools")
+    parser.add_argument("--responses", help="JSON file of canned answers")
+    parser.add_argument("--recordings", help="JSON file of recorded responses to replay")
+    parser.add_argument("--record", action="store_true", help="Record the missing responses from the upstream API")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    responses = []
+    if args.responses:
+        with open(args.responses) as file:
+            responses = json.load(file)
+
+    stub_config = StubConfig(
+        latency=args.latency,
+        latency_sigma=args.latency_sigma,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        embedding_latency=args.embedding_latency,
+        rate_limit_rate=args.rate_limit_rate,
+        error_rate=args.error_rate,
+        requests_per_minute=args.requests_per_minute,
+        call_tools=not args.no_tool_calls,
+        responses=responses,
+        recordings_path=args.recordings,
+        record=args.record,
+        seed=args.seed,
+    )
+    uvicorn.run(create_app(stub_config), host=args.host, port=args.port)
@@ -1,9 +1,12 @@
+from datetime import datetime, timezone
+
 import logfire
-from sqlalchemy import desc, select, delete, update
+from sqlalchemy import desc, func, select, delete, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic_ai.messages import ModelMessage, ModelMessagesTypeAdapter, ModelRequest, ModelResponse
 
-from src.db.models import MessageBlobModel, UserModel
+from src.db.models import ConversationSummaryModel, MessageBlobModel, TranslationMemoryModel, UserModel
 from src.schemas.schemas import TelegramUser
 
 
@@ -66,6 +69,72 @@ async def get_message_history(session: AsyncSession, user: TelegramUser) -> list
 
     return chat_history
 
+
+async def get_active_message_blobs(session: AsyncSession, user_id: int, limit: int = 50) -> list[MessageBlobModel]:
+    """
+    Get the active message blobs of a user, the newest first
+    Args:
+        session: Database session
+        user_id: Telegram user id
+        limit: Maximum number of blobs to return
+    """
+    result = await session.execute(
+        select(MessageBlobModel)
+        .where(MessageBlobModel.user_id == user_id)
+        .where(MessageBlobModel.is_active)
+        .order_by(desc(MessageBlobModel.created_at))
+        .limit(limit)
+    )
+    return list(result.scalars().all())
+
+
+async def get_recent_message_blob_data(session: AsyncSession, limit: int = 10000) -> list[bytes]:
+    """
+    Get the serialized messages of the most recent blobs of all users, including the inactive ones
+    Args:
+        session: Database session
+        limit: Maximum number of blobs to return
+    """
+    result = await session.execute(
+        select(MessageBlobModel.data)
+        .order_by(desc(MessageBlobModel.created_at))
+        .limit(limit)
+    )
+    return list(result.scalars().all())
+
+
+async def get_conversation_summary(session: AsyncSession, user_id: int) -> ConversationSummaryModel | None:
+    return await session.get(ConversationSummaryModel, user_id)
+
+
+async def save_conversation_summary(
+        session: AsyncSession,
+        user_id: int,
+        summary: str,
+        summarized_until: datetime
+) -> None:
+    """
+    Create or replace the conversation summary of a user
+    Args:
+        session: Database session
+        user_id: Telegram user id
+        summary: New summary text
+        summarized_until: created_at of the latest message blob included in the summary
+    """
+    values = {"summary": summary, "summarized_until": summarized_until, "updated_at": datetime.now(timezone.utc)}
+
+    try:
+        await session.execute(
+            insert(ConversationSummaryModel)
+            .values(user_id=user_id, **values)
+            .on_conflict_do_update(index_elements=["user_id"], set_=values)
+        )
+        await session.commit()
+    except Exception as e:
+        await session.rollback()
+        logfire.error(f"Failed to save the conversation summary of {user_id}: {e}")
+
+
 async def get_full_message_history(session: AsyncSession, user_id: int) -> list[ModelMessage]:
     """
     Get message history by using chat ID
@@ -169,6 +238,8 @@ async def clear_chat_history(session: AsyncSession, user_id: int):
         .where(MessageBlobModel.user_id == user_id)
         .values(is_active=False)
     )
+    # The summary only covers the cleared messages
+    await session.execute(delete(ConversationSummaryModel).where(ConversationSummaryModel.user_id == user_id))
     
     await session.commit()
     return result.rowcount
@@ -232,4 +303,64 @@ async def delete_user_by_id(session: AsyncSession, user_id: int):
     Returns True if user was deleted, False if user not found
     """
     result = await session.execute(delete(UserModel).where(UserModel.id == user_id))
-    return result.rowcount
\ No newline at end of file
+    return result.rowcount
+
+
+async def get_translations(session: AsyncSession, keys: list[str]) -> dict[str, TranslationMemoryModel]:
+    """
+    Look up cached segment translations and count the hits
+    Args:
+        session: Database session
+        keys: Translation memory keys of the segments
+    """
+    if not keys:
+        return {}
+
+    result = await session.execute(select(TranslationMemoryModel).where(TranslationMemoryModel.key.in_(keys)))
+    entries = {entry.key: entry for entry in result.scalars().all()}
+
+    if entries:
+        await session.execute(
+            update(TranslationMemoryModel)
+            .where(TranslationMemoryModel.key.in_(list(entries)))
+            .values(hits=TranslationMemoryModel.hits + 1, last_used_at=datetime.now(timezone.utc))
+        )
+        await session.commit()
+
+    return entries
+
+
+async def save_translations(session: AsyncSession, entries: list[dict]) -> None:
+    """
+    Store new segment translations, keeping the existing ones on conflict
+    Args:
+        session: Database session
+        entries: Rows of the translation_memory table (key, direction, source, translation, tokens)
+    """
+    if not entries:
+        return
+
+    now = datetime.now(timezone.utc)
+    rows = [{**entry, "hits": 0, "created_at": now, "last_used_at": now} for entry in entries]
+
+    try:
+        await session.execute(insert(TranslationMemoryModel).values(rows).on_conflict_do_nothing())
+        await session.commit()
+    except Exception as e:
+        await session.rollback()
+        logfire.error(f"Failed to save translations: {e}")
+
+
+async def get_translation_memory_stats(session: AsyncSession) -> dict:
+    """
+    Number of cached segments, total hits and tokens saved by them
+    """
+    result = await session.execute(
+        select(
+            func.count(TranslationMemoryModel.key),
+            func.coalesce(func.sum(TranslationMemoryModel.hits), 0),
+            func.coalesce(func.sum(TranslationMemoryModel.hits * TranslationMemoryModel.tokens), 0),
+        )
+    )
+    entries, hits, saved_tokens = result.one()
+    return {"entries": entries, "hits": hits, "saved_tokens": saved_tokens}
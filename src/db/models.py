@@ -3,7 +3,7 @@ from typing import Optional
 from uuid import uuid4, UUID
 from sqlalchemy.dialects.postgresql import UUID as PG_UUID
 
-from sqlalchemy import DateTime, ForeignKey, LargeBinary, BigInteger, Boolean
+from sqlalchemy import DateTime, ForeignKey, LargeBinary, BigInteger, Boolean, Integer, String, Text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from src.db.database import Base
@@ -68,3 +68,42 @@ class MessageBlobModel(Base):
         'UserModel',
         back_populates='messages'
     )
+
+
+class TranslationMemoryModel(Base):
+    __tablename__ = "translation_memory"
+
+    # sha256 of the direction and the normalized source sentence
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    direction: Mapped[str] = mapped_column(String(8), nullable=False)
+    source: Mapped[str] = mapped_column(Text, nullable=False)
+    translation: Mapped[str] = mapped_column(Text, nullable=False)
+    # Estimated LLM tokens spent on the segment, i.e. saved on every hit
+    tokens: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    hits: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=False,
+        default=lambda: datetime.now(timezone.utc)
+    )
+    last_used_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=False,
+        default=lambda: datetime.now(timezone.utc)
+    )
+
+
+class ConversationSummaryModel(Base):
+    __tablename__ = "conversation_summaries"
+
+    user_id: Mapped[int] = mapped_column(
+        ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
+    )
+    summary: Mapped[str] = mapped_column(Text, nullable=False)
+    # created_at of the latest message blob folded into the summary
+    summarized_until: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=False,
+        default=lambda: datetime.now(timezone.utc)
+    )
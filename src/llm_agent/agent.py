@@ -1,3 +1,5 @@
+import os
+
 from dotenv import load_dotenv
 
 from src.config.settings import Config
@@ -6,7 +8,12 @@ from pydantic_ai import Agent, RunContext
 from pydantic_ai.settings import ModelSettings
 
 from src.llm_agent.agent_tools import retrieve_docs_tool
+from src.llm_agent.circuit_breaker import circuit_breakers
+from src.llm_agent.deadline import DOCS_SECONDS
+from src.llm_agent.doc_compression import compress_docs
+from src.llm_agent.llm_scheduler import openai_model
 from src.schemas.schemas import (
+    FusedRouterAgentResult,
     RouterAgentResult,
     ThinkingGrammarAgentDeps,
 )
@@ -15,8 +22,12 @@ load_dotenv()
 
 config = Config()
 
+# "two_step": router_agent, then query_rewriter_agent for grammar searches
+# "fused": fused_router_agent classifies and extracts the grammar pattern in a single call
+ROUTER_MODE = os.getenv("ROUTER_MODE", "two_step")
+
 router_agent = Agent(
-    model="openai:gpt-4.1",
+    model=openai_model("gpt-4.1"),
     instrument=True,
     output_type=RouterAgentResult,
     model_settings=ModelSettings(temperature=0.0),
@@ -33,7 +44,7 @@ router_agent = Agent(
 )
 
 query_rewriter_agent = Agent(
-    model="openai:gpt-4.1-mini",
+    model=openai_model("gpt-4.1-mini"),
     instrument=True,
     instructions="""
 Ты - query enhancer в поисковой системе корейской грамматики. 
@@ -48,8 +59,35 @@ INPUT -> OUTPUT:
 """,
 )
 
+fused_router_agent = Agent(
+    model=openai_model("gpt-4.1"),
+    instrument=True,
+    output_type=FusedRouterAgentResult,
+    model_settings=ModelSettings(temperature=0.0),
+    instructions="""
+Классифицируйте самое последнее сообщение пользователя, предоставьте объяснение и извлеките грамматическую конструкцию для поиска:
+1. Запрос пользователя - поиск грамматической конструкции или на него можно ответить заранее написанным определением одной конкретной грамматической конструкции корейского языка. Установите message_type=direct_grammar_search
+Примеры прямых запросов: ["아/어 보이다", "грамматика 이/가", "будущее время в корейском", "объясни грамматику -는 것 같다"]
+2. Запрос пользователя требует гибкого и специфичного объяснения грамматической структуры или является вопросом, связанным с грамматикой (то есть, прямого определения и объяснения грамматики недостаточно). Установите message_type=thinking_grammar_answer
+Примеры специфичных запросов: ["는/은 и 이/가 отличия", "падежи в корейском", "когда использовать 을, а когда 를?", "примеры использования 는데", "Почему в ... используется ...?"]
+3. Запрос пользователя является продолжением предыдущих сообщений. Установите message_type=thinking_grammar_answer
+Примеры follow-up запросов: ["приведи еще примеры", "тогда зачем нужно ...?", "а что делать если ...?"]
+4. Запрос пользователя не связан с корейской грамматикой и требует общего ответа. Установите message_type=casual_answer
+
+Если message_type=direct_grammar_search, установите grammar_pattern - грамматическую форму или шаблон из запроса в её изначальном виде.
+Если грамматическую форму невозможно извлечь или message_type другой, установите grammar_pattern="None".
+Примеры:
+INPUT -> grammar_pattern:
+가고 싶어요 -> -고 싶다
+грамматика будущего времени в корейском -> будущее время
+дательный падеж -> дательный падеж
+объясни грамматику 는 동안 -> -는 동안
+расскажи мне про грамматику -으 면 -> -(으)면
+"""
+)
+
 thinking_grammar_agent = Agent(
-    model="openai:gpt-4.1-mini",
+    model=openai_model("gpt-4.1-mini"),
     instrument=True,
     instructions="""
 ROLE: Ты - профессиональный агент в RAG системе в роли преподавателя корейского языка.\n
@@ -89,18 +127,28 @@ async def retrieve_docs(ctx: RunContext[ThinkingGrammarAgentDeps], hyde_query: s
     # hyde_response = await hyde_agent.run(user_prompt=hyde_query)
     # search_query = hyde_response.output
 
+    # INFO: Close to the request deadline the agent answers on its own, as when no lessons are found
+    if not ctx.deps.deadline.allows("skip_docs", DOCS_SECONDS):
+        return "RETRIEVED DOCS: none"
+    if not circuit_breakers["qdrant"].available():
+        ctx.deps.deadline.degrade("skip_docs")
+        return "RETRIEVED DOCS: none"
+
     retrieved_docs = await retrieve_docs_tool(ctx.deps, hyde_query, rerank_strategy="none")
 
+    # INFO: Only the spans of the lessons closest to the HyDE query are kept, within DOCS_TOKEN_BUDGET
+    texts = await compress_docs(ctx.deps, hyde_query, [doc.content["content"] for doc in retrieved_docs])
+
     docs = ["RETRIEVED DOCS:"]
 
-    for i, doc in enumerate(retrieved_docs):
-        docs.append(f"{i}. {doc.content["content"]}")
+    for i, text in enumerate(texts):
+        docs.append(f"{i}. {text}")
 
     return "\n\n".join(docs)
 
 
 conversation_agent = Agent(
-    model="openai:gpt-4.1",
+    model=openai_model("gpt-4.1"),
     instrument=True,
     instructions="""
 Я практикую разговорный корейский, а ты - мой партнер по диалогу. Используй легкую грамматику и лексику. 
@@ -112,7 +160,7 @@ conversation_agent = Agent(
 )
 
 translation_agent = Agent(
-    model="openai:gpt-4.1",
+    model=openai_model("gpt-4.1"),
     instrument=True,
     instructions="""
 You are a power Russian-Korean translator. Translate all Russian text to Korean, and Korean text to Russian. 
@@ -121,7 +169,7 @@ Only output the translated text, keeping the original format. Don't include your
 )
 
 learning_agent = Agent(
-    model="openai:gpt-4.1",
+    model=openai_model("gpt-4.1"),
     instrument=True,
     instructions="""
 Вы — преподаватель корейского языка. Ваша цель — оценить, правильно ли студент использовал ОПРЕДЕЛЁННУЮ грамматическую 
@@ -132,8 +180,19 @@ learning_agent = Agent(
 """
 )
 
+summary_agent = Agent(
+    model=openai_model("gpt-4.1-mini"),
+    instrument=True,
+    output_type=str,
+    instructions="""
+Ты ведешь краткое содержание диалога пользователя с ботом, изучающим корейский язык.
+Тебе дают предыдущее краткое содержание и новые реплики. Верни обновленное краткое содержание: темы и грамматики,
+которые обсуждались, ошибки пользователя и договоренности (например, исправлять ли ошибки). Не более 150 слов, без вступлений.
+"""
+)
+
 system_agent = Agent(
-    model="openai:gpt-4.1-mini",
+    model=openai_model("gpt-4.1-mini"),
     instrument=True,
     output_type=str,
     instructions="""
@@ -11,6 +11,15 @@ from qdrant_client.http.models import Prefetch, SparseVector, FusionQuery, Fusio
 from src.config.settings import Config
 from src.schemas.schemas import GrammarEntryV2, RetrievedGrammar, RouterAgentDeps, RetrievedDoc, \
     ThinkingGrammarAgentDeps
+from src.llm_agent.circuit_breaker import circuit_breakers
+from src.llm_agent.corpus import get_corpus_version
+from src.llm_agent.deadline import COLBERT_SECONDS, LLM_FILTER_FULL_MODEL_SECONDS, LLM_FILTER_SECONDS
+from src.llm_agent.embedding_batcher import embedding_batcher
+from src.llm_agent.hedging import hedged
+from src.llm_agent.llm_scheduler import openai_model
+from src.llm_agent.pipeline_metrics import pipeline_stage, record_usage
+from src.llm_agent.retrieval_cache import RETRIEVAL_CACHE, RetrievalQuery, retrieval_cache
+from src.llm_agent.single_flight import llm_filter_flight, normalize_key, retrieval_flight
 
 load_dotenv()
 config = Config()
@@ -21,10 +30,14 @@ async def retrieve_grammars_tool(
         user_prompt: str,
         retrieve_top_k: int = 15,
         llm_filter: bool = True
-) -> list[GrammarEntryV2] | None:
+) -> list[RetrievedGrammar] | None:
     """
     Инструмент для извлечения грамматических конструкций на основе запроса пользователя.
+    Returns retrieved grammars together with their Qdrant point IDs.
     A tool for extracting grammatical constructions based on the user's query.
+    Concurrent calls with the same normalized queries share a single retrieval, whose IDs are cached per corpus version.
+    The LLM filter is skipped or runs on a smaller model when the request deadline is close.
+    While the OpenAI circuit breakers are open, the filter is skipped and the search is sparse-only.
 
     Args:
         deps: the call context's dependencies
@@ -33,17 +46,80 @@ async def retrieve_grammars_tool(
         user_prompt: User original prompt
         llm_filter: Whether to use llm filter or not
     """
+    # INFO: Decided before the retrieval, so that the coalesced callers have the same budget
+    filter_model = "gpt-4.1"
+    if llm_filter and not deps.deadline.allows("llm_filter_mini", LLM_FILTER_FULL_MODEL_SECONDS):
+        filter_model = "gpt-4.1-mini"
+        llm_filter = deps.deadline.allows("skip_llm_filter", LLM_FILTER_SECONDS)
+    if llm_filter and not circuit_breakers["openai_chat"].available():
+        deps.deadline.degrade("skip_llm_filter")
+        llm_filter = False
 
-    with logfire.span("Creating embedding for search_query = {search_query}", search_query=search_query):
-        vector_query = await deps.openai_client.embeddings.create(model=config.embedding_model, input=search_query)
-        sparse_vector_query = next(deps.sparse_embedding.query_embed(search_query))
-        sparse_vector_query = SparseVector(**sparse_vector_query.as_object())
+    dense = circuit_breakers["openai_embeddings"].available()
+    if not dense:
+        deps.deadline.degrade("sparse_only")
 
-    assert len(vector_query.data) == 1, (
-        f"Expected 1 embedding, got {len(vector_query.data)}, doc query: {search_query!r}"
-    )
+    query = RetrievalQuery.create(search_query, user_prompt, retrieve_top_k, llm_filter, filter_model, dense)
+    if RETRIEVAL_CACHE:
+        cached = await retrieval_cache.get(query, await get_corpus_version(deps.qdrant_client))
+        if cached is not None:
+            return await retrieval_cache.hydrate(deps.qdrant_client, config.qdrant_collection_name_final, cached)
 
-    vector_query = vector_query.data[0].embedding
+    return await retrieve_grammars_for_query(deps, query, search_query, user_prompt)
+
+
+async def retrieve_grammars_for_query(
+        deps: RouterAgentDeps,
+        query: RetrievalQuery,
+        search_query: str | None = None,
+        user_prompt: str | None = None,
+) -> list[RetrievedGrammar] | None:
+    """
+    Coalesced retrieval of a query, its result is stored in the retrieval cache
+
+    Args:
+        deps: the call context's dependencies
+        query: Normalized retrieval parameters
+        search_query: Original search query, the normalized one by default (cache warm-up)
+        user_prompt: Original user prompt, the normalized one by default
+    """
+    async def retrieve() -> list[RetrievedGrammar] | None:
+        docs = await _retrieve_grammars(
+            deps,
+            search_query or query.search_query,
+            user_prompt or query.user_prompt,
+            query.retrieve_top_k,
+            query.llm_filter,
+            query.filter_model or "gpt-4.1",
+            query.dense,
+        )
+        if RETRIEVAL_CACHE:
+            await retrieval_cache.put(query, await get_corpus_version(deps.qdrant_client), docs)
+        return docs
+
+    docs = await retrieval_flight.do(query, retrieve)
+    # The list is shared between the coalesced callers
+    return list(docs) if docs else None
+
+
+async def _retrieve_grammars(
+        deps: RouterAgentDeps,
+        search_query: str,
+        user_prompt: str,
+        retrieve_top_k: int,
+        llm_filter: bool,
+        filter_model: str = "gpt-4.1",
+        dense: bool = True,
+) -> list[RetrievedGrammar] | None:
+
+    with (
+        logfire.span("Creating embedding for search_query = {search_query}", search_query=search_query),
+        pipeline_stage("embed"),
+    ):
+        # Batched with the queries of the concurrent requests
+        vector_query = await embedding_batcher.embed(deps.openai_client, search_query) if dense else None
+        sparse_vector_query = next(deps.sparse_embedding.query_embed(search_query))
+        sparse_vector_query = SparseVector(**sparse_vector_query.as_object())
 
     bm_threshold = 0
     vector_threshold = 0
@@ -65,12 +141,15 @@ async def retrieve_grammars_tool(
 
     with logfire.span(f"Querying Qdrant for search_query = {search_query}"):
         # Use hybrid search with bm25 amd OpenAI embeddings with RRF
-        response = await deps.qdrant_client.query_points(
-            collection_name=config.qdrant_collection_name_final,
-            prefetch=[bm_25_prefetch, dense_prefetch],
-            query=FusionQuery(fusion=Fusion.RRF),
-            with_payload=True,
-        )
+        with pipeline_stage("qdrant"):
+            with circuit_breakers["qdrant"].guard():
+                response = await hedged("qdrant_grammars", lambda: deps.qdrant_client.query_points(
+                    collection_name=config.qdrant_collection_name_final,
+                    # Sparse-only while the embeddings are unavailable
+                    prefetch=[bm_25_prefetch, dense_prefetch] if dense else [bm_25_prefetch],
+                    query=FusionQuery(fusion=Fusion.RRF),
+                    with_payload=True,
+                ))
         hits = response.points
 
         logfire.info(f"Received {len(hits)} results from Qdrant.")
@@ -78,7 +157,7 @@ async def retrieve_grammars_tool(
         # Convert to schema objects
         docs = [
             RetrievedGrammar(
-                id=hit.id,
+                id=str(hit.id),
                 content=GrammarEntryV2(**hit.payload),
                 score=hit.score,
             )
@@ -92,74 +171,15 @@ async def retrieve_grammars_tool(
         return None
 
     else:
-        result = [doc.content for doc in docs]
+        result = docs
 
         if llm_filter:
-            llm_filter_prompt = [f"USER_QUERY: '{user_prompt}'\n\nGRAMMAR LIST: "]
-
-            for i, doc in enumerate(result):
-                # ! For Version 1 grammars (full in json)
-                llm_filter_prompt.append(f"{i}. {doc.grammar_name_kr} - {doc.grammar_name_rus}")
-
-                # ! For Version 2 grammars (MD)
-                # llm_filter_prompt.append(f"{i}. {doc}")
-
-            llm_filter_agent = Agent(
-                model="openai:gpt-4.1",
-                instrument=True,
-                output_type=List[int],
-                instructions="""
-                    You're a search filter in Korean grammar database. Select all relevant search results from the GRAMMAR LIST, 
-                    based on the USER QUERY, and only output their indexes in a list in the relevancy order (most relevant - first). 
-                    Focus on higher recall, if the number of potential results is more that 1, and higher precision if there is 
-                    only 1 relevant result (i.e. it should be exactly what the user is looking for. If none are relevant, output an empty list
-                    
-                    Example 1 - high recall:
-                    ```
-                    USER_QUERY: 'грамматика будущего времени в корейском языке'
-                    GRAMMAR LIST: 
-                    0. V/A + -(으)ㄹ 것이다 - будущее время
-                    1. V + -겠- - будущее время (планы, намерения говорящего)
-                    2. A/V + -(으)ㄹ 때, N + 때 - - «когда…», «во время…»
-                    3. N + 에 - «в (какое-то время)»
-                    4. V + -(으)ㄹ - определительная форма глагола в будущем времени
-                    5. V/A + -(으)면서 - одновременность действий
-                    6. V/A + -었-, -았-, -였- - суффикс прошедшего времени
-                    
-                    OUTPUT: [0, 1, 4]
-                    ```
-                    
-                    Example 2 - higher precision
-                    ```
-                    USER_QUERY: 'грамматика 는 데'
-                    GRAMMAR LIST:
-                    0. N + 은/는 - выделительная частица
-                    1. N + 하고 - «с» (совместное действие)
-                    2. V + -는 동안(에) - «в течение…, пока…»
-                    3. V/A + -(으)ㄴ/는데 - «а», «но», вводит контраст, предысторию или контекст
-                    4. V + -는 것 - «делание», «то, что…», отглагольное существительное
-                    
-                    
-                    OUTPUT: [3]
-                    ```
-                    
-                    Example 3 - high precision, but none relevant:
-                    ```
-                    USER_QUERY: 'объясни использование 아/어 보이다'
-                    GRAMMAR LIST:
-                    0. 보다 - «чем»
-                    1. V + -(으)ㄹ까 보다 - «боюсь, что…», «волнуюсь, что…»
-                    2. V + -아/어 있다 - состояние, возникшее в результате действия
-                    3. V + -고 있다 - состояние одежды и внешнего вида
-                    4. 와/과 - «с», совместное действие
-                    
-                    OUTPUT: []
-                    ```
-                    """
-            )
-
-            llm_filter_response = await llm_filter_agent.run(user_prompt="\n\n".join(llm_filter_prompt))
-            filtered_doc_ids = llm_filter_response.output
+            # Coalesce by the prompt and the candidates, retrievals with different search queries can share it
+            with pipeline_stage("llm_filter"):
+                filtered_doc_ids = await llm_filter_flight.do(
+                    (normalize_key(user_prompt), tuple(doc.id for doc in result), filter_model),
+                    lambda: llm_filter_grammars(user_prompt, result, filter_model),
+                )
 
             if filtered_doc_ids:
                 filtered_docs = [result[i] for i in filtered_doc_ids]
@@ -172,6 +192,83 @@ async def retrieve_grammars_tool(
             return result
 
 
+async def llm_filter_grammars(user_prompt: str, docs: list[RetrievedGrammar], model: str = "gpt-4.1") -> list[int]:
+    """
+    Select the retrieved grammars relevant to the user prompt with an LLM
+
+    Args:
+        model: OpenAI model of the filter, gpt-4.1-mini when the request deadline is close
+
+    Returns:
+        Indexes of the relevant grammars in `docs`, the most relevant first
+    """
+    llm_filter_prompt = [f"USER_QUERY: '{user_prompt}'\n\nGRAMMAR LIST: "]
+
+    for i, doc in enumerate(docs):
+        # ! For Version 1 grammars (full in json)
+        llm_filter_prompt.append(f"{i}. {doc.content.grammar_name_kr} - {doc.content.grammar_name_rus}")
+
+        # ! For Version 2 grammars (MD)
+        # llm_filter_prompt.append(f"{i}. {doc}")
+
+    llm_filter_agent = Agent(
+        model=openai_model(model),
+        instrument=True,
+        output_type=List[int],
+        instructions="""
+            You're a search filter in Korean grammar database. Select all relevant search results from the GRAMMAR LIST, 
+            based on the USER QUERY, and only output their indexes in a list in the relevancy order (most relevant - first). 
+            Focus on higher recall, if the number of potential results is more that 1, and higher precision if there is 
+            only 1 relevant result (i.e. it should be exactly what the user is looking for. If none are relevant, output an empty list
+
+            Example 1 - high recall:
+            ```
+            USER_QUERY: 'грамматика будущего времени в корейском языке'
+            GRAMMAR LIST: 
+            0. V/A + -(으)ㄹ 것이다 - будущее время
+            1. V + -겠- - будущее время (планы, намерения говорящего)
+            2. A/V + -(으)ㄹ 때, N + 때 - - «когда…», «во время…»
+            3. N + 에 - «в (какое-то время)»
+            4. V + -(으)ㄹ - определительная форма глагола в будущем времени
+            5. V/A + -(으)면서 - одновременность действий
+            6. V/A + -었-, -았-, -였- - суффикс прошедшего времени
+
+            OUTPUT: [0, 1, 4]
+            ```
+
+            Example 2 - higher precision
+            ```
+            USER_QUERY: 'грамматика 는 데'
+            GRAMMAR LIST:
+            0. N + 은/는 - выделительная частица
+            1. N + 하고 - «с» (совместное действие)
+            2. V + -는 동안(에) - «в течение…, пока…»
+            3. V/A + -(으)ㄴ/는데 - «а», «но», вводит контраст, предысторию или контекст
+            4. V + -는 것 - «делание», «то, что…», отглагольное существительное
+
+
+            OUTPUT: [3]
+            ```
+
+            Example 3 - high precision, but none relevant:
+            ```
+            USER_QUERY: 'объясни использование 아/어 보이다'
+            GRAMMAR LIST:
+            0. 보다 - «чем»
+            1. V + -(으)ㄹ까 보다 - «боюсь, что…», «волнуюсь, что…»
+            2. V + -아/어 있다 - состояние, возникшее в результате действия
+            3. V + -고 있다 - состояние одежды и внешнего вида
+            4. 와/과 - «с», совместное действие
+
+            OUTPUT: []
+            ```
+            """
+    )
+
+    llm_filter_response = await llm_filter_agent.run(user_prompt="\n\n".join(llm_filter_prompt))
+    return record_usage("llm_filter", llm_filter_response).output
+
+
 async def retrieve_docs_tool(
         deps: ThinkingGrammarAgentDeps,
         search_query: str,
@@ -196,15 +293,18 @@ async def retrieve_docs_tool(
     bm_threshold = 0
     vector_threshold = 0
 
+    if rerank_strategy == "colbert" and not deps.deadline.allows("skip_colbert", COLBERT_SECONDS):
+        rerank_strategy = "none"
+    if search_strategy != "bm25" and not circuit_breakers["openai_embeddings"].available():
+        deps.deadline.degrade("sparse_only")
+        search_strategy, rerank_strategy = "bm25", "none"
+
     local_logfire = logfire.with_tags(search_strategy, rerank_strategy, "RETRIEVER")
 
     with local_logfire.span(f"Embedding for search_query = {search_query}"):
 
         if search_strategy == "dense" or search_strategy == "hybrid":
-            vector_query = await deps.openai_client.embeddings.create(
-                model=config.embedding_model,
-                input=search_query)
-            vector_query = vector_query.data[0].embedding
+            vector_query = await embedding_batcher.embed(deps.openai_client, search_query)
 
             dense_prefetch = Prefetch(
                 query=vector_query,
@@ -234,51 +334,54 @@ async def retrieve_docs_tool(
     # Use hybrid search with bm25 amd OpenAI embeddings with RRF
     # local_logfire.info(f"Trying to retrieve from {deps.qdrant_client.__dict__}")
 
-    with local_logfire.span(f"qdrant_retrieval_{search_strategy}_{rerank_strategy}"):
+    with (
+        local_logfire.span(f"qdrant_retrieval_{search_strategy}_{rerank_strategy}"),
+        circuit_breakers["qdrant"].guard(),
+    ):
 
         if search_strategy == "hybrid":
             if rerank_strategy in ["cross", "none", "jina"]:
-                response = await deps.qdrant_client.query_points(
+                response = await hedged("qdrant_docs", lambda: deps.qdrant_client.query_points(
                     collection_name=config.qdrant_collection_name_rag_small,
                     prefetch=[bm_25_prefetch, dense_prefetch],
                     query=FusionQuery(fusion=Fusion.RRF),
                     limit=retrieve_top_k,
                     with_payload=True,
-                )
+                ))
                 hits = response.points
                 local_logfire.info(f"Received {len(hits)} results from Qdrant.")
 
             elif rerank_strategy == "colbert":
-                response = await deps.qdrant_client.query_points(
+                response = await hedged("qdrant_docs", lambda: deps.qdrant_client.query_points(
                     collection_name=config.qdrant_collection_name_rag_small,
                     prefetch=[bm_25_prefetch, dense_prefetch],
                     query=late_vector_query,
                     using=config.late_interaction_model,
                     limit=rerank_top_k,
                     with_payload=True,
-                )
+                ))
                 hits = response.points
                 local_logfire.info(f"Received {len(hits)} results from Qdrant.")
 
         elif search_strategy == "bm25" and rerank_strategy == "none":
-            response = await deps.qdrant_client.query_points(
+            response = await hedged("qdrant_docs", lambda: deps.qdrant_client.query_points(
                 collection_name=config.qdrant_collection_name_rag_small,
                 query=sparse_vector_query,
                 using=config.sparse_embedding_model,
                 with_payload=True,
                 limit=retrieve_top_k,
-            )
+            ))
             hits = response.points
             local_logfire.info(f"Received {len(hits)} results from Qdrant.")
 
         elif search_strategy == "dense" and rerank_strategy == "none":
-            response = await deps.qdrant_client.query_points(
+            response = await hedged("qdrant_docs", lambda: deps.qdrant_client.query_points(
                 collection_name=config.qdrant_collection_name_rag_small,
                 using=config.embedding_model,
                 query=vector_query,
                 with_payload=True,
                 limit=retrieve_top_k,
-            )
+            ))
             hits = response.points
             local_logfire.info(f"Received {len(hits)} results from Qdrant.")
 
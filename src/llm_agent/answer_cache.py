@@ -0,0 +1,149 @@
+"""
+Semantic cache of thinking_grammar_agent answers to first-turn questions.
+
+Questions without chat history ("разница между 은/는 и 이/가") are asked by many users in slightly
+different words. Their embeddings are compared with the cached questions of the same corpus version,
+and if the cosine similarity passes ANSWER_CACHE_THRESHOLD, the stored answer is returned instead of
+running the agent. Follow-up turns depend on the history and never use the cache.
+"""
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+from openai import AsyncOpenAI
+
+from src.llm_agent.embedding_batcher import embedding_batcher
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.93"))
+ANSWER_CACHE_MAX_SIZE = int(os.getenv("ANSWER_CACHE_MAX_SIZE", "1000"))
+ANSWER_CACHE_MAX_AGE = float(os.getenv("ANSWER_CACHE_MAX_AGE_HOURS", "168")) * 3600
+
+
+@dataclass
+class CachedAnswer:
+    """
+    A cached answer together with the embedding of its question
+    """
+    entry_id: str
+    question: str
+    answer: str
+    corpus_version: str
+    embedding: np.ndarray
+    created_at: float
+    hits: int = 0
+
+
+class SemanticAnswerCache:
+    """
+    LRU cache of answers looked up by the cosine similarity of question embeddings
+
+    Args:
+        threshold: Minimal cosine similarity for a cached question to match
+        max_size: Maximum number of cached answers, the least recently used ones are evicted first
+        max_age: Seconds after which an answer is evicted regardless of its use
+    """
+
+    def __init__(
+        self,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+        max_size: int = ANSWER_CACHE_MAX_SIZE,
+        max_age: float = ANSWER_CACHE_MAX_AGE,
+    ):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: OrderedDict[str, CachedAnswer] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    async def embed(openai_client: AsyncOpenAI, question: str) -> np.ndarray:
+        embedding = np.asarray(await embedding_batcher.embed(openai_client, question), dtype=np.float32)
+        return embedding / (np.linalg.norm(embedding) or 1.0)
+
+    def lookup(self, embedding: np.ndarray, corpus_version: str) -> tuple[CachedAnswer | None, float]:
+        """
+        Return the most similar cached answer of the corpus version if it passes the threshold,
+        together with its similarity
+        """
+        self.evict_expired()
+
+        candidates = [entry for entry in self._entries.values() if entry.corpus_version == corpus_version]
+        if not candidates:
+            self.misses += 1
+            return None, 0.0
+
+        similarities = np.stack([entry.embedding for entry in candidates]) @ embedding
+        best = int(np.argmax(similarities))
+        similarity = float(similarities[best])
+
+        if similarity < self.threshold:
+            self.misses += 1
+            return None, similarity
+
+        entry = candidates[best]
+        entry.hits += 1
+        self.hits += 1
+        self._entries.move_to_end(entry.entry_id)
+        return entry, similarity
+
+    def put(self, question: str, answer: str, embedding: np.ndarray, corpus_version: str) -> CachedAnswer:
+        entry_id = hashlib.sha1(f"{corpus_version}\n{question}".encode("utf-8")).hexdigest()[:8]
+        entry = CachedAnswer(
+            entry_id=entry_id,
+            question=question,
+            answer=answer,
+            corpus_version=corpus_version,
+            embedding=embedding,
+            created_at=time.time(),
+        )
+        self._entries[entry_id] = entry
+        self._entries.move_to_end(entry_id)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+        return entry
+
+    def evict_expired(self) -> None:
+        deadline = time.time() - self.max_age
+        for entry_id in [entry.entry_id for entry in self._entries.values() if entry.created_at < deadline]:
+            del self._entries[entry_id]
+
+    def entries(self) -> list[CachedAnswer]:
+        """
+        Cached answers, the most recently used first
+        """
+        self.evict_expired()
+        return list(reversed(self._entries.values()))
+
+    def purge(self, entry_id: str | None = None) -> int:
+        """
+        Remove a single entry by its ID, or all entries if no ID is given. Returns the number of removed entries
+        """
+        if entry_id is None:
+            removed = len(self._entries)
+            self._entries.clear()
+            return removed
+
+        return 1 if self._entries.pop(entry_id, None) is not None else 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "threshold": self.threshold,
+        }
+
+
+answer_cache = SemanticAnswerCache()
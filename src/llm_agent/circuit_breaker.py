@@ -0,0 +1,268 @@
+"""
+Circuit breakers of the external dependencies of /invoke.
+
+When OpenAI or Qdrant is slow, every request would wait for the timeouts. A breaker per dependency
+counts its consecutive failures, slow calls included. After CIRCUIT_FAILURE_THRESHOLD of them it
+opens, and for CIRCUIT_RESET_SECONDS the requests use the local fallbacks instead of calling the
+dependency. The breaker then becomes half-open: the first request asking `available()` claims the
+probe and is sent to the dependency, the others keep using the fallbacks until it is done. The claim
+belongs to the context of the request, so its own `guard()` and `track()` calls are the probe. A
+successful probe closes the breaker, a failed one opens it again. Until then the outcomes of the other
+calls, started before the breaker opened or not gated by `available()`, don't change its state.
+
+Fallback matrix of /invoke:
+
+    openai_chat        no router: patterns resolved locally are searched without the LLM filter,
+                       the other messages get a "try again later" answer
+    openai_embeddings  sparse-only (BM25) grammar and lesson search, no answer cache
+    qdrant             grammar cards from the corpus artifact by exact name, answers without lessons
+    postgres           last known registered users, no message history
+
+The OpenAI calls are recorded by the transport of the shared client, Qdrant and Postgres calls are
+wrapped in `guard()`. State changes are sent to the admin, rate-limited per breaker.
+"""
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Awaitable, Callable
+
+import logfire
+
+CIRCUIT_BREAKERS = os.getenv("CIRCUIT_BREAKERS", "true").lower() == "true"
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+CIRCUIT_NOTIFY_INTERVAL_SECONDS = float(os.getenv("CIRCUIT_NOTIFY_INTERVAL_SECONDS", "300"))
+
+# Calls slower than this count as failures
+SLOW_CALL_SECONDS = {
+    "openai_chat": 30.0,
+    "openai_embeddings": 5.0,
+    "qdrant": 3.0,
+    "postgres": 3.0,
+}
+
+
+# Probe claims held by the current request: breaker -> claim token
+_probe_claims: ContextVar[dict["CircuitBreaker", object]] = ContextVar("circuit_probe_claims", default={})
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised by `guard()` instead of calling a dependency whose breaker is open
+    """
+
+    def __init__(self, name: str):
+        super().__init__(f"Circuit breaker {name} is open")
+        self.name = name
+
+
+@dataclass
+class TrackedCall:
+    """
+    Call recorded by `track()`, set `error` for failures that are not exceptions (e.g. a 5xx response)
+    """
+    error: bool = False
+
+
+class CircuitBreaker:
+    """
+    Breaker of a single dependency
+
+    Args:
+        name: Name of the dependency, e.g. "qdrant"
+        slow_call_seconds: Calls slower than this count as failures
+    """
+
+    def __init__(self, name: str, slow_call_seconds: float):
+        self.name = name
+        self.slow_call_seconds = slow_call_seconds
+        self.state = CircuitState.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        # Claim of the half-open probe, released by `record()` or a cancelled call. A claim older than
+        # slow_call_seconds is stale (the request never called), the next request takes over
+        self.probe_token: object | None = None
+        self.probe_claimed_at = 0.0
+        self.listeners: list[Callable[["CircuitBreaker", CircuitState], None]] = []
+
+        self.calls = 0
+        self.failures = 0
+        self.opened = 0
+        self.fallbacks = 0
+
+    def _set_state(self, state: CircuitState) -> None:
+        previous, self.state = self.state, state
+        logfire.warning(
+            "Circuit breaker {name}: {previous} -> {state}", name=self.name, previous=previous.value, state=state.value
+        )
+        for listener in self.listeners:
+            listener(self, previous)
+
+    def _holds_probe(self) -> bool:
+        return self.probe_token is not None and _probe_claims.get().get(self) is self.probe_token
+
+    def _claim_probe(self) -> bool:
+        """
+        Claim the probe for the current request, False if another request holds it
+        """
+        now = time.monotonic()
+        if self.probe_token is not None and now - self.probe_claimed_at <= self.slow_call_seconds:
+            return False
+        self.probe_token, self.probe_claimed_at = object(), now
+        _probe_claims.set({**_probe_claims.get(), self: self.probe_token})
+        return True
+
+    def available(self) -> bool:
+        """
+        Whether a request should call the dependency, False if it should use the fallback. While
+        half-open only the request claiming the probe gets True, on every call it makes.
+        """
+        if not CIRCUIT_BREAKERS or self.state == CircuitState.CLOSED:
+            return True
+        if self.state == CircuitState.OPEN:
+            if time.monotonic() - self.opened_at >= CIRCUIT_RESET_SECONDS:
+                self._set_state(CircuitState.HALF_OPEN)
+        if self.state == CircuitState.HALF_OPEN and (self._holds_probe() or self._claim_probe()):
+            return True
+
+        self.fallbacks += 1
+        return False
+
+    def record(self, seconds: float, error: bool = False, probe: bool = False) -> None:
+        """
+        Record the outcome of a call, slow calls count as failures. While the breaker is not closed only
+        the outcome of the probe closes or reopens it, the other calls started before it opened or were
+        not gated by `available()`.
+
+        Args:
+            seconds: Duration of the call
+            error: Whether the call failed
+            probe: Whether the call was made by the request holding the half-open probe
+        """
+        self.calls += 1
+        failed = error or seconds > self.slow_call_seconds
+        if failed:
+            self.failures += 1
+
+        if self.state != CircuitState.CLOSED:
+            if not probe:
+                return
+            self.probe_token = None
+            if failed:
+                self.opened += 1
+                self.opened_at = time.monotonic()
+                self._set_state(CircuitState.OPEN)
+            else:
+                self.consecutive_failures = 0
+                self._set_state(CircuitState.CLOSED)
+            return
+
+        if failed:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= CIRCUIT_FAILURE_THRESHOLD:
+                self.opened += 1
+                self.opened_at = time.monotonic()
+                self._set_state(CircuitState.OPEN)
+        else:
+            self.consecutive_failures = 0
+
+    @contextmanager
+    def track(self):
+        """
+        Record the outcome of the call made in the block. While half-open the call is the probe if the
+        request claimed it with `available()`.
+        """
+        call = TrackedCall()
+        started = time.monotonic()
+        try:
+            yield call
+        except asyncio.CancelledError:
+            # Cancelled by the caller (deadline, speculation), only a slow call says something about the dependency
+            if time.monotonic() - started > self.slow_call_seconds:
+                self.record(time.monotonic() - started, probe=self._holds_probe())
+            elif self._holds_probe():
+                self.probe_token = None
+            raise
+        except Exception:
+            self.record(time.monotonic() - started, error=True, probe=self._holds_probe())
+            raise
+        else:
+            self.record(time.monotonic() - started, error=call.error, probe=self._holds_probe())
+
+    @contextmanager
+    def guard(self):
+        """
+        Like `track()`, but raise CircuitOpenError without running the block while the breaker is open
+        or half-open with the probe claimed by another request
+        """
+        if self.state != CircuitState.CLOSED and not self.available():
+            raise CircuitOpenError(self.name)
+        with self.track() as call:
+            yield call
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "state": self.state.value,
+            "open": int(self.state != CircuitState.CLOSED),
+            "calls": self.calls,
+            "failures": self.failures,
+            "opened": self.opened,
+            "fallbacks": self.fallbacks,
+        }
+
+
+circuit_breakers = {name: CircuitBreaker(name, seconds) for name, seconds in SLOW_CALL_SECONDS.items()}
+
+
+def circuit_breaker_stats() -> dict[str, dict[str, Any]]:
+    return {name: breaker.stats() for name, breaker in circuit_breakers.items()}
+
+
+class StateChangeNotifier:
+    """
+    Breaker listener sending the state changes, at most one message per breaker per interval.
+    Changes within the interval are summed up in a single message with the state at its end.
+
+    Args:
+        send: Coroutine function sending a text to the admin
+        interval: Minimum seconds between two messages about the same breaker
+    """
+
+    def __init__(self, send: Callable[[str], Awaitable[None]], interval: float = CIRCUIT_NOTIFY_INTERVAL_SECONDS):
+        self.send = send
+        self.interval = interval
+        self.last_sent: dict[str, float] = {}
+        self.pending: dict[str, int] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def __call__(self, breaker: CircuitBreaker, previous: CircuitState) -> None:
+        if breaker.name in self.pending:
+            self.pending[breaker.name] += 1
+            return
+
+        wait = self.last_sent.get(breaker.name, -self.interval) + self.interval - time.monotonic()
+        if wait <= 0:
+            self._send(breaker, f"{previous.value} -> {breaker.state.value}")
+        else:
+            self.pending[breaker.name] = 1
+            asyncio.get_running_loop().call_later(wait, self._flush, breaker)
+
+    def _flush(self, breaker: CircuitBreaker) -> None:
+        changes = self.pending.pop(breaker.name)
+        self._send(breaker, f"{breaker.state.value} ({changes} changes in the last {self.interval:.0f}s)")
+
+    def _send(self, breaker: CircuitBreaker, change: str) -> None:
+        self.last_sent[breaker.name] = time.monotonic()
+        task = asyncio.create_task(self.send(f"{breaker.name}: {change}"))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
@@ -0,0 +1,169 @@
+"""
+Token-budgeted message history for the conversation and learning agents.
+
+The newest turns are kept in full as long as they fit the token budget of the agent. A turn with a
+grammar card that doesn't fit is kept with the card reduced to its title, and everything older is
+replaced by a rolling summary stored in the conversation_summaries table. The summary is updated
+incrementally, in the background, with the turns that have left the window since the last update.
+"""
+import os
+import re
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+
+import logfire
+from pydantic_ai.messages import (
+    ModelMessage,
+    ModelMessagesTypeAdapter,
+    ModelRequest,
+    ModelResponse,
+    SystemPromptPart,
+    TextPart,
+    UserPromptPart,
+)
+from pydantic_ai.usage import UsageLimits
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.db.crud import get_active_message_blobs, get_conversation_summary, save_conversation_summary
+from src.db.models import MessageBlobModel
+from src.llm_agent.agent import summary_agent
+from src.llm_agent.llm_scheduler import Priority, llm_priority
+from src.llm_agent.pipeline_metrics import record_usage
+from src.llm_agent.tokens import count_tokens
+
+CONTEXT_TOKEN_BUDGETS = {
+    "conversation": int(os.getenv("CONVERSATION_CONTEXT_TOKENS", "2000")),
+    "learning": int(os.getenv("LEARNING_CONTEXT_TOKENS", "2000")),
+}
+# Turns older than that are never considered, even for the summary
+MAX_CONTEXT_TURNS = 50
+
+# Grammar cards start with their bold "<kr> - <rus>" title followed by the "Описание" section
+GRAMMAR_CARD_PATTERN = re.compile(r"^<b>([^\n]+?)</b>\n\n<b>Описание:?</b>")
+
+SUMMARY_PREFIX = "Краткое содержание предыдущей части диалога:\n"
+
+
+def message_texts(messages: list[ModelMessage]) -> list[str]:
+    return [
+        part.content
+        for message in messages
+        for part in message.parts
+        if isinstance(part, (UserPromptPart, TextPart, SystemPromptPart)) and isinstance(part.content, str)
+    ]
+
+
+def count_message_tokens(messages: list[ModelMessage]) -> int:
+    return sum(count_tokens(text) for text in message_texts(messages))
+
+
+def strip_grammar_cards(messages: list[ModelMessage]) -> list[ModelMessage]:
+    """
+    Replace the bodies of grammar cards in model responses by their titles
+    """
+    stripped = []
+    for message in messages:
+        if isinstance(message, ModelResponse) and any(
+            isinstance(part, TextPart) and GRAMMAR_CARD_PATTERN.match(part.content) for part in message.parts
+        ):
+            parts = []
+            for part in message.parts:
+                card = GRAMMAR_CARD_PATTERN.match(part.content) if isinstance(part, TextPart) else None
+                parts.append(TextPart(content=f"[Грамматическая карточка: {card.group(1)}]") if card else part)
+            message = replace(message, parts=parts)
+        stripped.append(message)
+    return stripped
+
+
+@dataclass
+class ConversationContext:
+    """
+    Message history that fits the token budget, and the turns still to be folded into the summary
+    """
+    messages: list[ModelMessage]
+    summary: str = ""
+    tokens: int = 0
+    # Turns outside the window that are newer than the stored summary, oldest first
+    unsummarized: list[MessageBlobModel] = field(default_factory=list)
+
+
+async def build_context(session: AsyncSession, user_id: int, budget: int) -> ConversationContext:
+    """
+    Build the message history of a user within a token budget
+
+    Args:
+        session: Database session
+        user_id: Telegram user id
+        budget: Maximum number of tokens of the history, including the summary
+    """
+    blobs = await get_active_message_blobs(session, user_id, MAX_CONTEXT_TURNS)
+    stored_summary = await get_conversation_summary(session, user_id)
+    summary = stored_summary.summary if stored_summary else ""
+
+    remaining = budget - count_tokens(summary)
+    window: list[list[ModelMessage]] = []
+    for blob in blobs:
+        turn = ModelMessagesTypeAdapter.validate_json(blob.data)
+        tokens = count_message_tokens(turn)
+        if tokens > remaining:
+            turn = strip_grammar_cards(turn)
+            tokens = count_message_tokens(turn)
+            # The latest turn is always kept, the agent can't answer a follow-up without it
+            if tokens > remaining and window:
+                break
+        window.append(turn)
+        remaining -= tokens
+
+    older = blobs[len(window):]
+    unsummarized = [
+        blob for blob in reversed(older)
+        if stored_summary is None or blob.created_at > stored_summary.summarized_until
+    ]
+
+    messages: list[ModelMessage] = []
+    if summary:
+        messages.append(ModelRequest(parts=[SystemPromptPart(content=SUMMARY_PREFIX + summary)]))
+    for turn in reversed(window):
+        messages.extend(turn)
+
+    context = ConversationContext(
+        messages=messages,
+        summary=summary,
+        tokens=budget - remaining,
+        unsummarized=unsummarized,
+    )
+    logfire.info(
+        "Context: {turns} turns, {tokens}/{budget} tokens, {unsummarized} turns to summarize",
+        turns=len(window),
+        tokens=context.tokens,
+        budget=budget,
+        unsummarized=len(unsummarized),
+    )
+    return context
+
+
+async def update_summary(session: AsyncSession, user_id: int, context: ConversationContext) -> None:
+    """
+    Fold the turns that have left the window into the stored summary. Meant to run as a background task.
+    """
+    if not context.unsummarized:
+        return
+
+    lines = []
+    for blob in context.unsummarized:
+        for message in strip_grammar_cards(ModelMessagesTypeAdapter.validate_json(blob.data)):
+            speaker = "Ассистент" if isinstance(message, ModelResponse) else "Пользователь"
+            lines.extend(f"{speaker}: {text}" for text in message_texts([message]))
+
+    prompt = f"Предыдущее краткое содержание:\n{context.summary or '-'}\n\nНовые реплики:\n" + "\n".join(lines)
+
+    try:
+        with llm_priority(Priority.BACKGROUND):
+            response = await summary_agent.run(user_prompt=prompt, usage_limits=UsageLimits(request_limit=1))
+    except Exception as e:
+        logfire.error(f"Failed to update the conversation summary of {user_id}: {e}")
+        return
+
+    record_usage("summary", response)
+    summarized_until: datetime = max(blob.created_at for blob in context.unsummarized)
+    await save_conversation_summary(session, user_id, response.output, summarized_until)
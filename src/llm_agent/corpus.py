@@ -0,0 +1,118 @@
+"""
+Grammar corpus versioning.
+
+Every cache that stores data derived from the grammar collection (rendered cards, grammar IDs)
+keys its entries by the corpus version, so a re-index never serves stale entries.
+
+The version is a digest of the point IDs and payloads of the collection: any re-index that changes a
+grammar changes it, an identical re-index keeps the caches. The indexing path writes the same digest
+into the corpus artifact, and the API re-reads it every CORPUS_VERSION_REFRESH_SECONDS, so a re-index
+is picked up without a restart. Reading it scrolls the whole collection, so the refresh runs in the
+background while the requests keep the last known version, and only a cold start waits for it, once
+for all the concurrent requests.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Any, Iterable
+
+import logfire
+from qdrant_client import AsyncQdrantClient
+
+from src.config.settings import Config
+from src.llm_agent.single_flight import corpus_version_flight
+
+config = Config()
+
+CORPUS_VERSION_REFRESH_SECONDS = float(os.getenv("CORPUS_VERSION_REFRESH_SECONDS", "300"))
+
+_corpus_version: str | None = None
+_checked_at = 0.0
+_refresh_task: asyncio.Task | None = None
+
+
+def corpus_digest(collection_name: str, points: Iterable[tuple[str, dict[str, Any]]]) -> str:
+    """
+    Version of a collection from its (point ID, payload) pairs, independent of their order
+    """
+    digest = hashlib.sha1()
+    for point_id, payload in sorted(points, key=lambda point: point[0]):
+        digest.update(point_id.encode("utf-8"))
+        digest.update(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    return f"{collection_name}:{digest.hexdigest()[:12]}"
+
+
+async def read_corpus_version(qdrant_client: AsyncQdrantClient) -> str:
+    """
+    Digest of the grammar collection as it is indexed now
+    """
+    points, offset = [], None
+    while True:
+        batch, offset = await qdrant_client.scroll(
+            collection_name=config.qdrant_collection_name_final,
+            limit=256,
+            offset=offset,
+            with_payload=True,
+            with_vectors=False,
+        )
+        points += [(str(point.id), point.payload) for point in batch]
+        if offset is None:
+            break
+    return corpus_digest(config.qdrant_collection_name_final, points)
+
+
+async def _refresh_corpus_version(qdrant_client: AsyncQdrantClient) -> str:
+    global _corpus_version, _checked_at
+
+    _checked_at = time.monotonic()
+    try:
+        version = await read_corpus_version(qdrant_client)
+    except Exception as e:
+        if _corpus_version is None:
+            raise
+        logfire.warning(f"Failed to read the grammar corpus version, keeping {_corpus_version}: {e}")
+        return _corpus_version
+
+    if version != _corpus_version:
+        logfire.info(f"Grammar corpus version: {version}")
+    _corpus_version = version
+    return version
+
+
+async def get_corpus_version(qdrant_client: AsyncQdrantClient) -> str:
+    """
+    Return the version of the grammar collection, re-read in the background every
+    CORPUS_VERSION_REFRESH_SECONDS.
+
+    GRAMMAR_CORPUS_VERSION overrides the version explicitly. If Qdrant can't be read, the last known
+    version is kept.
+    """
+    global _refresh_task
+
+    override = os.getenv("GRAMMAR_CORPUS_VERSION")
+    if override:
+        return override
+
+    if _corpus_version is None:
+        # INFO: Cold start, the concurrent requests wait for a single read of the collection
+        return await corpus_version_flight.do("corpus_version", lambda: _refresh_corpus_version(qdrant_client))
+
+    stale = time.monotonic() - _checked_at >= CORPUS_VERSION_REFRESH_SECONDS
+    if stale and (_refresh_task is None or _refresh_task.done()):
+        _refresh_task = asyncio.create_task(
+            corpus_version_flight.do("corpus_version", lambda: _refresh_corpus_version(qdrant_client)),
+            name="corpus_version_refresh",
+        )
+
+    return _corpus_version
+
+
+def set_corpus_version(version: str) -> None:
+    """
+    Explicitly set the corpus version until the next refresh, e.g. from the corpus artifact at startup
+    """
+    global _corpus_version, _checked_at
+    _corpus_version = version
+    _checked_at = time.monotonic()
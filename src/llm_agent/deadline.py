@@ -0,0 +1,125 @@
+"""
+Per-request deadline of /invoke with graceful degradation.
+
+A request chains router -> rewriter -> embed -> qdrant -> llm_filter -> generation with tool calls,
+and the bot waits for it. The Deadline is created when the request arrives and carried in the agent
+deps to every tool. Before an optional or expensive step each stage checks the remaining budget and
+degrades instead of running over it:
+
+- "llm_filter_mini": the LLM filter of the retrieved grammars runs on gpt-4.1-mini
+- "skip_llm_filter": the RRF results are returned without the LLM filter
+- "skip_colbert": the lesson retrieval skips the ColBERT rerank
+- "skip_docs": the thinking agent answers without retrieving lessons
+- "bm25_compression": the retrieved lessons are compressed with BM25 instead of ColBERT scores
+
+The fallbacks of the open circuit breakers (see circuit_breaker) are recorded in the same list, and
+the degradations that fired are returned with the response. Whatever is still running when the
+budget is spent is cancelled, so the latency of a request is bounded by REQUEST_DEADLINE_SECONDS.
+"""
+import asyncio
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any
+
+import logfire
+
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "30"))
+
+# Budget a step needs to be started, below it the stage degrades
+LLM_FILTER_SECONDS = float(os.getenv("DEADLINE_LLM_FILTER_SECONDS", "6"))
+LLM_FILTER_FULL_MODEL_SECONDS = float(os.getenv("DEADLINE_LLM_FILTER_FULL_MODEL_SECONDS", "12"))
+COLBERT_SECONDS = float(os.getenv("DEADLINE_COLBERT_SECONDS", "4"))
+DOCS_SECONDS = float(os.getenv("DEADLINE_DOCS_SECONDS", "8"))
+
+DEGRADATIONS = (
+    "llm_filter_mini", "skip_llm_filter", "skip_colbert", "skip_docs", "bm25_compression",
+    # Circuit breaker fallbacks
+    "no_router", "sparse_only", "corpus_card", "skip_answer_cache", "skip_history", "unavailable",
+)
+
+
+class DeadlineStats:
+    """
+    Degradations and exceeded deadlines since the start of the process
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.degraded = 0
+        self.exceeded = 0
+        self.degradations = dict.fromkeys(DEGRADATIONS, 0)
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "deadline_seconds": REQUEST_DEADLINE_SECONDS,
+            "requests": self.requests,
+            "degraded": self.degraded,
+            "exceeded": self.exceeded,
+            **self.degradations,
+        }
+
+
+deadline_stats = DeadlineStats()
+
+
+class Deadline:
+    """
+    Time budget of a request
+
+    Args:
+        seconds: Budget from now, None for an unbounded deadline (evaluation, scripts)
+    """
+
+    def __init__(self, seconds: float | None = None):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds if seconds is not None else math.inf
+        self.degradations: list[str] = []
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def allows(self, degradation: str, seconds: float) -> bool:
+        """
+        Whether a step needing `seconds` fits in the remaining budget, records `degradation` if not
+        """
+        remaining = self.remaining()
+        if remaining >= seconds:
+            return True
+
+        logfire.warning(
+            "Deadline: {degradation}, {remaining:.1f}s left of {seconds}s",
+            degradation=degradation,
+            remaining=remaining,
+            seconds=self.seconds,
+        )
+        self.degrade(degradation)
+        return False
+
+    def degrade(self, degradation: str) -> None:
+        """
+        Record a degradation of the request
+        """
+        if not self.degradations:
+            deadline_stats.degraded += 1
+        self.degradations.append(degradation)
+        deadline_stats.degradations[degradation] += 1
+
+    @asynccontextmanager
+    async def bounded(self):
+        """
+        Cancel the block once the budget is spent, raising TimeoutError
+        """
+        if self.seconds is None:
+            yield
+            return
+        timeout = asyncio.timeout(self.remaining())
+        try:
+            async with timeout:
+                yield
+        except TimeoutError:
+            if timeout.expired():
+                deadline_stats.exceeded += 1
+                logfire.warning("Deadline of {seconds}s exceeded", seconds=self.seconds)
+            raise
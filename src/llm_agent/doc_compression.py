@@ -0,0 +1,200 @@
+"""
+Extractive compression of the lessons retrieved for the thinking agent.
+
+retrieve_docs put the full text of up to five lessons into the prompt, thousands of tokens of which
+usually only a few paragraphs are about the question. The lessons are split into spans (paragraphs,
+sentences of the long ones), the spans are scored against the HyDE query with the local encoders
+already loaded for the retrieval, and the best ones are kept within DOCS_TOKEN_BUDGET, in their
+original order with "…" for the omitted parts:
+
+- ColBERT (late interaction) MaxSim of the query tokens over the span tokens
+- BM25 of the span against the query when ColBERT isn't loaded or the request deadline is close
+  ("bm25_compression")
+
+`POST /evaluate/docs_compression` compares the prompt tokens, latency and answers with and without it.
+Off by default (DOCS_COMPRESSION=true enables it) until that evaluation is run against the production
+corpus.
+"""
+import asyncio
+import os
+import re
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Callable, Sequence
+
+import numpy as np
+from fastembed import LateInteractionTextEmbedding, SparseTextEmbedding
+
+from src.llm_agent.deadline import COLBERT_SECONDS
+from src.llm_agent.pipeline_metrics import pipeline_stage
+from src.llm_agent.tokens import count_tokens, truncate_tokens
+
+DOCS_COMPRESSION = os.getenv("DOCS_COMPRESSION", "false").lower() == "true"
+DOCS_TOKEN_BUDGET = int(os.getenv("DOCS_TOKEN_BUDGET", "1500"))
+# Paragraphs longer than this are split into sentences
+DOCS_MAX_SPAN_TOKENS = int(os.getenv("DOCS_MAX_SPAN_TOKENS", "150"))
+
+PARAGRAPH_SEPARATOR = re.compile(r"\n\s*\n")
+SENTENCE_SEPARATOR = re.compile(r"(?<=[.!?…])\s+|\n")
+OMISSION = "…"
+
+_compression_enabled: ContextVar[bool] = ContextVar("docs_compression", default=DOCS_COMPRESSION)
+
+
+@contextmanager
+def docs_compression(enabled: bool):
+    """
+    Enable or disable the compression of the lessons retrieved inside the block (evaluation)
+    """
+    token = _compression_enabled.set(enabled)
+    try:
+        yield
+    finally:
+        _compression_enabled.reset(token)
+
+
+@dataclass
+class Span:
+    """
+    Paragraph or sentence of a lesson
+    """
+    doc: int
+    position: int
+    text: str
+    tokens: int
+
+
+class CompressionStats:
+    """
+    Tokens of the retrieved lessons before and after the compression, since the start of the process
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.bm25_calls = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "bm25_calls": self.bm25_calls,
+            "tokens_in": self.tokens_in,
+            "tokens_out": self.tokens_out,
+            "kept_ratio": round(self.tokens_out / self.tokens_in, 3) if self.tokens_in else 1.0,
+        }
+
+
+compression_stats = CompressionStats()
+
+
+def split_spans(text: str, max_span_tokens: int = DOCS_MAX_SPAN_TOKENS) -> list[str]:
+    """
+    Paragraphs of the text, the ones longer than `max_span_tokens` split into sentences
+    """
+    spans = []
+    for paragraph in PARAGRAPH_SEPARATOR.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if count_tokens(paragraph) <= max_span_tokens:
+            spans.append(paragraph)
+        else:
+            spans += [sentence.strip() for sentence in SENTENCE_SEPARATOR.split(paragraph) if sentence.strip()]
+    return spans
+
+
+def colbert_scores(model: LateInteractionTextEmbedding, query: str, spans: list[str]) -> list[float]:
+    """
+    MaxSim: the similarity of every query token with its closest span token, summed
+    """
+    query_embedding = next(iter(model.query_embed(query)))
+    return [float((query_embedding @ np.asarray(tokens).T).max(axis=1).sum()) for tokens in model.embed(spans)]
+
+
+def bm25_scores(model: SparseTextEmbedding, query: str, spans: list[str]) -> list[float]:
+    query_embedding = next(iter(model.query_embed(query)))
+    weights = dict(zip(query_embedding.indices.tolist(), query_embedding.values.tolist()))
+    return [
+        sum(weights.get(index, 0.0) * value for index, value in zip(embedding.indices.tolist(), embedding.values.tolist()))
+        for embedding in model.embed(spans)
+    ]
+
+
+def compress(
+        texts: list[str],
+        score: Callable[[list[str]], Sequence[float]],
+        token_budget: int = DOCS_TOKEN_BUDGET,
+) -> list[str]:
+    """
+    Keep the best scored spans of the texts within the token budget. Texts that already fit are returned
+    as they are, texts without a kept span are dropped. If no span fits, the best ranked text is truncated.
+
+    Args:
+        texts: Texts of the retrieved lessons, the best ranked first
+        score: Relevance of every span to the query
+        token_budget: Maximum tokens of the kept spans
+    """
+    spans = [
+        Span(doc, position, text, count_tokens(text))
+        for doc, content in enumerate(texts)
+        for position, text in enumerate(split_spans(content))
+    ]
+    if sum(span.tokens for span in spans) <= token_budget:
+        return texts
+
+    scores = score([span.text for span in spans])
+    kept, used = [], 0
+    # Ties go to the better ranked lesson and to the earlier span
+    for index in sorted(range(len(spans)), key=lambda i: (-scores[i], spans[i].doc, spans[i].position)):
+        if used + spans[index].tokens <= token_budget:
+            kept.append(spans[index])
+            used += spans[index].tokens
+
+    if not kept:
+        # Every span is over the budget (a lesson without paragraph or sentence breaks)
+        return [truncate_tokens(texts[0], token_budget - count_tokens(OMISSION)) + OMISSION]
+
+    compressed = []
+    for doc in range(len(texts)):
+        doc_spans = sorted((span for span in kept if span.doc == doc), key=lambda span: span.position)
+        if not doc_spans:
+            continue
+        parts = [OMISSION] if doc_spans[0].position > 0 else []
+        for previous, span in zip([None, *doc_spans], doc_spans):
+            if previous is not None and span.position > previous.position + 1:
+                parts.append(OMISSION)
+            parts.append(span.text)
+        compressed.append("\n\n".join(parts))
+    return compressed
+
+
+async def compress_docs(deps, query: str, texts: list[str]) -> list[str]:
+    """
+    Compress the retrieved lessons against the HyDE query, with ColBERT if the deadline allows it
+
+    Args:
+        deps: Agent deps with the local encoders and the deadline
+        query: HyDE query of the retrieval
+        texts: Texts of the retrieved lessons
+    """
+    if not _compression_enabled.get() or not texts:
+        return texts
+
+    model = deps.late_interaction_model
+    if model is not None and deps.deadline.allows("bm25_compression", COLBERT_SECONDS):
+        score = partial(colbert_scores, model, query)
+    else:
+        compression_stats.bm25_calls += 1
+        score = partial(bm25_scores, deps.sparse_embedding, query)
+
+    with pipeline_stage("compression"):
+        # INFO: The encoders are CPU-bound, the event loop keeps serving the other requests meanwhile
+        compressed = await asyncio.to_thread(compress, texts, score, DOCS_TOKEN_BUDGET)
+
+    compression_stats.calls += 1
+    compression_stats.tokens_in += sum(count_tokens(text) for text in texts)
+    compression_stats.tokens_out += sum(count_tokens(text) for text in compressed)
+    return compressed
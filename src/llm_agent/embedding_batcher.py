@@ -0,0 +1,133 @@
+"""
+Micro-batching of the query embedding requests.
+
+Every retrieval embeds a single query, while the embeddings endpoint takes a list of inputs.
+Queries arriving within EMBEDDING_BATCH_WINDOW_MS of each other, from any request, are sent in a
+single embeddings.create call (at most EMBEDDING_BATCH_SIZE inputs) and the vectors are handed
+back to the waiting coroutines. Under load this trades a few milliseconds of latency for far
+fewer requests against the rate limits. The embeddings of the last EMBEDDING_CACHE_MAX_SIZE texts
+are kept, repeated queries are not sent again.
+"""
+import asyncio
+import os
+from collections import OrderedDict
+
+from openai import AsyncOpenAI
+
+from src.config.settings import Config
+
+config = Config()
+
+EMBEDDING_BATCH_WINDOW = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5")) / 1000
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_CACHE_MAX_SIZE = int(os.getenv("EMBEDDING_CACHE_MAX_SIZE", "2000"))
+
+
+class EmbeddingBatcher:
+    """
+    Collects the texts to embed and sends them in batches
+
+    Args:
+        model: Embedding model
+        window: Seconds to wait for more texts after the first one of a batch
+        max_batch: Maximum number of texts in a single request, a full batch is sent right away
+        cache_size: Number of embeddings kept for repeated texts, 0 disables the cache
+    """
+
+    def __init__(
+            self,
+            model: str,
+            window: float = EMBEDDING_BATCH_WINDOW,
+            max_batch: int = EMBEDDING_BATCH_SIZE,
+            cache_size: int = EMBEDDING_CACHE_MAX_SIZE,
+    ):
+        self.model = model
+        self.window = window
+        self.max_batch = max_batch
+        self.cache_size = cache_size
+        self.texts = 0
+        self.batches = 0
+        self.cache_hits = 0
+
+        self._cache: OrderedDict[str, list[float]] = OrderedDict()
+
+        # Texts waiting for the next batch per client, with the futures of their callers
+        self._pending: dict[AsyncOpenAI, dict[str, list[asyncio.Future]]] = {}
+        self._timers: dict[AsyncOpenAI, asyncio.TimerHandle] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def embed(self, openai_client: AsyncOpenAI, text: str) -> list[float]:
+        """
+        Return the embedding of the text, computed together with the other texts of its batch
+        """
+        if text in self._cache:
+            self.cache_hits += 1
+            self._cache.move_to_end(text)
+            return self._cache[text]
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.texts += 1
+
+        pending = self._pending.setdefault(openai_client, {})
+        # The same text in one batch is only sent once
+        pending.setdefault(text, []).append(future)
+
+        if len(pending) >= self.max_batch:
+            self._flush(openai_client)
+        elif openai_client not in self._timers:
+            self._timers[openai_client] = loop.call_later(self.window, self._flush, openai_client)
+
+        return await future
+
+    def _flush(self, openai_client: AsyncOpenAI) -> None:
+        timer = self._timers.pop(openai_client, None)
+        if timer is not None:
+            timer.cancel()
+
+        batch = self._pending.pop(openai_client, None)
+        if batch:
+            self.batches += 1
+            task = asyncio.create_task(self._send(openai_client, batch))
+            # Keep a reference, the event loop only holds weak ones
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, openai_client: AsyncOpenAI, batch: dict[str, list[asyncio.Future]]) -> None:
+        texts = list(batch)
+        try:
+            response = await openai_client.embeddings.create(model=self.model, input=texts)
+            if len(response.data) != len(texts):
+                raise ValueError(f"Expected {len(texts)} embeddings, got {len(response.data)}")
+        except Exception as e:
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+
+        for item in response.data:
+            self._remember(texts[item.index], item.embedding)
+            for future in batch[texts[item.index]]:
+                if not future.done():
+                    future.set_result(item.embedding)
+
+    def _remember(self, text: str, embedding: list[float]) -> None:
+        if self.cache_size <= 0:
+            return
+        self._cache[text] = embedding
+        self._cache.move_to_end(text)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "texts": self.texts,
+            "batches": self.batches,
+            "cache_hits": self.cache_hits,
+            "cached": len(self._cache),
+            "mean_batch_size": round(self.texts / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+embedding_batcher = EmbeddingBatcher(config.embedding_model)
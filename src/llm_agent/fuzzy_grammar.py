@@ -0,0 +1,242 @@
+"""
+Typo-tolerant lookup of grammar names.
+
+Mistyped endings ("-고 십다", "는 동한") and Korean typed with the Latin layout active ("rhtlvek")
+don't match the pattern table, and the hybrid search with the LLM filter often finds nothing for
+them. The lookup corrects them before that path:
+
+- Latin words are transliterated with the 2-set (dubeolsik) keyboard layout when they form valid
+  syllables: "rkrh" -> "가고"
+- Grammar name variants are decomposed into jamo, so a missing batchim or a wrong vowel is a single
+  edit, and indexed SymSpell-style: every string obtained by deleting up to MAX_EDIT_DISTANCE jamo
+  points to its variants. A query looks up its own deletes, the candidates are checked with the
+  Damerau-Levenshtein distance and ranked by it.
+"""
+import os
+import re
+from dataclasses import dataclass
+from itertools import combinations
+from typing import Any, Iterable
+
+from src.llm_agent.grammar_patterns import CHOSEONG, CONTRACTED, INPUT_ALTERNATIVE, JONGSEONG, JUNGSEONG, SEPARATOR, \
+    display_name, expand_name, jamo_syllables
+
+FUZZY_GRAMMAR_LOOKUP = os.getenv("FUZZY_GRAMMAR_LOOKUP", "true").lower() == "true"
+
+MAX_EDIT_DISTANCE = 2
+
+# 2-set keyboard layout, shift only changes these keys
+LAYOUT = dict(zip("qwertyuiopasdfghjklzxcvbnm", "ㅂㅈㄷㄱㅅㅛㅕㅑㅐㅔㅁㄴㅇㄹㅎㅗㅓㅏㅣㅋㅌㅊㅍㅠㅜㅡ"))
+LAYOUT.update(zip("QWERTOP", "ㅃㅉㄸㄲㅆㅒㅖ"))
+
+COMPOUND_VOWELS = {
+    ("ㅗ", "ㅏ"): "ㅘ", ("ㅗ", "ㅐ"): "ㅙ", ("ㅗ", "ㅣ"): "ㅚ", ("ㅜ", "ㅓ"): "ㅝ",
+    ("ㅜ", "ㅔ"): "ㅞ", ("ㅜ", "ㅣ"): "ㅟ", ("ㅡ", "ㅣ"): "ㅢ",
+}
+COMPOUND_FINALS = {
+    ("ㄱ", "ㅅ"): "ㄳ", ("ㄴ", "ㅈ"): "ㄵ", ("ㄴ", "ㅎ"): "ㄶ", ("ㄹ", "ㄱ"): "ㄺ", ("ㄹ", "ㅁ"): "ㄻ",
+    ("ㄹ", "ㅂ"): "ㄼ", ("ㄹ", "ㅅ"): "ㄽ", ("ㄹ", "ㅌ"): "ㄾ", ("ㄹ", "ㅍ"): "ㄿ", ("ㄹ", "ㅎ"): "ㅀ",
+    ("ㅂ", "ㅅ"): "ㅄ",
+}
+
+LATIN_WORD = re.compile(r"[A-Za-z]+")
+
+
+def _is_vowel(jamo: str) -> bool:
+    return jamo in JUNGSEONG
+
+
+def compose(jamo: list[str]) -> str | None:
+    """
+    Compose typed jamo into syllables like the 2-set IME, None if a jamo is left without a syllable
+    """
+    syllables = []
+    i, n = 0, len(jamo)
+    while i < n:
+        if _is_vowel(jamo[i]) or i + 1 >= n or not _is_vowel(jamo[i + 1]):
+            return None
+        initial, vowel = jamo[i], jamo[i + 1]
+        i += 2
+        if i < n and (vowel, jamo[i]) in COMPOUND_VOWELS:
+            vowel = COMPOUND_VOWELS[(vowel, jamo[i])]
+            i += 1
+
+        # A consonant followed by a vowel starts the next syllable
+        final = ""
+        if i < n and jamo[i] in JONGSEONG and not (i + 1 < n and _is_vowel(jamo[i + 1])):
+            final = jamo[i]
+            i += 1
+            if i < n and (final, jamo[i]) in COMPOUND_FINALS and not (i + 1 < n and _is_vowel(jamo[i + 1])):
+                final = COMPOUND_FINALS[(final, jamo[i])]
+                i += 1
+
+        code = (CHOSEONG.index(initial) * 21 + JUNGSEONG.index(vowel)) * 28 + JONGSEONG.index(final)
+        syllables.append(chr(0xAC00 + code))
+    return "".join(syllables)
+
+
+def transliterate_layout(text: str) -> str:
+    """
+    Replace the Latin words typed with the 2-set layout by Hangul, words that don't form valid syllables are kept
+    """
+    def replace(word: re.Match) -> str:
+        jamo = [LAYOUT.get(char, LAYOUT.get(char.lower())) for char in word.group()]
+        return compose(jamo) or word.group()
+
+    return LATIN_WORD.sub(replace, text)
+
+
+def jamo_string(text: str) -> str:
+    """
+    Jamo of the Hangul in the text, without syllable boundaries and spaces
+    """
+    return "".join(f"{l}{v}{t}" for l, v, t in jamo_syllables(text) if l is not None)
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Damerau-Levenshtein distance (optimal string alignment), limit + 1 once it is over the limit
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def allowed_distance(term: str) -> int:
+    """
+    Edits tolerated for a term of this many jamo: none for particles, one for short endings
+    """
+    if len(term) < 4:
+        return 0
+    if len(term) < 7:
+        return 1
+    return MAX_EDIT_DISTANCE
+
+
+def deletes(term: str, distance: int) -> set[str]:
+    """
+    Strings obtained by deleting up to `distance` jamo of the term
+    """
+    result = {term}
+    for count in range(1, min(distance, len(term) - 1) + 1):
+        for positions in combinations(range(len(term)), count):
+            result.add("".join(char for index, char in enumerate(term) if index not in positions))
+    return result
+
+
+@dataclass
+class FuzzyCandidate:
+    """
+    Grammar found for a mistyped name
+
+    Args:
+        pattern: Display name of the grammar
+        variant: Variant of the name that matched
+        distance: Jamo edits between the input and the variant
+    """
+    pattern: str
+    variant: str
+    distance: int
+
+
+class FuzzyGrammarLookup:
+    """
+    SymSpell-style index of the grammar name variants over jamo
+
+    Args:
+        grammar_names: grammar_name_kr of the corpus entries
+    """
+
+    def __init__(self, grammar_names: Iterable[str]):
+        self.terms: list[tuple[str, str, str]] = []
+        self.index: dict[str, list[int]] = {}
+        self.lookups = 0
+        self.hits = 0
+        self.transliterated = 0
+        self.max_term_length = 0
+
+        seen = set()
+        for grammar_name in grammar_names:
+            pattern = display_name(grammar_name)
+            for variant in expand_name(grammar_name):
+                term = jamo_string(variant)
+                if CONTRACTED in variant or not term or (pattern, term) in seen:
+                    continue
+                seen.add((pattern, term))
+                self.terms.append((term, pattern, variant))
+                self.max_term_length = max(self.max_term_length, len(term))
+                for delete in deletes(term, allowed_distance(term)):
+                    self.index.setdefault(delete, []).append(len(self.terms) - 1)
+
+    def candidates(self, query: str, limit: int = 5) -> list[FuzzyCandidate]:
+        """
+        Grammars within their allowed distance of the jamo query, closest and longest first
+        """
+        found: dict[int, int] = {}
+        for delete in deletes(query, MAX_EDIT_DISTANCE):
+            for term_index in self.index.get(delete, ()):
+                if term_index in found:
+                    continue
+                term = self.terms[term_index][0]
+                found[term_index] = edit_distance(query, term, allowed_distance(term))
+
+        ranked = sorted(
+            (distance, -len(self.terms[index][0]), index)
+            for index, distance in found.items()
+            if distance <= allowed_distance(self.terms[index][0])
+        )
+        result, patterns = [], set()
+        for distance, _, index in ranked:
+            _, pattern, variant = self.terms[index]
+            if pattern not in patterns:
+                patterns.add(pattern)
+                result.append(FuzzyCandidate(pattern, variant, distance))
+        return result[:limit]
+
+    def lookup(self, text: str, limit: int = 5) -> list[FuzzyCandidate]:
+        """
+        Ranked grammars for the Korean parts of a message, each part is compared as a whole
+        """
+        self.lookups += 1
+        korean = transliterate_layout(text)
+        if korean != text:
+            self.transliterated += 1
+
+        korean = INPUT_ALTERNATIVE.sub(r"\1", korean.replace("(", "").replace(")", ""))
+        candidates: list[FuzzyCandidate] = []
+        for chunk in SEPARATOR.split(korean.replace("-", " ")):
+            query = jamo_string(chunk)
+            # Longer parts (whole sentences) can't be within the distance of a name
+            if query and len(query) <= self.max_term_length + MAX_EDIT_DISTANCE:
+                candidates += self.candidates(query, limit)
+
+        candidates.sort(key=lambda candidate: candidate.distance)
+        unique, patterns = [], set()
+        for candidate in candidates:
+            if candidate.pattern not in patterns:
+                patterns.add(candidate.pattern)
+                unique.append(candidate)
+        if unique:
+            self.hits += 1
+        return unique[:limit]
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "terms": len(self.terms),
+            "index_size": len(self.index),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "transliterated": self.transliterated,
+            "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+        }
@@ -0,0 +1,391 @@
+"""
+Local extraction of grammar patterns from conjugated Korean input.
+
+Most direct grammar searches only need the query rewriter to map a conjugated form to the pattern
+of the corpus: "가고 싶어요" -> "-고 싶다", "는 동안" -> "-는 동안". The extractor does it with a
+pattern table generated from the grammar_name_kr fields of the corpus, in microseconds:
+
+- Text is decomposed into jamo, one "LVT|" group per syllable, so that endings attached as batchim
+  ("-(으)ㄴ", "-(으)ㄹ 수 있다") match the final consonant of the stem
+- Names are expanded into their variants: optional parts "(으)", alternatives "아/어", "것"/"거",
+  contractions of 아/어 with the stem ("가야", "해야")
+- The final "다" of multi-word constructions is stripped and the last stem syllable may change its
+  vowel or drop ㄹ, so that any conjugated ending matches ("싶어요", "돼요", "마세요"). A one-syllable
+  stem only takes the vowels of its own contractions (하 -> 해, 보 -> 봐, 거 stays 거), otherwise
+  "ㄹ 거다" would match any ㄹ followed by ㄱ ("서울 가요")
+
+The longest match wins. Short patterns (particles, one-syllable endings) only match when they are
+the whole Korean input, and single-word patterns inside a sentence must start at a word boundary:
+"-(으)세요" is typed alone or as one word ("가세요"), not found in "물을 주세요". Everything else goes
+to the query rewriter.
+
+Off by default (LOCAL_PATTERN_EXTRACTOR=true enables it) until the accuracy is measured on the logged
+rewrites of production:
+    python -m src.llm_agent.grammar_patterns --rewrites rewrites.jsonl
+"""
+import argparse
+import itertools
+import json
+import os
+import re
+import time
+import unicodedata
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Iterable
+
+if TYPE_CHECKING:
+    from src.utils.corpus_artifact import CorpusArtifact
+
+GRAMMAR_LIST_PATH = os.getenv("GRAMMAR_LIST_PATH", "data/grammar-level-1/final/grammar_list_clean_word2md.md")
+
+LOCAL_PATTERN_EXTRACTOR = os.getenv("LOCAL_PATTERN_EXTRACTOR", "false").lower() == "true"
+
+# Matches with fewer fixed jamo (about two syllables) must cover the whole Korean input
+MIN_MATCH_JAMO = 4
+# Multi-word constructions ("-(으)ㄹ 거다") outrank the sentence endings they are conjugated with ("예요")
+CONSTRUCTION_BONUS = 3
+
+CHOSEONG = "ㄱㄲㄴㄷㄸㄹㅁㅂㅃㅅㅆㅇㅈㅉㅊㅋㅌㅍㅎ"
+JUNGSEONG = "ㅏㅐㅑㅒㅓㅔㅕㅖㅗㅘㅙㅚㅛㅜㅝㅞㅟㅠㅡㅢㅣ"
+JONGSEONG = ["", *"ㄱㄲㄳㄴㄵㄶㄷㄹㄺㄻㄼㄽㄾㄿㅀㅁㅂㅄㅅㅆㅇㅈㅊㅋㅌㅍㅎ"]
+VOWEL = "[ㅏ-ㅣ]"
+# Vowels of a one-syllable open stem once contracted with 아/어: 하 -> 해, 보 -> 봐, 되 -> 돼, 주 -> 줘
+STEM_VOWELS = {"ㅏ": "ㅏㅐ", "ㅗ": "ㅗㅘ", "ㅜ": "ㅜㅝ", "ㅚ": "ㅚㅙ", "ㅣ": "ㅣㅕ", "ㅡ": "ㅡㅓ"}
+
+# Contraction of 아/어 with a stem ending in a vowel: 가 + 아야 -> 가야
+CONTRACTED = "~"
+
+POS_PREFIX = re.compile(r"^(?:[VANА]/)*[VANА]\s*\+\s*")
+POS_SUFFIX = re.compile(r"\s*\+\s*(?:[VANА]/)*[VANА]$")
+QUOTED = re.compile(r"«[^»]*»")
+NON_KOREAN = re.compile(r"[^가-힣ㄱ-ㅣ()/\-\s~]+")
+INPUT_ALTERNATIVE = re.compile(r"([가-힣ㄱ-ㅎ()]+)(?:/[가-힣ㄱ-ㅎ()]+)+")
+SEPARATOR = re.compile(r"[^가-힣ㄱ-ㅣ\s]+")
+
+
+def jamo_syllables(text: str) -> list[list[str]]:
+    """
+    Decompose Hangul into [L, V, T] syllables. A standalone consonant becomes the batchim of the
+    previous open syllable ("으ㄹ" -> 을) or a batchim-only syllable, "~" is kept as a contraction.
+    """
+    syllables = []
+    for char in unicodedata.normalize("NFC", text):
+        code = ord(char) - 0xAC00
+        if 0 <= code < 11172:
+            syllables.append([CHOSEONG[code // 588], JUNGSEONG[code % 588 // 28], JONGSEONG[code % 28]])
+        elif "ㄱ" <= char <= "ㅎ":
+            if syllables and syllables[-1][0] is not None and syllables[-1][1] and not syllables[-1][2]:
+                syllables[-1][2] = char
+            else:
+                syllables.append(["", "", char])
+        elif char == CONTRACTED:
+            syllables.append([None, None, None])
+    return syllables
+
+
+def encode(text: str) -> str:
+    """
+    Jamo of the syllables, each followed by "|"
+    """
+    return "".join(f"{l}{v}{t}|" for l, v, t in jamo_syllables(text) if l is not None)
+
+
+def display_name(grammar_name_kr: str) -> str:
+    """
+    Grammar name without the parts of speech and the Russian glosses: "V + -고 싶다" -> "-고 싶다"
+    """
+    alternatives = []
+    for alternative in QUOTED.sub("", grammar_name_kr).split(","):
+        alternative = POS_SUFFIX.sub("", POS_PREFIX.sub("", alternative.strip())).strip()
+        if alternative:
+            alternatives.append(alternative)
+    return ", ".join(alternatives)
+
+
+def _syllable_count(piece: str) -> int:
+    return len(jamo_syllables(re.sub(r"\([^)]*\)", "", piece)))
+
+
+def _expand_token(token: str) -> list[str]:
+    """
+    Alternatives of a token: "아/어서" -> 아서, 어서 (+ 해서, contracted ~서), "이/가" -> 이, 가
+    """
+    pieces = [piece.strip("-") for piece in token.split("/")]
+    if len(pieces) == 1:
+        return pieces
+
+    *heads, last = pieces
+    suffix = ""
+    if all(_syllable_count(head) == 1 for head in heads) and _syllable_count(last) > 1:
+        suffix = last[1:]
+        last = last[:1]
+
+    options = [head + suffix for head in heads] + [last + suffix]
+    if {"아", "어"} <= set(heads + [last]):
+        options += ["해" + suffix, CONTRACTED + suffix]
+    return options
+
+
+def _expand_optional(text: str) -> list[str]:
+    """
+    Variants with and without every optional part: "(으)면" -> 으면, 면
+    """
+    parts = re.split(r"\(([^)]*)\)", text)
+    variants = []
+    for choice in itertools.product([True, False], repeat=len(parts) // 2):
+        variant = parts[0]
+        for index, keep in enumerate(choice):
+            variant += (parts[2 * index + 1] if keep else "") + parts[2 * index + 2]
+        variants.append(variant)
+    return variants
+
+
+def expand_name(grammar_name_kr: str) -> list[str]:
+    """
+    Surface variants of a grammar name, words separated by spaces
+    """
+    variants = []
+    name = QUOTED.sub("", grammar_name_kr)
+    for alternative in re.split(r",|\s/\s", name):
+        alternative = NON_KOREAN.sub(" ", POS_SUFFIX.sub("", POS_PREFIX.sub("", alternative.strip())))
+        tokens = [token for token in alternative.split() if token.strip("-/")]
+        if not tokens:
+            continue
+        for combination in itertools.product(*[_expand_token(token) for token in tokens]):
+            for variant in _expand_optional(" ".join(combination)):
+                variant = variant.replace("-", "").strip()
+                variants.append(variant)
+                # Endings written with 으 attach to vowel stems as batchim: -은 적이 -> 본 적이
+                if tokens[0].startswith("-") and variant[:1] in ("은", "을", "음", "읍"):
+                    variants.append(jamo_syllables(variant[0])[0][2] + variant[1:])
+    for variant in list(variants):
+        if "것" in variant:
+            variants.append(variant.replace("것이다", "거다").replace("것", "거"))
+    return list(dict.fromkeys(variant for variant in variants if variant))
+
+
+@dataclass
+class PatternVariant:
+    """
+    Compiled variant of a grammar name
+
+    Args:
+        pattern: Display name of the grammar returned on a match
+        regex: Regex over the jamo encoding
+        literal: Longest fixed part of the regex, checked before running it
+        score: Number of jamo matched by the regex
+        stripped: Whether the final "다" was stripped and any ending may follow
+        construction: Whether the variant has several words, so it may start inside the first word of a sentence
+    """
+    pattern: str
+    regex: re.Pattern
+    literal: str
+    score: int
+    stripped: bool
+    construction: bool
+
+
+def compile_variant(pattern: str, variant: str) -> PatternVariant | None:
+    stripped = " " in variant and variant.endswith("다") and len(variant.replace(" ", "")) > 1
+    syllables = jamo_syllables(variant[:-1] if stripped else variant)
+    if not syllables:
+        return None
+    short_stem = stripped and len(jamo_syllables(variant[:-1].split()[-1])) == 1
+
+    pieces: list[tuple[str, bool]] = []
+    for index, (l, v, t) in enumerate(syllables):
+        if l is None:
+            pieces.append((VOWEL + r"\|", False))
+        elif short_stem and index == len(syllables) - 1 and not t:
+            # 하 -> 해요, 했어요; 되 -> 돼요; 보 -> 봐요
+            pieces += [(l, True), (f"[{STEM_VOWELS.get(v, v)}]" + r"[^|]?\|", False)]
+        elif stripped and index == len(syllables) - 1 and not t:
+            # Open stem: 보이 -> 보여요
+            pieces += [(l, True), (VOWEL + r"[^|]?\|", False)]
+        elif stripped and index == len(syllables) - 1 and t == "ㄹ":
+            # ㄹ is dropped before some endings: 말 -> 마세요
+            pieces += [(l + v, True), (r"ㄹ?\|", False)]
+        else:
+            pieces.append((f"{l}{v}{t}|", True))
+
+    literals, current = [], ""
+    for text, fixed in pieces:
+        if fixed:
+            current += text
+        else:
+            literals.append(current)
+            current = ""
+    literals.append(current)
+
+    regex = "".join(re.escape(text) if fixed else text for text, fixed in pieces)
+    fixed_jamo = sum(len(text.replace("|", "")) for text, fixed in pieces if fixed)
+    if fixed_jamo < 2:
+        # "~ 주" would match any open syllable followed by 지, 자, 주...
+        return None
+
+    # A vowel of a contraction or of a conjugated stem counts as one jamo
+    score = fixed_jamo + sum(1 for _, fixed in pieces if not fixed)
+    if stripped:
+        score += CONSTRUCTION_BONUS
+    return PatternVariant(pattern, re.compile(regex), max(literals, key=len), score, stripped, " " in variant)
+
+
+@dataclass
+class PatternMatch:
+    """
+    Grammar pattern found in a text
+    """
+    pattern: str
+    matched: str
+    score: int
+
+
+class GrammarPatternExtractor:
+    """
+    Pattern table generated from the grammar names of the corpus
+
+    Args:
+        grammar_names: grammar_name_kr of the corpus entries
+    """
+
+    def __init__(self, grammar_names: Iterable[str]):
+        self.variants: list[PatternVariant] = []
+        self.hits = 0
+        self.misses = 0
+
+        seen = set()
+        for grammar_name in grammar_names:
+            pattern = display_name(grammar_name)
+            for variant in expand_name(grammar_name):
+                if (pattern, variant) in seen:
+                    continue
+                seen.add((pattern, variant))
+                compiled = compile_variant(pattern, variant)
+                if compiled:
+                    self.variants.append(compiled)
+
+    @property
+    def patterns(self) -> list[str]:
+        return list(dict.fromkeys(variant.pattern for variant in self.variants))
+
+    def match(self, text: str) -> PatternMatch | None:
+        """
+        The longest grammar pattern in the Korean parts of the text, ties go to the latest one
+        """
+        text = INPUT_ALTERNATIVE.sub(r"\1", text.replace("(", "").replace(")", ""))
+
+        best, best_key = None, None
+        for words in (chunk.split() for chunk in SEPARATOR.split(text.replace("-", " "))):
+            encoded_words = [word for word in map(encode, words) if word]
+            chunk = "".join(encoded_words)
+            if not chunk:
+                continue
+            # Offsets of the words in the encoding, spaces are not encoded
+            word_starts = set(itertools.accumulate(map(len, encoded_words[:-1]), initial=0))
+            for variant in self.variants:
+                if variant.literal not in chunk:
+                    continue
+                found = variant.regex.search(chunk)
+                if not found:
+                    continue
+                whole = found.start() == 0 and (found.end() == len(chunk) or variant.stripped)
+                if variant.score < MIN_MATCH_JAMO and not whole:
+                    continue
+                if not variant.construction and len(encoded_words) > 1 and found.start() not in word_starts:
+                    continue
+                key = (variant.score, found.end())
+                if best_key is None or key > best_key:
+                    best, best_key = PatternMatch(variant.pattern, found.group(), variant.score), key
+        return best
+
+    def extract(self, text: str) -> str | None:
+        """
+        Search query for the grammar in the text, None if the query rewriter is needed
+        """
+        found = self.match(text)
+        if found:
+            self.hits += 1
+            return found.pattern
+        self.misses += 1
+        return None
+
+    def stats(self) -> dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "patterns": len(self.patterns),
+            "variants": len(self.variants),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+def load_grammar_names(corpus_artifact: "CorpusArtifact | None" = None, path: str = GRAMMAR_LIST_PATH) -> list[str]:
+    """
+    grammar_name_kr of the corpus artifact, or of the headers of the grammar list it was built from
+    """
+    if corpus_artifact is not None:
+        return corpus_artifact.grammar_names()
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as file:
+        # Same header format as src.utils.md_to_json.parse_entry_v2: "## grammar_name_kr | grammar_name_rus"
+        return [line[3:].split("|", 1)[0].strip() for line in file if line.startswith("## ")]
+
+
+def same_pattern(extractor: GrammarPatternExtractor, pattern: str | None, rewrite: str) -> bool:
+    """
+    Whether an extracted pattern and a logged rewrite name the same grammar
+    """
+    if rewrite == "None" or pattern is None:
+        return pattern is None and rewrite == "None"
+    if encode(pattern) == encode(rewrite):
+        return True
+    rewrite_match = extractor.match(rewrite)
+    return rewrite_match is not None and rewrite_match.pattern == pattern
+
+
+def evaluate_rewrites(extractor: GrammarPatternExtractor, rewrites: list[dict]) -> dict[str, Any]:
+    """
+    Coverage and accuracy of the extractor against logged {"prompt", "rewrite"} pairs of the query rewriter.
+    Inputs without a local match go to the rewriter, so only the local matches can be wrong. Coverage is
+    counted over the rewrites naming a grammar, a match of a "None" rewrite is an error.
+    """
+    matched, covered, correct, seconds = 0, 0, 0, 0.0
+    errors = []
+    for item in rewrites:
+        started = time.perf_counter()
+        found = extractor.match(item["prompt"])
+        seconds += time.perf_counter() - started
+
+        if found is None:
+            continue
+        matched += 1
+        covered += item["rewrite"] != "None"
+        if same_pattern(extractor, found.pattern, item["rewrite"]):
+            correct += 1
+        else:
+            errors.append({**item, "extracted": found.pattern})
+
+    grammars = sum(item["rewrite"] != "None" for item in rewrites)
+    return {
+        "rewrites": len(rewrites),
+        "matched": matched,
+        "coverage": round(covered / grammars, 3) if grammars else 0.0,
+        "accuracy": round(correct / matched, 3) if matched else 0.0,
+        "mean_latency_us": round(seconds / len(rewrites) * 1e6, 1) if rewrites else 0.0,
+        "errors": errors,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the local grammar pattern extractor against logged rewrites")
+    parser.add_argument("--rewrites", required=True, help='JSON lines of {"prompt": ..., "rewrite": ...}')
+    parser.add_argument("--grammar-list", default=GRAMMAR_LIST_PATH)
+    args = parser.parse_args()
+
+    with open(args.rewrites, encoding="utf-8") as file:
+        logged = [json.loads(line) for line in file if line.strip()]
+
+    report = evaluate_rewrites(GrammarPatternExtractor(load_grammar_names(path=args.grammar_list)), logged)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
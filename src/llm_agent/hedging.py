@@ -0,0 +1,131 @@
+"""
+Hedged requests for the latency-critical calls.
+
+The median latency of the router and of the Qdrant queries is fine, but their slowest calls dominate
+the p99 of /invoke. With HEDGED_REQUESTS, a call still running after the recent p95 latency of its
+class is duplicated and the first response wins, the other call is cancelled. At most
+HEDGE_BUDGET_PERCENT of the calls of a class are hedged, which caps the extra load.
+
+The stats compare the observed p99 with the p99 of the first attempts. The first attempt of a call
+won by its hedge is cancelled, so its latency is counted as the time until the hedge answered and
+the improvement is a lower bound.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, TypeVar
+
+import logfire
+
+T = TypeVar("T")
+
+HEDGED_REQUESTS = os.getenv("HEDGED_REQUESTS", "false").lower() == "true"
+HEDGE_BUDGET_PERCENT = float(os.getenv("HEDGE_BUDGET_PERCENT", "5"))
+# Latencies needed before the p95 is trusted
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "50"))
+
+LATENCY_WINDOW = 1000
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))] if ordered else 0.0
+
+
+class HedgeClass:
+    """
+    Recent latencies and hedging outcomes of a class of calls
+
+    Args:
+        name: Name of the class, e.g. "router"
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        # Latency of the first attempts, drives the hedging delay
+        self.primary_latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+        # Latency seen by the callers
+        self.latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    def delay(self) -> float | None:
+        """
+        Seconds after which a call is hedged, None while there are too few samples
+        """
+        if len(self.primary_latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return _percentile(list(self.primary_latencies), 0.95)
+
+    def within_budget(self) -> bool:
+        return self.hedged + 1 <= self.calls * HEDGE_BUDGET_PERCENT / 100
+
+    def stats(self) -> dict[str, Any]:
+        p99 = _percentile(list(self.latencies), 0.99)
+        p99_primary = _percentile(list(self.primary_latencies), 0.99)
+        return {
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "extra_requests_percent": round(self.hedged / self.calls * 100, 2) if self.calls else 0.0,
+            "hedge_delay_ms": round((self.delay() or 0.0) * 1000, 1),
+            "p50_ms": round(_percentile(list(self.latencies), 0.5) * 1000, 1),
+            "p99_ms": round(p99 * 1000, 1),
+            "p99_unhedged_ms": round(p99_primary * 1000, 1),
+            "p99_improvement_ms": round((p99_primary - p99) * 1000, 1),
+        }
+
+
+hedge_classes: dict[str, HedgeClass] = {}
+
+
+def hedging_stats() -> dict[str, dict[str, Any]]:
+    return {name: hedge_class.stats() for name, hedge_class in hedge_classes.items()}
+
+
+async def hedged(name: str, call: Callable[[], Awaitable[T]]) -> T:
+    """
+    Await `call()`, duplicated once it runs longer than the recent p95 of its class
+
+    Args:
+        name: Class of the call, its latencies and budget are shared
+        call: Idempotent call, invoked a second time for the hedge
+    """
+    hedge_class = hedge_classes.setdefault(name, HedgeClass(name))
+    hedge_class.calls += 1
+    started = time.perf_counter()
+
+    delay = hedge_class.delay() if HEDGED_REQUESTS else None
+    if delay is None:
+        result = await call()
+        hedge_class.primary_latencies.append(time.perf_counter() - started)
+        hedge_class.latencies.append(time.perf_counter() - started)
+        return result
+
+    primary = asyncio.create_task(call())
+    tasks = {primary}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done and hedge_class.within_budget():
+            hedge_class.hedged += 1
+            logfire.info("Hedging {name} after {delay_ms:.0f} ms", name=name, delay_ms=delay * 1000)
+            tasks.add(asyncio.create_task(call()))
+
+        # The first successful response wins, a failure only counts if both attempts fail
+        winner, pending = None, set(tasks)
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winner = next((task for task in done if task.exception() is None), None)
+
+        elapsed = time.perf_counter() - started
+        if winner is not None and winner is not primary:
+            hedge_class.hedge_wins += 1
+        # A cancelled first attempt would have taken at least as long
+        hedge_class.primary_latencies.append(elapsed)
+        hedge_class.latencies.append(elapsed)
+        return (winner or primary).result()
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,423 @@
+"""
+Central scheduler of the OpenAI API calls.
+
+Every agent and the embedding calls go through `openai_client`, whose HTTP transport asks the
+scheduler for a slot before sending a request. Per model, the scheduler keeps:
+- request and token buckets refilled at the rate limits of the model (LLM_REQUEST_LIMITS,
+  LLM_TOKEN_LIMITS), synced down with the x-ratelimit-remaining-* headers of the responses;
+- an adaptive concurrency limit (AIMD): +1 per window of successful requests, halved on a 429
+  and reduced when the latency goes above LLM_LATENCY_TARGET_SECONDS. A 429 also pauses the
+  model for its retry-after;
+- a queue ordered by priority, so interactive /invoke traffic is always served before the
+  background and evaluation requests waiting for the same model.
+
+The priority of the calls is taken from the context, see `llm_priority`.
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from enum import IntEnum
+
+import httpx
+import logfire
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from pydantic_ai.models.openai import OpenAIModel
+from pydantic_ai.providers.openai import OpenAIProvider
+
+from src.llm_agent.circuit_breaker import circuit_breakers
+from src.llm_agent.pipeline_metrics import LLM_QUEUE_WAIT
+
+
+def parse_model_limits(value: str) -> dict[str, float]:
+    """
+    Parse "gpt-4.1=500,gpt-4.1-mini=1000,*=500" into a dict, "*" being the limit of the other models
+    """
+    limits = {}
+    for item in value.split(","):
+        if "=" in item:
+            model, limit = item.split("=", 1)
+            limits[model.strip()] = float(limit)
+    return limits
+
+
+# Per minute, the defaults are the tier 1 limits of the models used by the agents
+LLM_REQUEST_LIMITS = parse_model_limits(os.getenv("LLM_REQUEST_LIMITS", "*=500"))
+LLM_TOKEN_LIMITS = parse_model_limits(
+    os.getenv("LLM_TOKEN_LIMITS", "gpt-4.1=30000,gpt-4.1-mini=200000,*=1000000")
+)
+LLM_INITIAL_CONCURRENCY = int(os.getenv("LLM_INITIAL_CONCURRENCY", "8"))
+LLM_MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", "1"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_LATENCY_TARGET = float(os.getenv("LLM_LATENCY_TARGET_SECONDS", "30"))
+
+# Completion tokens reserved for a request without max_tokens
+DEFAULT_COMPLETION_TOKENS = 1000
+# Seconds to pause a model after a 429 without a retry-after header
+DEFAULT_RETRY_AFTER = 1.0
+
+SCHEDULED_PATHS = ("/chat/completions", "/embeddings", "/responses")
+
+# INFO: Send every OpenAI call to the local stub (python -m src.benchmarks.openai_stub) for offline benchmarks
+USE_OPENAI_STUB = os.getenv("USE_OPENAI_STUB", "false").lower() == "true"
+OPENAI_STUB_URL = os.getenv("OPENAI_STUB_URL", "http://localhost:8100/v1")
+
+
+class Priority(IntEnum):
+    """
+    Priority classes of the LLM calls, a lower value is served first
+    """
+    INTERACTIVE = 0
+    BACKGROUND = 1
+    EVALUATION = 2
+
+
+_priority: ContextVar[Priority] = ContextVar("llm_priority", default=Priority.INTERACTIVE)
+
+
+@contextmanager
+def llm_priority(priority: Priority):
+    """
+    Run the LLM calls made inside the block (and in the tasks started from it) with the given priority
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """
+    Bucket holding up to `per_minute` units, refilled continuously at `per_minute` units per minute
+
+    Args:
+        per_minute: Capacity of the bucket and its refill rate per minute
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """
+        Seconds until `amount` units are available. Amounts above the capacity only wait for a full bucket.
+        """
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.level -= amount
+
+    def sync(self, remaining: float, now: float) -> None:
+        """
+        Lower the level to the remaining limit reported by the API, other clients may share the key
+        """
+        self._refill(now)
+        self.level = min(self.level, remaining)
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    sequence: int
+    tokens: int = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+@dataclass
+class Slot:
+    """
+    Permission to send a single request, reports the response back to the limiter
+    """
+    limiter: "ModelLimiter"
+    priority: Priority
+    started_at: float
+    status: int | None = None
+    headers: httpx.Headers | None = None
+
+    def response(self, status: int, headers: httpx.Headers) -> None:
+        self.status = status
+        self.headers = headers
+
+
+class ModelLimiter:
+    """
+    Request and token buckets, adaptive concurrency limit and priority queue of a single model
+
+    Args:
+        model: Model name
+        requests_per_minute: Request rate limit
+        tokens_per_minute: Token rate limit
+    """
+
+    def __init__(self, model: str, requests_per_minute: float, tokens_per_minute: float):
+        self.model = model
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.limit = float(LLM_INITIAL_CONCURRENCY)
+        self.active = 0
+        self.paused_until = 0.0
+        self.rate_limited = 0
+
+        self._queue: list[_Waiter] = []
+        self._sequence = itertools.count()
+        self._last_decrease = 0.0
+        self._timer: asyncio.TimerHandle | None = None
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for waiter in self._queue if not waiter.future.done())
+
+    async def acquire(self, tokens: int, priority: Priority) -> None:
+        waiter = _Waiter(priority, next(self._sequence), tokens, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, waiter)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            # The slot was granted right before the caller went away
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.active -= 1
+                self._dispatch()
+            raise
+
+    def release(self, slot: Slot) -> None:
+        now = time.monotonic()
+        self.active -= 1
+
+        headers = slot.headers or httpx.Headers()
+        for bucket, header in ((self.requests, "x-ratelimit-remaining-requests"),
+                               (self.tokens, "x-ratelimit-remaining-tokens")):
+            if header in headers:
+                try:
+                    bucket.sync(float(headers[header]), now)
+                except ValueError:
+                    pass
+
+        # Only react once to the requests started before the last decrease, they all saw the same overload
+        can_decrease = slot.started_at >= self._last_decrease
+        if slot.status == 429:
+            self.rate_limited += 1
+            self.paused_until = max(self.paused_until, now + retry_after(headers))
+            if can_decrease:
+                self._decrease(0.5, now)
+        elif slot.status is not None and slot.status < 400:
+            if now - slot.started_at > LLM_LATENCY_TARGET:
+                if can_decrease:
+                    self._decrease(0.9, now)
+            else:
+                self.limit = min(LLM_MAX_CONCURRENCY, self.limit + 1 / self.limit)
+
+        self._dispatch()
+
+    def _decrease(self, factor: float, now: float) -> None:
+        self.limit = max(LLM_MIN_CONCURRENCY, self.limit * factor)
+        self._last_decrease = now
+        logfire.info(
+            "LLM scheduler: {model} concurrency limit lowered to {limit}", model=self.model, limit=int(self.limit)
+        )
+
+    def _dispatch(self) -> None:
+        """
+        Grant slots to the waiters in priority order, as long as the limits allow it
+        """
+        now = time.monotonic()
+        while self._queue:
+            waiter = self._queue[0]
+            if waiter.future.done():
+                heapq.heappop(self._queue)
+                continue
+            if self.active >= int(self.limit):
+                return
+
+            wait = max(
+                self.paused_until - now,
+                self.requests.wait_time(1, now),
+                self.tokens.wait_time(waiter.tokens, now),
+            )
+            if wait > 0:
+                self._schedule(wait)
+                return
+
+            heapq.heappop(self._queue)
+            self.requests.take(1, now)
+            self.tokens.take(waiter.tokens, now)
+            self.active += 1
+            waiter.future.set_result(None)
+
+    def _schedule(self, delay: float) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def stats(self) -> dict:
+        return {
+            "concurrency_limit": round(self.limit, 2),
+            "active": self.active,
+            "queued": self.queued,
+            "rate_limited": self.rate_limited,
+            "requests_available": int(self.requests.level),
+            "tokens_available": int(self.tokens.level),
+        }
+
+
+class LLMScheduler:
+    """
+    Hands out request slots per model and records the queue wait time per priority class
+
+    Args:
+        request_limits: Requests per minute per model, "*" for the other models
+        token_limits: Tokens per minute per model, "*" for the other models
+    """
+
+    def __init__(self, request_limits: dict[str, float] = None, token_limits: dict[str, float] = None):
+        self.request_limits = request_limits or LLM_REQUEST_LIMITS
+        self.token_limits = token_limits or LLM_TOKEN_LIMITS
+        self.models: dict[str, ModelLimiter] = {}
+        # Last queue wait times per priority class, for the stats
+        self.waits: dict[Priority, deque[float]] = {priority: deque(maxlen=1000) for priority in Priority}
+
+    def limiter(self, model: str) -> ModelLimiter:
+        if model not in self.models:
+            self.models[model] = ModelLimiter(
+                model,
+                self.request_limits.get(model, self.request_limits.get("*", 500)),
+                self.token_limits.get(model, self.token_limits.get("*", 1_000_000)),
+            )
+        return self.models[model]
+
+    @asynccontextmanager
+    async def slot(self, model: str, tokens: int, priority: Priority | None = None):
+        """
+        Wait for a slot of the model, the block sends the request and reports its response to the slot
+        """
+        priority = _priority.get() if priority is None else priority
+        limiter = self.limiter(model)
+
+        queued_at = time.monotonic()
+        await limiter.acquire(tokens, priority)
+        started_at = time.monotonic()
+
+        wait = started_at - queued_at
+        self.waits[priority].append(wait)
+        LLM_QUEUE_WAIT.labels(model, priority.name.lower()).observe(wait)
+
+        slot = Slot(limiter, priority, started_at)
+        try:
+            yield slot
+        finally:
+            limiter.release(slot)
+
+    def stats(self) -> dict:
+        waits = {}
+        for priority, values in self.waits.items():
+            ordered = sorted(values)
+            waits[priority.name.lower()] = {
+                "count": len(ordered),
+                "p50": round(ordered[len(ordered) // 2], 3) if ordered else 0.0,
+                "p95": round(ordered[int(len(ordered) * 0.95)], 3) if ordered else 0.0,
+            }
+        return {
+            "models": {model: limiter.stats() for model, limiter in self.models.items()},
+            "queue_wait": waits,
+        }
+
+
+def retry_after(headers: httpx.Headers) -> float:
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return DEFAULT_RETRY_AFTER
+
+
+def estimate_request(request: httpx.Request) -> tuple[str | None, int]:
+    """
+    Return the model of an OpenAI API request and an estimate of the tokens it will use
+    """
+    if not request.url.path.endswith(SCHEDULED_PATHS):
+        return None, 0
+    try:
+        body = json.loads(request.content)
+    except ValueError:
+        return None, 0
+    if not isinstance(body, dict) or "model" not in body:
+        return None, 0
+
+    # About 4 bytes per token for the mix of Russian, Korean and JSON in the prompts
+    prompt_tokens = len(request.content) // 4
+    if request.url.path.endswith("/embeddings"):
+        return body["model"], prompt_tokens
+
+    completion_tokens = (
+        body.get("max_completion_tokens") or body.get("max_tokens")
+        or body.get("max_output_tokens") or DEFAULT_COMPLETION_TOKENS
+    )
+    return body["model"], prompt_tokens + completion_tokens
+
+
+class SchedulerTransport(httpx.AsyncBaseTransport):
+    """
+    HTTP transport sending the OpenAI API requests only once the scheduler gives them a slot
+
+    Args:
+        scheduler: Scheduler to take the slots from
+        transport: Transport that actually sends the requests
+    """
+
+    def __init__(self, scheduler: LLMScheduler, transport: httpx.AsyncBaseTransport | None = None):
+        self.scheduler = scheduler
+        self._transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        model, tokens = estimate_request(request)
+        if model is None:
+            return await self._transport.handle_async_request(request)
+
+        # INFO: Outcomes and latencies feed the circuit breakers, the queue wait is not counted
+        breaker = circuit_breakers["openai_embeddings" if request.url.path.endswith("/embeddings") else "openai_chat"]
+
+        # INFO: For streamed responses the slot is released once the headers arrive
+        async with self.scheduler.slot(model, tokens) as slot:
+            with breaker.track() as call:
+                response = await self._transport.handle_async_request(request)
+                call.error = response.status_code >= 500
+            slot.response(response.status_code, response.headers)
+            return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+llm_scheduler = LLMScheduler()
+
+openai_client = AsyncOpenAI(
+    http_client=DefaultAsyncHttpxClient(transport=SchedulerTransport(llm_scheduler)),
+    **({"base_url": OPENAI_STUB_URL, "api_key": "stub"} if USE_OPENAI_STUB else {}),
+)
+_provider = OpenAIProvider(openai_client=openai_client)
+
+
+def openai_model(model_name: str) -> OpenAIModel:
+    """
+    OpenAI model for an agent, with its requests going through the scheduler
+    """
+    return OpenAIModel(model_name, provider=_provider)
@@ -0,0 +1,199 @@
+"""
+Prometheus metrics of the API pipelines, independent of logfire.
+
+/invoke goes through router -> rewriter -> embed -> qdrant -> llm_filter -> generation -> history_write,
+and its mode is only known at the end. The stages of a request are therefore collected by a Pipeline
+in the request context and observed with the final mode once the request is done. Stages measured
+outside of a pipeline (other endpoints, evaluation) are observed right away with an empty mode.
+"""
+import functools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, TypeVar
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from src.utils.prometheus import METRICS_PREFIX
+
+T = TypeVar("T")
+
+# LLM calls take seconds, the local stages milliseconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+STAGE_LATENCY = Histogram(
+    f"{METRICS_PREFIX}_stage_duration_seconds",
+    "Duration of the pipeline stages",
+    ["pipeline", "stage", "mode"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_LATENCY = Histogram(
+    f"{METRICS_PREFIX}_request_duration_seconds",
+    "Duration of the pipeline requests",
+    ["pipeline", "mode"],
+    buckets=LATENCY_BUCKETS,
+)
+IN_FLIGHT = Gauge(
+    f"{METRICS_PREFIX}_in_flight",
+    "Requests and stages currently running",
+    ["pipeline", "stage"],
+)
+LLM_TOKENS = Counter(
+    f"{METRICS_PREFIX}_llm_tokens",
+    "Tokens used by the agents",
+    ["agent", "kind"],
+)
+LLM_QUEUE_WAIT = Histogram(
+    f"{METRICS_PREFIX}_llm_queue_wait_seconds",
+    "Time LLM calls wait for a scheduler slot",
+    ["model", "priority"],
+    buckets=LATENCY_BUCKETS,
+)
+
+
+class Pipeline:
+    """
+    Stage durations of a single request, observed with its mode when the request is done
+
+    Args:
+        name: Name of the pipeline, e.g. "invoke"
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.mode = ""
+        self.finished = False
+        self.stages: list[tuple[str, float]] = []
+
+    def record(self, stage: str, seconds: float) -> None:
+        # Background tasks (history writes) finish after the response
+        if self.finished:
+            STAGE_LATENCY.labels(self.name, stage, self.mode).observe(seconds)
+        else:
+            self.stages.append((stage, seconds))
+
+    def finish(self, seconds: float) -> None:
+        self.finished = True
+        for stage, stage_seconds in self.stages:
+            STAGE_LATENCY.labels(self.name, stage, self.mode).observe(stage_seconds)
+        REQUEST_LATENCY.labels(self.name, self.mode).observe(seconds)
+
+
+_pipeline: ContextVar[Pipeline | None] = ContextVar("pipeline", default=None)
+
+
+@contextmanager
+def pipeline_request(name: str):
+    """
+    Measure a request and the stages run inside the block. Set `mode` on the yielded pipeline,
+    requests failing with an exception are labelled "error".
+    """
+    pipeline = Pipeline(name)
+    token = _pipeline.set(pipeline)
+    IN_FLIGHT.labels(name, "").inc()
+    started = time.perf_counter()
+    try:
+        yield pipeline
+    except BaseException:
+        pipeline.mode = "error"
+        raise
+    finally:
+        IN_FLIGHT.labels(name, "").dec()
+        _pipeline.reset(token)
+        pipeline.finish(time.perf_counter() - started)
+
+
+def measure_pipeline(name: str):
+    """
+    Decorator measuring an endpoint as a pipeline, labelled with the "mode" of its dict response
+    """
+    def decorator(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            with pipeline_request(name) as pipeline:
+                response = await endpoint(*args, **kwargs)
+                if isinstance(response, dict):
+                    pipeline.mode = response.get("mode", "")
+                return response
+
+        return wrapper
+
+    return decorator
+
+
+def _record(pipeline: Pipeline | None, stage: str, seconds: float) -> None:
+    if pipeline is not None:
+        pipeline.record(stage, seconds)
+    else:
+        STAGE_LATENCY.labels("", stage, "").observe(seconds)
+
+
+@contextmanager
+def pipeline_stage(stage: str):
+    """
+    Measure a stage of the current pipeline
+    """
+    pipeline = _pipeline.get()
+    in_flight = IN_FLIGHT.labels(pipeline.name if pipeline else "", stage)
+    in_flight.inc()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        in_flight.dec()
+        _record(pipeline, stage, time.perf_counter() - started)
+
+
+def timed_task(stage: str, fn: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+    """
+    Wrap a background task so that it is measured as a stage of the pipeline that scheduled it
+    """
+    pipeline = _pipeline.get()
+
+    async def wrapper(*args, **kwargs) -> T:
+        started = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            _record(pipeline, stage, time.perf_counter() - started)
+
+    return wrapper
+
+
+class TokenTally:
+    """
+    Tokens of the agent runs made inside a tally_tokens() block, including its tasks
+    """
+
+    def __init__(self):
+        self.tokens = 0
+
+
+_token_tally: ContextVar[TokenTally | None] = ContextVar("token_tally", default=None)
+
+
+@contextmanager
+def tally_tokens():
+    """
+    Count the tokens recorded with record_usage() inside the block and the tasks started from it
+    """
+    tally = TokenTally()
+    token = _token_tally.set(tally)
+    try:
+        yield tally
+    finally:
+        _token_tally.reset(token)
+
+
+def record_usage(agent: str, result: T) -> T:
+    """
+    Count the tokens of an agent run, returns the run result
+    """
+    usage = result.usage()
+    LLM_TOKENS.labels(agent, "request").inc(usage.request_tokens or 0)
+    LLM_TOKENS.labels(agent, "response").inc(usage.response_tokens or 0)
+
+    tally = _token_tally.get()
+    if tally is not None:
+        tally.tokens += (usage.request_tokens or 0) + (usage.response_tokens or 0)
+    return result
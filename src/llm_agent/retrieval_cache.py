@@ -0,0 +1,316 @@
+"""
+Cache of grammar retrieval results.
+
+The same grammars are searched over and over ("-고 싶다", "은/는 vs 이/가"), and every search embeds the
+query, runs the hybrid Qdrant query and the LLM filter. The cache stores what the retrieval decided, not
+the grammars: the IDs and scores of the returned points, with an empty list when nothing passed the LLM
+filter. On a hit the entries are read from the corpus artifact, or fetched by ID from Qdrant when the
+artifact is missing or of another version.
+
+Entries are keyed by the corpus version and the normalized retrieval parameters, so a re-index never
+serves stale IDs. They are held in a per-process LRU; with Redis they are also shared between the
+workers and the frequency of every query is counted in a sorted set per day, kept for
+RETRIEVAL_CACHE_QUERY_DAYS, and on deploy the most frequent queries of these days are loaded (or
+recomputed) before the first request.
+"""
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from dataclasses import astuple, dataclass
+from typing import Any, Awaitable, Callable
+
+import logfire
+from qdrant_client import AsyncQdrantClient
+
+from src.llm_agent.circuit_breaker import circuit_breakers
+from src.llm_agent.single_flight import normalize_key
+from src.schemas.schemas import GrammarEntryV2, RetrievedGrammar
+from src.utils.corpus_artifact import CorpusArtifact
+
+RETRIEVAL_CACHE = os.getenv("RETRIEVAL_CACHE", "true").lower() == "true"
+RETRIEVAL_CACHE_MAX_SIZE = int(os.getenv("RETRIEVAL_CACHE_MAX_SIZE", "5000"))
+RETRIEVAL_CACHE_MAX_AGE = float(os.getenv("RETRIEVAL_CACHE_MAX_AGE_HOURS", "24")) * 3600
+# Most frequent queries loaded on deploy, and the time the warm-up may take
+RETRIEVAL_CACHE_WARM_QUERIES = int(os.getenv("RETRIEVAL_CACHE_WARM_QUERIES", "200"))
+RETRIEVAL_CACHE_WARM_SECONDS = float(os.getenv("RETRIEVAL_CACHE_WARM_SECONDS", "60"))
+# Days of lookups counted for the warm-up, the queries contain user prompts and expire with them
+RETRIEVAL_CACHE_QUERY_DAYS = int(os.getenv("RETRIEVAL_CACHE_QUERY_DAYS", "7"))
+DAY_SECONDS = 86400
+
+REDIS_PREFIX = "retrieval"
+# Sorted sets of the queries by the number of lookups, "<key>:<day>" per day and "<key>" for their union
+REDIS_QUERIES_KEY = f"{REDIS_PREFIX}:queries"
+
+
+@dataclass(frozen=True)
+class RetrievalQuery:
+    """
+    Normalized parameters of a grammar retrieval, the cache and coalescing key
+
+    Args:
+        search_query: Query of the hybrid search
+        user_prompt: Prompt the LLM filter compares the results with, empty without the filter
+        retrieve_top_k: Number of points retrieved per prefetch
+        llm_filter: Whether the results are filtered by the LLM
+        filter_model: Model of the LLM filter, empty without the filter
+        dense: Whether the search uses the dense embeddings, False for sparse-only
+    """
+    search_query: str
+    user_prompt: str
+    retrieve_top_k: int
+    llm_filter: bool
+    filter_model: str
+    dense: bool
+
+    @classmethod
+    def create(
+            cls,
+            search_query: str,
+            user_prompt: str,
+            retrieve_top_k: int,
+            llm_filter: bool,
+            filter_model: str,
+            dense: bool,
+    ) -> "RetrievalQuery":
+        # Without the filter the prompt doesn't change the result
+        return cls(
+            normalize_key(search_query),
+            normalize_key(user_prompt) if llm_filter else "",
+            retrieve_top_k,
+            llm_filter,
+            filter_model if llm_filter else "",
+            dense,
+        )
+
+    def member(self) -> str:
+        return json.dumps(astuple(self), ensure_ascii=False)
+
+    @classmethod
+    def from_member(cls, member: str | bytes) -> "RetrievalQuery":
+        return cls(*json.loads(member))
+
+
+@dataclass
+class CachedRetrieval:
+    """
+    Decision of a retrieval: IDs and scores of the returned grammars, empty if none passed the filter
+    """
+    ids: list[str]
+    scores: list[float]
+    corpus_version: str
+    llm_filter: bool
+    created_at: float
+
+    def to_json(self) -> str:
+        return json.dumps(self.__dict__)
+
+    @classmethod
+    def from_json(cls, data: str | bytes) -> "CachedRetrieval":
+        return cls(**json.loads(data))
+
+
+def _point_id(grammar_id: str) -> int | str:
+    # Qdrant point IDs are unsigned integers or UUIDs
+    return int(grammar_id) if grammar_id.isdigit() else grammar_id
+
+
+class RetrievalCache:
+    """
+    LRU of retrieval decisions per corpus version, optionally shared through Redis
+
+    Args:
+        max_size: Maximum number of entries in the process, the least recently used ones are evicted first
+        max_age: Seconds after which an entry is recomputed
+    """
+
+    def __init__(self, max_size: int = RETRIEVAL_CACHE_MAX_SIZE, max_age: float = RETRIEVAL_CACHE_MAX_AGE):
+        self.max_size = max_size
+        self.max_age = max_age
+        # Set by the API: the artifact the entries are read from, and the optional Redis client
+        self.artifact: CorpusArtifact | None = None
+        self.redis = None
+
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.qdrant_fetches = 0
+        self.warmed = 0
+
+        self._entries: OrderedDict[tuple[str, RetrievalQuery], CachedRetrieval] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _redis_key(query: RetrievalQuery, corpus_version: str) -> str:
+        digest = hashlib.sha1(query.member().encode("utf-8")).hexdigest()
+        return f"{REDIS_PREFIX}:{corpus_version}:{digest}"
+
+    @staticmethod
+    def _queries_key(day: int) -> str:
+        return f"{REDIS_QUERIES_KEY}:{day}"
+
+    async def _redis_call(self, method: str, *args, **kwargs) -> Any:
+        """
+        Redis command, None without Redis or when it fails: the cache is an optimization
+        """
+        if self.redis is None:
+            return None
+        try:
+            return await getattr(self.redis, method)(*args, **kwargs)
+        except Exception as e:
+            logfire.warning("Retrieval cache: Redis {method} failed: {error}", method=method, error=str(e))
+            return None
+
+    def _store(self, query: RetrievalQuery, entry: CachedRetrieval) -> None:
+        key = (entry.corpus_version, query)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get(self, query: RetrievalQuery, corpus_version: str) -> CachedRetrieval | None:
+        """
+        Cached decision of the query for the corpus version, from the process or from Redis
+        """
+        queries_key = self._queries_key(int(time.time() // DAY_SECONDS))
+        # INFO: A score of 1 is the first lookup of the query that day, the expiry is (re)set on those only
+        if await self._redis_call("zincrby", queries_key, 1, query.member()) == 1:
+            await self._redis_call("expire", queries_key, RETRIEVAL_CACHE_QUERY_DAYS * DAY_SECONDS)
+
+        key = (corpus_version, query)
+        entry = self._entries.get(key)
+        if entry is not None and time.time() - entry.created_at < self.max_age:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+
+        data = await self._redis_call("get", self._redis_key(query, corpus_version))
+        if data is not None:
+            entry = CachedRetrieval.from_json(data)
+            self.redis_hits += 1
+            self._store(query, entry)
+            return entry
+
+        self._entries.pop(key, None)
+        self.misses += 1
+        return None
+
+    async def put(self, query: RetrievalQuery, corpus_version: str, docs: list[RetrievedGrammar] | None) -> None:
+        entry = CachedRetrieval(
+            ids=[doc.id for doc in docs or []],
+            scores=[doc.score for doc in docs or []],
+            corpus_version=corpus_version,
+            llm_filter=query.llm_filter,
+            created_at=time.time(),
+        )
+        self._store(query, entry)
+        await self._redis_call("set", self._redis_key(query, corpus_version), entry.to_json(), ex=int(self.max_age))
+
+    async def hydrate(
+            self,
+            qdrant_client: AsyncQdrantClient,
+            collection_name: str,
+            entry: CachedRetrieval,
+    ) -> list[RetrievedGrammar] | None:
+        """
+        Grammars of a cached decision, None if the retrieval returned nothing
+        """
+        if not entry.ids:
+            return None
+
+        contents: dict[str, GrammarEntryV2] = {}
+        if self.artifact is not None and self.artifact.corpus_version == entry.corpus_version:
+            contents = {grammar_id: self.artifact.entry(grammar_id) for grammar_id in entry.ids if grammar_id in self.artifact}
+
+        missing = [grammar_id for grammar_id in entry.ids if grammar_id not in contents]
+        if missing:
+            self.qdrant_fetches += 1
+            with circuit_breakers["qdrant"].guard():
+                points = await qdrant_client.retrieve(
+                    collection_name=collection_name,
+                    ids=[_point_id(grammar_id) for grammar_id in missing],
+                    with_payload=True,
+                )
+            contents.update({str(point.id): GrammarEntryV2(**point.payload) for point in points})
+
+        return [
+            RetrievedGrammar(id=grammar_id, content=contents[grammar_id], score=score)
+            for grammar_id, score in zip(entry.ids, entry.scores)
+            if grammar_id in contents
+        ] or None
+
+    async def frequent_queries(self, limit: int = RETRIEVAL_CACHE_WARM_QUERIES) -> list[RetrievalQuery]:
+        """
+        Most frequently looked up queries of the last RETRIEVAL_CACHE_QUERY_DAYS across the workers, empty
+        without Redis
+        """
+        today = int(time.time() // DAY_SECONDS)
+        days = [self._queries_key(today - offset) for offset in range(RETRIEVAL_CACHE_QUERY_DAYS)]
+        await self._redis_call("zunionstore", REDIS_QUERIES_KEY, days)
+        await self._redis_call("expire", REDIS_QUERIES_KEY, DAY_SECONDS)
+        members = await self._redis_call("zrevrange", REDIS_QUERIES_KEY, 0, limit - 1) or []
+        return [RetrievalQuery.from_member(member) for member in members]
+
+    async def warm(
+            self,
+            corpus_version: str,
+            retrieve: Callable[[RetrievalQuery], Awaitable[Any]],
+            limit: int = RETRIEVAL_CACHE_WARM_QUERIES,
+            budget_seconds: float = RETRIEVAL_CACHE_WARM_SECONDS,
+    ) -> int:
+        """
+        Load the most frequent queries of the corpus version, the ones missing from Redis are recomputed
+        with `retrieve`, which stores them. Stops once the budget is spent, returns the number of warmed queries
+
+        Args:
+            corpus_version: Version of the served corpus
+            retrieve: Cached retrieval of a query
+            limit: Number of queries
+            budget_seconds: Time the warm-up may take
+        """
+        started = time.monotonic()
+        warmed = 0
+        for query in await self.frequent_queries(limit):
+            if time.monotonic() - started > budget_seconds:
+                logfire.warning("Retrieval cache warm-up stopped after {seconds}s", seconds=budget_seconds)
+                break
+            key = (corpus_version, query)
+            if key in self._entries:
+                continue
+            data = await self._redis_call("get", self._redis_key(query, corpus_version))
+            try:
+                if data is not None:
+                    self._store(query, CachedRetrieval.from_json(data))
+                else:
+                    await retrieve(query)
+            except Exception as e:
+                logfire.warning("Retrieval cache warm-up failed for {query}: {error}", query=query, error=str(e))
+                continue
+            warmed += 1
+
+        self.warmed += warmed
+        logfire.info("Warmed the retrieval cache with {warmed} queries", warmed=warmed)
+        return warmed
+
+    def purge(self) -> int:
+        removed = len(self._entries)
+        self._entries.clear()
+        return removed
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.redis_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "qdrant_fetches": self.qdrant_fetches,
+            "warmed": self.warmed,
+            "hit_rate": round((self.hits + self.redis_hits) / lookups, 3) if lookups else 0.0,
+        }
+
+
+retrieval_cache = RetrievalCache()
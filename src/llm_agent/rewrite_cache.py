@@ -0,0 +1,63 @@
+"""
+Cache of the query rewriter outputs.
+
+The rewriter turns a prompt the local extractors couldn't resolve into a grammar pattern ("None" for
+the prompts that aren't about a grammar). Its output only depends on the prompt, so the patterns are
+kept per normalized prompt and the same question doesn't wait for the LLM again.
+"""
+import os
+from collections import OrderedDict
+from typing import Any
+
+from src.llm_agent.single_flight import normalize_key
+
+REWRITE_CACHE_MAX_SIZE = int(os.getenv("REWRITE_CACHE_MAX_SIZE", "5000"))
+
+
+class RewriteCache:
+    """
+    LRU of the rewritten queries per normalized prompt
+
+    Args:
+        max_size: Maximum number of prompts, the least recently used ones are evicted first
+    """
+
+    def __init__(self, max_size: int = REWRITE_CACHE_MAX_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self._patterns: OrderedDict[str, str] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._patterns)
+
+    def get(self, user_prompt: str) -> str | None:
+        key = normalize_key(user_prompt)
+        pattern = self._patterns.get(key)
+        if pattern is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._patterns.move_to_end(key)
+        return pattern
+
+    def put(self, user_prompt: str, pattern: str) -> None:
+        key = normalize_key(user_prompt)
+        self._patterns[key] = pattern
+        self._patterns.move_to_end(key)
+        while len(self._patterns) > self.max_size:
+            self._patterns.popitem(last=False)
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._patterns),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+rewrite_cache = RewriteCache()
@@ -0,0 +1,104 @@
+"""
+Coalescing of identical concurrent calls.
+
+When several users ask for the same grammar at once, every request would embed the same query,
+search Qdrant and run the same LLM filter. A SingleFlight runs the work once per normalized key:
+the first caller starts it and the concurrent callers with the same key await the same result.
+Nothing is cached, a call that starts after the work is done runs it again. The work is cancelled
+once every caller waiting for it is cancelled, e.g. a discarded speculative retrieval.
+"""
+import asyncio
+import unicodedata
+from typing import Any, Awaitable, Callable, Hashable, TypeVar
+
+import logfire
+
+T = TypeVar("T")
+
+
+def normalize_key(text: str) -> str:
+    """
+    Normalize a query for coalescing: NFKC, case-insensitive, collapsed whitespace
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time and shares its result with the concurrent callers
+
+    Args:
+        name: Name used in the logs and in the stats
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+
+        self._in_flight: dict[Hashable, asyncio.Task] = {}
+        self._waiters: dict[asyncio.Task, int] = {}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Return the result of `fn()`, or of the call already running for the same key.
+        The work runs in its own task, so a caller going away doesn't cancel it for the others,
+        only the last caller going away cancels it.
+        """
+        self.calls += 1
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            logfire.info("{name}: coalesced with an in-flight call", name=self.name)
+        else:
+            task = asyncio.create_task(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[task] == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Mark the exception as retrieved in case every caller went away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "executed": self.calls - self.coalesced,
+            "coalesced": self.coalesced,
+            "coalesced_rate": round(self.coalesced / self.calls, 3) if self.calls else 0.0,
+            "in_flight": self.in_flight,
+        }
+
+
+retrieval_flight = SingleFlight("retrieve_grammars")
+query_rewriter_flight = SingleFlight("query_rewriter")
+llm_filter_flight = SingleFlight("llm_filter")
+corpus_version_flight = SingleFlight("corpus_version")
+
+single_flights = {
+    flight.name: flight
+    for flight in (retrieval_flight, query_rewriter_flight, llm_filter_flight, corpus_version_flight)
+}
+
+
+def single_flight_stats() -> dict[str, dict[str, Any]]:
+    return {name: flight.stats() for name, flight in single_flights.items()}
@@ -0,0 +1,116 @@
+"""
+Speculative execution of a branch while its verdict is still pending.
+
+A direct grammar search runs router -> rewriter -> retrieval, three serial LLM round-trips. With
+SPECULATIVE_ROUTING the rewriter and the retrieval start together with the router, on the bet that
+the message is a grammar search. When the router decides otherwise the branch is cancelled and the
+tokens it already used are counted as wasted. The stats weigh these tokens against the latency saved
+on the accepted speculations.
+"""
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, TypeVar
+
+import logfire
+
+from src.llm_agent.pipeline_metrics import tally_tokens
+
+V = TypeVar("V")
+T = TypeVar("T")
+
+SPECULATIVE_ROUTING = os.getenv("SPECULATIVE_ROUTING", "false").lower() == "true"
+
+
+class SpeculationStats:
+    """
+    Outcomes of the speculations since the start of the process
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.accepted = 0
+        self.rejected = 0
+        # Rejected while still running, the tokens of its unfinished LLM calls are not counted
+        self.cancelled = 0
+        self.wasted_tokens = 0
+        self.saved_seconds = 0.0
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "enabled": SPECULATIVE_ROUTING,
+            "requests": self.requests,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "cancelled": self.cancelled,
+            "wasted_tokens": self.wasted_tokens,
+            "saved_seconds": round(self.saved_seconds, 3),
+            "avg_saved_ms": round(self.saved_seconds / self.accepted * 1000, 1) if self.accepted else 0.0,
+            "wasted_tokens_per_request": round(self.wasted_tokens / self.requests, 1) if self.requests else 0.0,
+        }
+
+
+speculation_stats = SpeculationStats()
+
+
+async def speculate(
+        verdict: Awaitable[V],
+        branch: Callable[[], Awaitable[T]],
+        accept: Callable[[V], bool],
+) -> tuple[V, T | None]:
+    """
+    Run `branch()` concurrently with `verdict`, keep its result only if the verdict accepts it
+
+    Args:
+        verdict: Awaitable deciding whether the branch is needed, e.g. the router run
+        branch: Work needed for an accepted verdict, e.g. rewrite and retrieval
+        accept: Whether the branch is needed for the verdict
+
+    Returns:
+        The verdict and the result of the branch, None if the branch was rejected
+    """
+    speculation_stats.requests += 1
+    branch_seconds = 0.0
+    branch_tally = None
+
+    async def run_branch() -> T:
+        nonlocal branch_seconds, branch_tally
+        branch_started = time.perf_counter()
+        with tally_tokens() as branch_tally:
+            try:
+                return await branch()
+            finally:
+                branch_seconds = time.perf_counter() - branch_started
+
+    started = time.perf_counter()
+    branch_task = asyncio.create_task(run_branch())
+
+    try:
+        verdict_result = await verdict
+    except BaseException:
+        branch_task.cancel()
+        raise
+    verdict_seconds = time.perf_counter() - started
+
+    if not accept(verdict_result):
+        speculation_stats.rejected += 1
+        if not branch_task.done():
+            speculation_stats.cancelled += 1
+            branch_task.cancel()
+            await asyncio.wait([branch_task])
+        # The branch may have failed, its exception doesn't matter anymore
+        if not branch_task.cancelled():
+            branch_task.exception()
+
+        wasted = branch_tally.tokens if branch_tally else 0
+        speculation_stats.wasted_tokens += wasted
+        logfire.info("Speculation rejected, {tokens} tokens wasted", tokens=wasted)
+        return verdict_result, None
+
+    result = await branch_task
+    # Serially the branch would have started after the verdict
+    saved = max(0.0, verdict_seconds + branch_seconds - (time.perf_counter() - started))
+    speculation_stats.accepted += 1
+    speculation_stats.saved_seconds += saved
+    logfire.info("Speculation accepted, {saved_ms:.0f} ms saved", saved_ms=saved * 1000)
+    return verdict_result, result
@@ -0,0 +1,26 @@
+"""
+Token counting for the prompt budgets, with the o200k_base encoding of the GPT-4.1 models.
+"""
+try:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    # tiktoken is not installed or can't download its vocabulary, fall back to an estimate
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    # Cyrillic and Hangul take about a token per two characters
+    return len(text) // 2 + 1
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """
+    Beginning of the text within `max_tokens`
+    """
+    if _encoding is not None:
+        return _encoding.decode(_encoding.encode(text, disallowed_special=())[:max_tokens])
+    return text[:max(max_tokens - 1, 0) * 2]
@@ -0,0 +1,321 @@
+"""
+Translation memory for the /translate endpoint.
+
+The input is split into sentences, every sentence is looked up in the translation_memory table
+by its normalized text and direction (ru-ko / ko-ru), and only the missing ones are sent to the
+translation agent, in a single request per part of the text. The translated sentences are put back
+between the original separators (line breaks, list bullets, numbering), so the formatting of the
+input is kept.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+import logfire
+from pydantic_ai import Agent
+from pydantic_ai.usage import UsageLimits
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.db.crud import get_translations, save_translations
+from src.llm_agent.pipeline_metrics import record_usage
+from src.schemas.schemas import SegmentTranslations
+
+HANGUL_PATTERN = re.compile(r"[ᄀ-ᇿ㄰-㆏가-힣]")
+CYRILLIC_PATTERN = re.compile(r"[Ѐ-ӿ]")
+
+# Indentation, list bullets, numbering and quotes at the start of a line are not translated
+LINE_PREFIX_PATTERN = re.compile(r"[ \t]*(?:(?:[-*•>]|\d+[.)])[ \t]+)*")
+# Sentence end punctuation with closing quotes or brackets, followed by the whitespace to split on
+SENTENCE_END_PATTERN = re.compile(r"[.!?…]+[\"'»”)\]]*(\s+)")
+
+# Long texts are translated in parts of about this many characters, at most TRANSLATION_CONCURRENCY at once
+TRANSLATION_CHUNK_CHARS = int(os.getenv("TRANSLATION_CHUNK_CHARS", "1500"))
+TRANSLATION_CONCURRENCY = int(os.getenv("TRANSLATION_CONCURRENCY", "4"))
+
+translation_semaphore = asyncio.Semaphore(TRANSLATION_CONCURRENCY)
+
+
+@dataclass
+class Segment:
+    """
+    A piece of the input: either a sentence to translate or a separator kept as is
+    """
+    text: str
+    direction: str | None = None
+
+    @property
+    def key(self) -> str:
+        return translation_key(self.text, self.direction)
+
+
+@dataclass
+class TranslationMemoryStats:
+    """
+    Translation memory counters since the start of the process
+    """
+    requests: int = 0
+    segments: int = 0
+    hits: int = 0
+    llm_requests: int = 0
+    saved_tokens: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.segments if self.segments else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "segments": self.segments,
+            "hits": self.hits,
+            "hit_rate": round(self.hit_rate, 3),
+            "llm_requests": self.llm_requests,
+            "saved_tokens": self.saved_tokens,
+        }
+
+
+translation_memory_stats = TranslationMemoryStats()
+
+
+def normalize_sentence(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def detect_direction(text: str) -> str | None:
+    """
+    Return "ko-ru" for Korean text, "ru-ko" for Russian text and None for anything else (numbers, emoji)
+    """
+    if HANGUL_PATTERN.search(text):
+        return "ko-ru"
+    if CYRILLIC_PATTERN.search(text):
+        return "ru-ko"
+    return None
+
+
+def translation_key(text: str, direction: str) -> str:
+    return hashlib.sha256(f"{direction}\n{normalize_sentence(text)}".encode("utf-8")).hexdigest()
+
+
+def split_sentences(text: str) -> list[str]:
+    """
+    Split a line into sentences, keeping the whitespace between them as separate pieces.
+    A lowercase letter after the period means an abbreviation (т.е., г.), not a new sentence.
+    """
+    pieces = []
+    start = 0
+    for match in SENTENCE_END_PATTERN.finditer(text):
+        following = text[match.end():match.end() + 1]
+        if not following or following.islower():
+            continue
+        pieces.append(text[start:match.start(1)])
+        pieces.append(match.group(1))
+        start = match.end()
+    pieces.append(text[start:])
+    return [piece for piece in pieces if piece]
+
+
+def segment_text(text: str) -> list[Segment]:
+    """
+    Split the text into sentences and separators, joining all segments gives back the original text
+    """
+    segments = []
+    for line in text.splitlines(keepends=True):
+        content = line.rstrip("\r\n")
+        ending = line[len(content):]
+
+        prefix = LINE_PREFIX_PATTERN.match(content).group()
+        if prefix:
+            segments.append(Segment(prefix))
+
+        for piece in split_sentences(content[len(prefix):]):
+            segments.append(Segment(piece, detect_direction(piece) if piece.strip() else None))
+
+        if ending:
+            segments.append(Segment(ending))
+
+    return segments
+
+
+async def translate_segments(agent: Agent, sentences: list[str]) -> tuple[list[str], int]:
+    """
+    Translate the sentences with a single agent request
+
+    Returns:
+        Translations in the same order and the number of tokens spent
+    """
+    prompt = (
+        f"Translate each of the {len(sentences)} segments below. They are consecutive sentences of one text, "
+        f"use them as context for each other. Return exactly {len(sentences)} translations in the same order.\n\n"
+        + json.dumps(sentences, ensure_ascii=False)
+    )
+    response = await agent.run(
+        user_prompt=prompt,
+        output_type=SegmentTranslations,
+        usage_limits=UsageLimits(request_limit=2),
+    )
+
+    record_usage("translation", response)
+    translations = response.output.translations
+    if len(translations) != len(sentences):
+        raise ValueError(f"Expected {len(sentences)} translations, got {len(translations)}")
+
+    return translations, response.usage().total_tokens or 0
+
+
+def split_parts(segments: list[Segment], max_chars: int = TRANSLATION_CHUNK_CHARS) -> list[list[Segment]]:
+    """
+    Group the segments into parts of about `max_chars` characters of sentences, translated independently.
+    Parts end on a paragraph break, on a line break if there is no paragraph break for too long,
+    and only on a sentence break for a single huge paragraph.
+    """
+    parts: list[list[Segment]] = [[]]
+    size = 0
+    for index, segment in enumerate(segments):
+        parts[-1].append(segment)
+        if segment.direction:
+            size += len(segment.text)
+            continue
+        if not size or index == len(segments) - 1:
+            continue
+
+        previous = segments[index - 1].text
+        paragraph_break = segment.text == "\n" and previous.endswith("\n")
+        if (
+            (paragraph_break and size >= max_chars // 2)
+            or ("\n" in segment.text and size >= max_chars)
+            or (segment.text.isspace() and size >= max_chars * 2)
+        ):
+            parts.append([])
+            size = 0
+
+    return [part for part in parts if part]
+
+
+class ChunkedTranslation:
+    """
+    Translation of a text with the translation memory. Long texts are split into parts at paragraph
+    boundaries, the sentences missing in each part are translated concurrently (one agent request
+    per part, at most TRANSLATION_CONCURRENCY at once across all requests), and the parts are
+    streamed in order as soon as all the parts before them are done.
+
+    Args:
+        session: Database session
+        agent: Translation agent used for the sentences missing in the translation memory
+        text: Text to translate
+        max_chars: Approximate number of characters to translate in a single agent request
+    """
+
+    def __init__(self, session: AsyncSession, agent: Agent, text: str, max_chars: int = TRANSLATION_CHUNK_CHARS):
+        self.session = session
+        self.agent = agent
+        self.parts = split_parts(segment_text(text), max_chars)
+        # Translation memory usage, filled in when the last part is translated
+        self.report: dict = {}
+
+        self._translated: dict[str, str] = {}
+        self._entries: dict[str, dict] = {}
+        self._llm_requests = 0
+
+    async def stream(self) -> AsyncIterator[str]:
+        """
+        Yield the translated parts in order, joining them gives the whole translation
+        """
+        sentences = [segment for part in self.parts for segment in part if segment.direction]
+        cached = await get_translations(self.session, list({segment.key for segment in sentences}))
+        self._translated = {key: entry.translation for key, entry in cached.items()}
+        if not self.parts:
+            await self._finish(sentences, cached)
+            return
+
+        tasks = [asyncio.create_task(self._translate_part(part)) for part in self.parts]
+        try:
+            for index, (part, task) in enumerate(zip(self.parts, tasks)):
+                await task
+                if index == len(self.parts) - 1:
+                    await self._finish(sentences, cached)
+                yield "".join(
+                    reassemble_segment(segment, self._translated[segment.key]) if segment.direction else segment.text
+                    for segment in part
+                )
+        finally:
+            # The client went away or another part failed, the exceptions of the other parts are retrieved
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def text(self) -> str:
+        return "".join([part async for part in self.stream()])
+
+    async def _translate_part(self, part: list[Segment]) -> None:
+        # Repeated sentences are only translated once
+        missing: dict[str, Segment] = {}
+        for segment in part:
+            if segment.direction and segment.key not in self._translated:
+                missing.setdefault(segment.key, segment)
+        if not missing:
+            return
+
+        async with translation_semaphore:
+            translations, tokens = await translate_segments(
+                self.agent, [segment.text.strip() for segment in missing.values()]
+            )
+        self._llm_requests += 1
+
+        # Share the tokens of the request between the sentences by their length
+        total_length = sum(len(segment.text) for segment in missing.values()) or 1
+        for (key, segment), translation in zip(missing.items(), translations):
+            self._translated.setdefault(key, translation)
+            self._entries.setdefault(key, {
+                "key": key,
+                "direction": segment.direction,
+                "source": normalize_sentence(segment.text),
+                "translation": translation,
+                "tokens": round(tokens * len(segment.text) / total_length),
+            })
+
+    async def _finish(self, sentences: list[Segment], cached: dict) -> None:
+        await save_translations(self.session, list(self._entries.values()))
+
+        hits = sum(1 for segment in sentences if segment.key in cached)
+        saved_tokens = sum(cached[segment.key].tokens for segment in sentences if segment.key in cached)
+
+        translation_memory_stats.requests += 1
+        translation_memory_stats.segments += len(sentences)
+        translation_memory_stats.hits += hits
+        translation_memory_stats.llm_requests += self._llm_requests
+        translation_memory_stats.saved_tokens += saved_tokens
+
+        self.report = {
+            "segments": len(sentences),
+            "hits": hits,
+            "misses": len(self._entries),
+            "saved_tokens": saved_tokens,
+            "parts": len(self.parts),
+            "llm_requests": self._llm_requests,
+        }
+        logfire.info("Translation memory: {report}", report=self.report)
+
+
+async def translate_with_memory(session: AsyncSession, agent: Agent, text: str) -> tuple[str, dict]:
+    """
+    Translate the text, reusing cached sentence translations
+
+    Returns:
+        The translated text and a report of the translation memory usage for this request
+    """
+    translation = ChunkedTranslation(session, agent, text)
+    return await translation.text(), translation.report
+
+
+def reassemble_segment(segment: Segment, translation: str) -> str:
+    """
+    Put the translation in place of the sentence, keeping its surrounding whitespace
+    """
+    stripped = segment.text.strip()
+    start = segment.text.index(stripped)
+    return segment.text[:start] + translation.strip() + segment.text[start + len(stripped):]
@@ -0,0 +1,162 @@
+"""
+Cache warm-up from the message history.
+
+After a deploy every cache is empty and the first users wait for the full pipeline. The message blobs
+show what the users actually ask: the WARMUP_TOP_PROMPTS most frequent prompts and the
+WARMUP_TOP_SELECTIONS most frequent grammar selections of the last WARMUP_HISTORY_BLOBS blobs are
+replayed in the background right after the start, filling the embedding, rewriter, retrieval and
+rendered-card caches. /ready answers 503 with the progress until the job is done or WARMUP_SECONDS
+are spent, so the deployment only routes traffic to a warm instance.
+"""
+import asyncio
+import os
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Iterable
+
+import logfire
+from pydantic_ai.messages import ModelMessagesTypeAdapter, ModelRequest, UserPromptPart
+
+from src.llm_agent.single_flight import normalize_key
+
+WARMUP = os.getenv("WARMUP", "true").lower() == "true"
+WARMUP_SECONDS = float(os.getenv("WARMUP_SECONDS", "120"))
+WARMUP_TOP_PROMPTS = int(os.getenv("WARMUP_TOP_PROMPTS", "100"))
+WARMUP_TOP_SELECTIONS = int(os.getenv("WARMUP_TOP_SELECTIONS", "50"))
+WARMUP_HISTORY_BLOBS = int(os.getenv("WARMUP_HISTORY_BLOBS", "10000"))
+WARMUP_CONCURRENCY = int(os.getenv("WARMUP_CONCURRENCY", "4"))
+
+# The bot stores a grammar selection as a "Selected: <grammar_name_kr> - <grammar_name_rus>" prompt
+SELECTION_PREFIX = "Selected: "
+PROGRESS_LOG_INTERVAL = 10
+
+
+@dataclass
+class HistoryQueries:
+    """
+    Most frequent prompts and selected grammar titles of the history, the most frequent first
+    """
+    prompts: list[str]
+    selections: list[str]
+
+
+def mine_history(
+        blobs: Iterable[bytes],
+        top_prompts: int = WARMUP_TOP_PROMPTS,
+        top_selections: int = WARMUP_TOP_SELECTIONS,
+) -> HistoryQueries:
+    """
+    Count the user prompts of the message blobs by their normalized text, keeping the first spelling seen
+
+    Args:
+        blobs: Serialized messages of the blobs
+        top_prompts: Number of prompts to return
+        top_selections: Number of selections to return
+    """
+    prompts, selections = Counter(), Counter()
+    spellings: dict[str, str] = {}
+    for data in blobs:
+        try:
+            messages = ModelMessagesTypeAdapter.validate_json(data)
+        except Exception as e:
+            logfire.warning(f"Skipping an unreadable message blob: {e}")
+            continue
+
+        for message in messages:
+            if not isinstance(message, ModelRequest):
+                continue
+            for part in message.parts:
+                if not isinstance(part, UserPromptPart) or not isinstance(part.content, str):
+                    continue
+                if part.content.startswith(SELECTION_PREFIX):
+                    selections[part.content.removeprefix(SELECTION_PREFIX).strip()] += 1
+                elif key := normalize_key(part.content):
+                    prompts[key] += 1
+                    spellings.setdefault(key, part.content.strip())
+
+    return HistoryQueries(
+        prompts=[spellings[key] for key, _ in prompts.most_common(top_prompts)],
+        selections=[title for title, _ in selections.most_common(top_selections)],
+    )
+
+
+class WarmupJob:
+    """
+    Runs the warm-up steps within a time budget and reports the progress
+
+    Args:
+        budget_seconds: Time after which the remaining steps are cancelled and the API reports ready
+        concurrency: Number of steps running at once
+    """
+
+    def __init__(self, budget_seconds: float = WARMUP_SECONDS, concurrency: int = WARMUP_CONCURRENCY):
+        self.budget_seconds = budget_seconds
+        self.concurrency = concurrency
+        self.state = "pending"
+        self.total = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = False
+        self.warmed: Counter[str] = Counter()
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    async def run(self, steps: list[tuple[str, Callable[[], Awaitable[Any]]]]) -> None:
+        """
+        Run the steps, a failed step is logged and skipped
+
+        Args:
+            steps: (cache, step) pairs, `cache` names the cache the step fills in the progress
+        """
+        self.state = "running"
+        self.total = len(steps)
+        self.started_at = time.monotonic()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_step(cache: str, step: Callable[[], Awaitable[Any]]) -> None:
+            async with semaphore:
+                try:
+                    await step()
+                    self.warmed[cache] += 1
+                except Exception as e:
+                    self.failed += 1
+                    logfire.warning("Warm-up step of the {cache} cache failed: {error}", cache=cache, error=str(e))
+                self.completed += 1
+                if self.completed % PROGRESS_LOG_INTERVAL == 0 or self.completed == self.total:
+                    logfire.info("Warm-up: {completed}/{total} steps", completed=self.completed, total=self.total)
+
+        try:
+            async with asyncio.timeout(self.budget_seconds):
+                await asyncio.gather(*(run_step(cache, step) for cache, step in steps))
+        except TimeoutError:
+            self.timed_out = True
+            logfire.warning(
+                "Warm-up stopped after {seconds}s, {completed}/{total} steps done",
+                seconds=self.budget_seconds, completed=self.completed, total=self.total,
+            )
+        finally:
+            self.state = "ready"
+            self.finished_at = time.monotonic()
+            logfire.info("Warm-up done: {warmed}", warmed=dict(self.warmed))
+
+    def as_dict(self) -> dict[str, Any]:
+        end = self.finished_at or time.monotonic()
+        return {
+            "state": self.state,
+            "ready": self.ready,
+            "total": self.total,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timed_out": self.timed_out,
+            "progress": round(self.completed / self.total, 3) if self.total else float(self.ready),
+            "elapsed_seconds": round(end - self.started_at, 1) if self.started_at else 0.0,
+            "warmed": dict(self.warmed),
+        }
+
+
+warmup_job = WarmupJob()
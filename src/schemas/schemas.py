@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Dict, List, Literal, Optional
 
 from fastembed import SparseTextEmbedding, LateInteractionTextEmbedding
@@ -9,6 +9,7 @@ from qdrant_client import AsyncQdrantClient
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.api.evaluation.reranker import QwenReranker
+from src.llm_agent.deadline import Deadline
 
 
 class GrammarEntry(BaseModel):
@@ -34,6 +35,15 @@ class RetrievedGrammar(BaseModel):
     cross_score: Optional[float] = None
 
 
+class GrammarRef(BaseModel):
+    """
+    Lightweight reference to a grammar entry: stable Qdrant ID and titles only
+    """
+    id: str
+    grammar_name_kr: str
+    grammar_name_rus: str
+
+
 class RetrievedDoc(BaseModel):
     id: str
     content: dict
@@ -41,6 +51,13 @@ class RetrievedDoc(BaseModel):
     cross_score: Optional[float] = None
 
 
+class SegmentTranslations(BaseModel):
+    """
+    Translation agent result for numbered segments, in the same order
+    """
+    translations: list[str]
+
+
 class TelegramUser(BaseModel):
     """
     Schema for Telegram user data for TelegramMessage
@@ -71,6 +88,8 @@ class RouterAgentDeps:
     session: AsyncSession
     reranking_model: QwenReranker = None
     late_interaction_model: LateInteractionTextEmbedding = None
+    # Budget of the request, checked by the tools before their optional steps
+    deadline: Deadline = field(default_factory=Deadline)
 
 @dataclass
 class ThinkingGrammarAgentDeps:
@@ -83,6 +102,7 @@ class ThinkingGrammarAgentDeps:
     reranking_model: QwenReranker
     session: AsyncSession
     late_interaction_model: LateInteractionTextEmbedding = None
+    deadline: Deadline = field(default_factory=Deadline)
 
 class RouterAgentResult(BaseModel):
     """
@@ -93,4 +113,11 @@ class RouterAgentResult(BaseModel):
         "thinking_grammar_answer",
         "casual_answer",
     ] = "thinking_grammar_answer"
-    short_reasoning: str
\ No newline at end of file
+    short_reasoning: str
+
+
+class FusedRouterAgentResult(RouterAgentResult):
+    """
+    Router agent result with the grammar pattern for the search, replaces the query rewriter call
+    """
+    grammar_pattern: str = "None"
\ No newline at end of file
@@ -0,0 +1,52 @@
+import numpy as np
+
+from src.llm_agent.answer_cache import SemanticAnswerCache
+
+
+def unit(*values: float) -> np.ndarray:
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_similar_question_hits():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.put("разница между 은/는 и 이/가", "ответ", unit(1, 0, 0), "v1")
+
+    entry, similarity = cache.lookup(unit(1, 0.1, 0), "v1")
+    assert entry.answer == "ответ"
+    assert similarity > 0.9
+
+    entry, _ = cache.lookup(unit(0, 1, 0), "v1")
+    assert entry is None
+
+
+def test_corpus_version_must_match():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.put("вопрос", "ответ", unit(1, 0, 0), "v1")
+
+    entry, _ = cache.lookup(unit(1, 0, 0), "v2")
+    assert entry is None
+
+
+def test_lru_and_age_eviction():
+    cache = SemanticAnswerCache(threshold=0.9, max_size=2)
+    first = cache.put("первый", "1", unit(1, 0, 0), "v1")
+    cache.put("второй", "2", unit(0, 1, 0), "v1")
+    cache.lookup(unit(1, 0, 0), "v1")
+    cache.put("третий", "3", unit(0, 0, 1), "v1")
+
+    assert [entry.question for entry in cache.entries()] == ["третий", "первый"]
+
+    first.created_at -= cache.max_age + 1
+    assert [entry.question for entry in cache.entries()] == ["третий"]
+
+
+def test_purge():
+    cache = SemanticAnswerCache()
+    entry = cache.put("вопрос", "ответ", unit(1, 0, 0), "v1")
+    cache.put("другой", "ответ", unit(0, 1, 0), "v1")
+
+    assert cache.purge(entry.entry_id) == 1
+    assert cache.purge("missing") == 0
+    assert cache.purge() == 1
+    assert len(cache) == 0
@@ -0,0 +1,169 @@
+import asyncio
+import contextvars
+
+import pytest
+
+from src.llm_agent import circuit_breaker
+from src.llm_agent.circuit_breaker import CircuitBreaker, CircuitOpenError, CircuitState, StateChangeNotifier
+
+
+def fail(breaker: CircuitBreaker, times: int) -> None:
+    for _ in range(times):
+        breaker.record(0.1, error=True)
+
+
+def guarded_call(breaker: CircuitBreaker) -> None:
+    with breaker.guard():
+        pass
+
+
+def test_breaker_opens_after_consecutive_failures(monkeypatch):
+    monkeypatch.setattr(circuit_breaker, "CIRCUIT_FAILURE_THRESHOLD", 3)
+    breaker = CircuitBreaker("qdrant", slow_call_seconds=1)
+
+    fail(breaker, 2)
+    breaker.record(0.1)
+    fail(breaker, 2)
+    assert breaker.state == CircuitState.CLOSED
+
+    # Slow calls count as failures
+    breaker.record(5)
+    assert breaker.state == CircuitState.OPEN
+    assert not breaker.available()
+    assert breaker.stats()["fallbacks"] == 1
+
+
+def test_half_open_probe_closes_or_reopens(monkeypatch):
+    monkeypatch.setattr(circuit_breaker, "CIRCUIT_FAILURE_THRESHOLD", 1)
+    monkeypatch.setattr(circuit_breaker, "CIRCUIT_RESET_SECONDS", 0)
+    breaker = CircuitBreaker("openai_chat", slow_call_seconds=1)
+    fail(breaker, 1)
+
+    assert breaker.available()
+    assert breaker.state == CircuitState.HALF_OPEN
+    with breaker.track():
+        # Only one probe at a time, the other requests run in their own context
+        assert not contextvars.Context().run(breaker.available)
+    assert breaker.state == CircuitState.CLOSED
+
+    fail(breaker, 1)
+    assert breaker.available()
+    with pytest.raises(ValueError):
+        with breaker.track():
+            raise ValueError
+    assert breaker.state == CircuitState.OPEN
+    assert breaker.stats()["opened"] == 3
+
+
+def test_stale_success_does_not_close_a_half_open_breaker(monkeypatch):
+    monkeypatch.setattr(circuit_breaker, "CIRCUIT_FAILURE_THRESHOLD", 1)
+    monkeypatch.setattr(circuit_breaker, "CIRCUIT_RESET_SECONDS", 0)
+    breaker = CircuitBreaker("openai_chat", slow_call_seconds=1)
+    fail(breaker, 1)
+
+    probe = contextvars.Context()
+    assert probe.run(breaker.available)
+
+    # A call started before the breaker opened, or an ungated one, finishes during the probe
+    breaker.record(0.1)
+    fail(breaker, 1)
+    assert breaker.state == CircuitState.HALF_OPEN
+    assert not contextvars.Context().run(breaker.available)
+
+    probe.run(guarded_call, breaker)
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.stats()["opened"] == 1
+
+
+def test_half_open_admits_a_single_request(monkeypatch):
+    monkeypatch.setattr(circuit_breaker, "CIRCUIT_FAILURE_THRESHOLD", 1)
+    monkeypatch.setattr(circuit_breaker, "CIRCUIT_RESET_SECONDS", 0)
+    breaker = CircuitBreaker("qdrant", slow_call_seconds=1)
+    fail(breaker, 1)
+
+    requests = [contextvars.Context() for _ in range(5)]
+    assert [request.run(breaker.available) for request in requests] == [True, False, False, False, False]
+
+    # The request holding the claim runs its guarded call as the probe, the others fall back
+    with pytest.raises(CircuitOpenError):
+        requests[1].run(guarded_call, breaker)
+    assert requests[0].run(breaker.available)
+
+    requests[0].run(guarded_call, breaker)
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.stats()["fallbacks"] == 5
+
+
+def test_cancelled_probe_releases_the_claim(monkeypatch):
+    monkeypatch.setattr(circuit_breaker, "CIRCUIT_FAILURE_THRESHOLD", 1)
+    monkeypatch.setattr(circuit_breaker, "CIRCUIT_RESET_SECONDS", 0)
+    breaker = CircuitBreaker("qdrant", slow_call_seconds=1)
+    fail(breaker, 1)
+
+    async def probe():
+        assert breaker.available()
+        with breaker.track():
+            await asyncio.sleep(1)
+
+    async def cancel():
+        task = asyncio.create_task(probe())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(cancel())
+    assert breaker.state == CircuitState.HALF_OPEN
+    assert contextvars.Context().run(breaker.available)
+
+
+def test_guard_rejects_while_open_and_records_errors(monkeypatch):
+    monkeypatch.setattr(circuit_breaker, "CIRCUIT_FAILURE_THRESHOLD", 1)
+    breaker = CircuitBreaker("postgres", slow_call_seconds=1)
+
+    with pytest.raises(ValueError):
+        with breaker.guard():
+            raise ValueError
+    assert breaker.state == CircuitState.OPEN
+
+    with pytest.raises(CircuitOpenError):
+        with breaker.guard():
+            pytest.fail("The block must not run")
+
+
+def test_cancelled_fast_calls_are_not_recorded():
+    breaker = CircuitBreaker("qdrant", slow_call_seconds=1)
+
+    async def run():
+        with breaker.track():
+            await asyncio.sleep(1)
+
+    async def cancel():
+        task = asyncio.create_task(run())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(cancel())
+    assert breaker.calls == 0
+
+
+def test_notifications_are_rate_limited_per_breaker(monkeypatch):
+    monkeypatch.setattr(circuit_breaker, "CIRCUIT_FAILURE_THRESHOLD", 1)
+    monkeypatch.setattr(circuit_breaker, "CIRCUIT_RESET_SECONDS", 0)
+    sent = []
+
+    async def send(text: str):
+        sent.append(text)
+
+    async def run():
+        notifier = StateChangeNotifier(send, interval=0.05)
+        breaker = CircuitBreaker("qdrant", slow_call_seconds=1)
+        breaker.listeners.append(notifier)
+
+        fail(breaker, 1)
+        assert breaker.available()
+        guarded_call(breaker)
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert sent == ["qdrant: closed -> open", "qdrant: closed (2 changes in the last 0s)"]
@@ -0,0 +1,25 @@
+from pydantic_ai.messages import ModelRequest, ModelResponse, TextPart, UserPromptPart
+
+from src.llm_agent.context_builder import count_message_tokens, strip_grammar_cards
+from src.tests.test_telegram_format import load_grammar_cards
+from src.utils.json_to_telegram_md import custom_telegram_format
+
+
+def test_grammar_cards_are_stripped_to_titles():
+    card = custom_telegram_format(load_grammar_cards()[0])
+    title = card[len("<b>"):card.index("</b>")]
+    turn = [
+        ModelRequest(parts=[UserPromptPart(content="Selected: " + title)]),
+        ModelResponse(parts=[TextPart(content=card)]),
+    ]
+
+    stripped = strip_grammar_cards(turn)
+
+    assert stripped[0] is turn[0]
+    assert stripped[1].parts[0].content == f"[Грамматическая карточка: {title}]"
+    assert count_message_tokens(stripped) < count_message_tokens(turn)
+
+
+def test_other_answers_are_kept():
+    turn = [ModelResponse(parts=[TextPart(content="<b>Ответ</b>\n\nОбычный ответ без карточки")])]
+    assert strip_grammar_cards(turn) == turn
@@ -0,0 +1,61 @@
+import asyncio
+from types import SimpleNamespace
+
+from src.llm_agent import corpus
+from src.llm_agent.corpus import corpus_digest, get_corpus_version
+
+
+class FakeQdrant:
+    def __init__(self, payloads: dict[str, dict]):
+        self.payloads = payloads
+        self.scrolls = 0
+
+    async def scroll(self, collection_name, limit, offset, with_payload, with_vectors):
+        self.scrolls += 1
+        points = [SimpleNamespace(id=point_id, payload=payload) for point_id, payload in self.payloads.items()]
+        start = offset or 0
+        end = start + limit
+        return points[start:end], end if end < len(points) else None
+
+
+def test_digest_changes_with_the_content_only():
+    points = [("1", {"grammar_name_kr": "-고 싶다"}), ("2", {"grammar_name_kr": "-는데"})]
+
+    assert corpus_digest("grammars", points) == corpus_digest("grammars", reversed(points))
+    assert corpus_digest("grammars", points) != corpus_digest("grammars", points[:1])
+    assert corpus_digest("grammars", points) != corpus_digest("grammars", [points[0], ("2", {"grammar_name_kr": "-는 데"})])
+
+
+def test_reindex_is_picked_up_after_the_refresh(monkeypatch):
+    monkeypatch.delenv("GRAMMAR_CORPUS_VERSION", raising=False)
+    monkeypatch.setattr(corpus, "_corpus_version", None)
+    qdrant = FakeQdrant({str(index): {"level": 1, "content": str(index)} for index in range(300)})
+
+    async def scenario():
+        first = await get_corpus_version(qdrant)
+        qdrant.payloads["0"] = {"level": 1, "content": "re-indexed"}
+        assert await get_corpus_version(qdrant) == first
+
+        # The refresh runs in the background, the request keeps the last known version
+        monkeypatch.setattr(corpus, "CORPUS_VERSION_REFRESH_SECONDS", 0)
+        assert await get_corpus_version(qdrant) == first
+        await corpus._refresh_task
+
+        monkeypatch.setattr(corpus, "CORPUS_VERSION_REFRESH_SECONDS", 300)
+        assert await get_corpus_version(qdrant) != first
+
+    asyncio.run(scenario())
+    # 300 points are read in pages of 256, twice
+    assert qdrant.scrolls == 4
+
+
+def test_cold_start_reads_the_collection_once(monkeypatch):
+    monkeypatch.delenv("GRAMMAR_CORPUS_VERSION", raising=False)
+    monkeypatch.setattr(corpus, "_corpus_version", None)
+    qdrant = FakeQdrant({str(index): {"level": 1, "content": str(index)} for index in range(10)})
+
+    async def scenario():
+        return await asyncio.gather(*(get_corpus_version(qdrant) for _ in range(5)))
+
+    assert len(set(asyncio.run(scenario()))) == 1
+    assert qdrant.scrolls == 1
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from src.schemas.schemas import GrammarEntryV2
+from src.utils.corpus_artifact import CorpusArtifact, load_corpus_artifact, write_corpus_artifact
+from src.utils.json_to_telegram_md import grammar_entry_to_markdown
+
+ENTRIES = [
+    GrammarEntryV2(
+        grammar_name_kr="V + -고 싶다 ",
+        grammar_name_rus="«хотеть»",
+        level=1,
+        content="**-고 싶다** выражает желание говорящего.\n\n가고 싶어요.",
+        related_grammars=["-고 싶어하다"],
+    ),
+    GrammarEntryV2(
+        grammar_name_kr="V/A + -(으)ㄴ/는데",
+        grammar_name_rus="«а, но»",
+        level=2,
+        content="Союз фона: 비가 오는데 우산이 없어요.",
+        related_grammars=[],
+    ),
+]
+
+
+def test_roundtrip(tmp_path):
+    path = str(tmp_path / "corpus.bin")
+    embeddings = np.arange(6, dtype="<f4").reshape(2, 3)
+    write_corpus_artifact(path, "grammars:abc", ["11", "22"], ENTRIES, embeddings)
+
+    artifact = CorpusArtifact(path)
+    try:
+        assert artifact.corpus_version == "grammars:abc"
+        assert artifact.ids() == ["11", "22"] and "22" in artifact and "33" not in artifact
+        assert artifact.entry("11") == ENTRIES[0].model_copy(update={"grammar_name_kr": "V + -고 싶다"})
+        assert artifact.entry("22") == ENTRIES[1]
+        assert artifact.card_html("22") == grammar_entry_to_markdown(ENTRIES[1].model_dump())
+        assert artifact.title("11") == "V + -고 싶다 - «хотеть»"
+        assert artifact.grammar_names() == ["V + -고 싶다", "V/A + -(으)ㄴ/는데"]
+        assert artifact.related_grammars("11") == ["-고 싶어하다"]
+        np.testing.assert_array_equal(artifact.embeddings, embeddings)
+    finally:
+        artifact.close()
+
+
+def test_empty_corpus(tmp_path):
+    path = str(tmp_path / "corpus.bin")
+    write_corpus_artifact(path, "grammars:empty", [], [], np.asarray([], dtype="<f4"))
+
+    artifact = CorpusArtifact(path)
+    try:
+        assert len(artifact) == 0 and artifact.ids() == [] and artifact.grammar_names() == []
+        assert artifact.embeddings is None
+    finally:
+        artifact.close()
+    # The API falls back to Qdrant instead of serving an artifact without grammars
+    assert load_corpus_artifact(path) is None
+
+
+def test_embeddings_must_match_the_entries(tmp_path):
+    with pytest.raises(ValueError, match="Expected 2 embeddings, one per grammar, got 1"):
+        write_corpus_artifact(str(tmp_path / "corpus.bin"), "grammars:abc", ["11", "22"], ENTRIES, np.ones((1, 3)))
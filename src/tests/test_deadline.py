@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from src.llm_agent.deadline import Deadline, deadline_stats
+
+
+def test_steps_fitting_the_budget_are_allowed():
+    deadline = Deadline(10)
+    assert deadline.allows("skip_llm_filter", 6)
+    assert deadline.degradations == []
+
+
+def test_degradations_are_recorded_per_request_and_counted():
+    degraded_before = deadline_stats.degraded
+    mini_before = deadline_stats.degradations["llm_filter_mini"]
+
+    deadline = Deadline(5)
+    assert not deadline.allows("llm_filter_mini", 12)
+    assert deadline.allows("skip_llm_filter", 4)
+    assert not deadline.allows("skip_docs", 8)
+
+    assert deadline.degradations == ["llm_filter_mini", "skip_docs"]
+    assert deadline_stats.degraded == degraded_before + 1
+    assert deadline_stats.degradations["llm_filter_mini"] == mini_before + 1
+
+
+def test_unbounded_deadline_never_degrades():
+    deadline = Deadline()
+    assert deadline.allows("skip_colbert", 1e9)
+
+    async def run():
+        async with deadline.bounded():
+            await asyncio.sleep(0)
+        return "done"
+
+    assert asyncio.run(run()) == "done"
+
+
+def test_bounded_block_is_cancelled_when_the_budget_is_spent():
+    exceeded_before = deadline_stats.exceeded
+
+    async def run():
+        async with Deadline(0.05).bounded():
+            await asyncio.sleep(1)
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(run())
+    assert deadline_stats.exceeded == exceeded_before + 1
+
+
+def test_timeouts_raised_inside_the_block_are_not_counted():
+    exceeded_before = deadline_stats.exceeded
+
+    async def run():
+        async with Deadline(10).bounded():
+            raise TimeoutError
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(run())
+    assert deadline_stats.exceeded == exceeded_before
@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from src.llm_agent.doc_compression import OMISSION, colbert_scores, compress, split_spans
+from src.llm_agent.tokens import count_tokens
+
+
+def keyword_score(keyword: str):
+    return lambda spans: [float(span.count(keyword)) for span in spans]
+
+
+def test_split_spans_splits_long_paragraphs_into_sentences():
+    text = "Короткий абзац.\n\n" + "Первое предложение. Второе предложение! Третье?"
+
+    assert split_spans(text, max_span_tokens=1000) == [
+        "Короткий абзац.", "Первое предложение. Второе предложение! Третье?",
+    ]
+    assert split_spans(text, max_span_tokens=10) == [
+        "Короткий абзац.", "Первое предложение.", "Второе предложение!", "Третье?",
+    ]
+
+
+def test_texts_within_the_budget_are_kept():
+    texts = ["-고 싶다 выражает желание.", "Другой урок."]
+
+    assert compress(texts, keyword_score("싶다"), token_budget=1000) == texts
+
+
+def test_best_spans_are_kept_in_order_within_the_budget():
+    filler = "Вводный абзац без нужной грамматики, довольно длинный. " * 3
+    texts = [
+        f"{filler}\n\n-고 싶다: желание говорящего.\n\n{filler}\n\nПример: 가고 싶다.",
+        f"{filler}\n\n{filler}",
+        "Отрицание: -고 싶지 않다.",
+    ]
+
+    compressed = compress(texts, keyword_score("싶"), token_budget=35)
+
+    assert compressed == [
+        f"{OMISSION}\n\n-고 싶다: желание говорящего.\n\n{OMISSION}\n\nПример: 가고 싶다.",
+        "Отрицание: -고 싶지 않다.",
+    ]
+
+
+def test_top_text_is_truncated_when_no_span_fits():
+    texts = ["Один длинный абзац без переносов строк " * 20, "Второй урок, такой же длинный " * 20]
+
+    compressed = compress(texts, keyword_score("абзац"), token_budget=30)
+
+    assert len(compressed) == 1
+    assert compressed[0].startswith("Один длинный абзац") and compressed[0].endswith(OMISSION)
+    assert count_tokens(compressed[0]) <= 30
+
+
+def test_colbert_scores_use_max_sim():
+    model = SimpleNamespace(
+        query_embed=lambda query: iter([np.array([[1.0, 0.0], [0.0, 1.0]])]),
+        embed=lambda spans: iter([np.array([[1.0, 0.0]]), np.array([[0.6, 0.8], [1.0, 0.0]])]),
+    )
+
+    assert colbert_scores(model, "query", ["a", "b"]) == [1.0, 1.8]
@@ -0,0 +1,118 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from src.llm_agent.embedding_batcher import EmbeddingBatcher
+
+
+class FakeEmbeddings:
+    """
+    Embeddings endpoint with a fixed latency per request and a limited number of concurrent requests
+    """
+
+    def __init__(self, latency: float = 0.02, per_input: float = 0.0002, concurrency: int = 4, fail: bool = False):
+        self.latency = latency
+        self.per_input = per_input
+        self.fail = fail
+        self.calls: list[list[str]] = []
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def create(self, model: str, input: str | list[str]):
+        inputs = [input] if isinstance(input, str) else input
+        self.calls.append(inputs)
+        async with self._semaphore:
+            await asyncio.sleep(self.latency + self.per_input * len(inputs))
+        if self.fail:
+            raise RuntimeError("rate limited")
+        return SimpleNamespace(
+            data=[SimpleNamespace(index=i, embedding=[float(len(text))]) for i, text in enumerate(inputs)]
+        )
+
+
+class FakeClient:
+    def __init__(self, **kwargs):
+        self.embeddings = FakeEmbeddings(**kwargs)
+
+
+def test_concurrent_texts_share_a_request():
+    async def run():
+        client = FakeClient()
+        batcher = EmbeddingBatcher("test", window=0.005, max_batch=3)
+        vectors = await asyncio.gather(*(batcher.embed(client, text) for text in ["a", "bb", "a", "ccc", "dddd"]))
+        return client, batcher, vectors
+
+    client, batcher, vectors = asyncio.run(run())
+
+    assert vectors == [[1.0], [2.0], [1.0], [3.0], [4.0]]
+    # The repeated "a" is sent once, the batch is sent as soon as it has 3 texts
+    assert client.embeddings.calls == [["a", "bb", "ccc"], ["dddd"]]
+    assert batcher.stats()["batches"] == 2
+
+
+def test_errors_reach_every_caller():
+    async def run():
+        batcher = EmbeddingBatcher("test", window=0.005)
+        client = FakeClient(fail=True)
+        return await asyncio.gather(*(batcher.embed(client, text) for text in ["a", "b"]), return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in asyncio.run(run()))
+
+
+def test_repeated_texts_are_served_from_the_cache():
+    async def run():
+        client = FakeClient()
+        batcher = EmbeddingBatcher("test", window=0.001, cache_size=2)
+        for text in ["a", "bb", "a", "ccc", "bb"]:
+            await batcher.embed(client, text)
+        return client, batcher
+
+    client, batcher = asyncio.run(run())
+
+    # "bb" was evicted by "ccc" after "a" was used again
+    assert client.embeddings.calls == [["a"], ["bb"], ["ccc"], ["bb"]]
+    assert batcher.stats()["cache_hits"] == 1
+
+
+async def simulate_load(embed, queries: int = 200, interval: float = 0.001) -> tuple[float, list[float]]:
+    """
+    Embed `queries` texts arriving every `interval` seconds, return the throughput and the sorted latencies
+    """
+    latencies = []
+
+    async def query(i: int):
+        await asyncio.sleep(i * interval)
+        started = time.perf_counter()
+        await embed(f"query {i}")
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(query(i) for i in range(queries)))
+    return queries / (time.perf_counter() - started), sorted(latencies)
+
+
+def test_batching_under_load():
+    async def run():
+        single = FakeClient()
+        single_throughput, single_latencies = await simulate_load(
+            lambda text: single.embeddings.create(model="test", input=text)
+        )
+
+        batched = FakeClient()
+        batcher = EmbeddingBatcher("test", window=0.005)
+        batched_throughput, batched_latencies = await simulate_load(lambda text: batcher.embed(batched, text))
+        return single_throughput, single_latencies, batched_throughput, batched_latencies, batched
+
+    single_throughput, single_latencies, batched_throughput, batched_latencies, batched = asyncio.run(run())
+
+    def p99(latencies: list[float]) -> float:
+        return latencies[int(len(latencies) * 0.99)]
+
+    print(
+        f"\none query per call: {single_throughput:.0f} queries/s, p99 {p99(single_latencies) * 1000:.0f} ms"
+        f"\nbatched:            {batched_throughput:.0f} queries/s, p99 {p99(batched_latencies) * 1000:.0f} ms, "
+        f"{len(batched.embeddings.calls)} requests"
+    )
+
+    assert batched_throughput > single_throughput
+    assert p99(batched_latencies) < p99(single_latencies)
+    assert len(batched.embeddings.calls) < 200 / 4
@@ -0,0 +1,58 @@
+import time
+from pathlib import Path
+
+import pytest
+
+from src.llm_agent.fuzzy_grammar import FuzzyGrammarLookup, compose, edit_distance, transliterate_layout
+from src.llm_agent.grammar_patterns import GRAMMAR_LIST_PATH, load_grammar_names
+
+ROOT = Path(__file__).parents[2]
+
+
+@pytest.fixture(scope="module")
+def lookup() -> FuzzyGrammarLookup:
+    return FuzzyGrammarLookup(load_grammar_names(path=str(ROOT / GRAMMAR_LIST_PATH)))
+
+
+def test_compose_follows_the_ime():
+    assert compose(list("ㄱㅏㄱㅗ")) == "가고"
+    assert compose(list("ㅇㅣㅆㅇㅓ")) == "있어"
+    assert compose(list("ㅇㅗㅏㅇㅛ")) == "와요"
+    assert compose(list("ㅇㅓㅂㅅㅇㅓ")) == "없어"
+    assert compose(list("ㄱㄱ")) is None
+
+
+def test_transliteration_keeps_english_words():
+    assert transliterate_layout("rkrh") == "가고"
+    assert transliterate_layout("rhtlvek") == "고싶다"
+    assert transliterate_layout("grammar -고 싶다 ok") == "grammar -고 싶다 ok"
+
+
+def test_edit_distance_counts_transpositions_once():
+    assert edit_distance("abcd", "abdc", 2) == 1
+    assert edit_distance("abcd", "abcd", 2) == 0
+    assert edit_distance("abcd", "xyz", 2) == 3
+
+
+@pytest.mark.parametrize("text, pattern", [
+    ("-고 십다", "-고 싶다"),
+    ("объясни грамматику 는 동한", "-는 동안(에)"),
+    ("-기 젼에", "-기 전에"),
+    ("rhtlvek", "-고 싶다"),
+])
+def test_typos_are_corrected(lookup, text, pattern):
+    candidates = lookup.lookup(text)
+    assert candidates and candidates[0].pattern == pattern
+
+
+def test_particles_and_other_words_are_not_fuzzed(lookup):
+    assert all(candidate.distance == 0 for candidate in lookup.lookup("이/가"))
+    assert lookup.lookup("grammar") == []
+    assert lookup.lookup("привет") == []
+
+
+def test_lookup_latency(lookup):
+    started = time.perf_counter()
+    for _ in range(100):
+        lookup.lookup("объясни грамматику 는 동한")
+    assert (time.perf_counter() - started) / 100 < 0.005
@@ -0,0 +1,77 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from src.llm_agent.grammar_patterns import (
+    GRAMMAR_LIST_PATH,
+    GrammarPatternExtractor,
+    display_name,
+    encode,
+    evaluate_rewrites,
+    expand_name,
+    load_grammar_names,
+)
+
+ROOT = Path(__file__).parents[2]
+GOLDEN_REWRITES = Path(__file__).parent / "golden" / "query_rewrites.jsonl"
+
+
+@pytest.fixture(scope="module")
+def extractor() -> GrammarPatternExtractor:
+    return GrammarPatternExtractor(load_grammar_names(path=str(ROOT / GRAMMAR_LIST_PATH)))
+
+
+def test_encode_attaches_standalone_consonants():
+    assert encode("으ㄹ 수") == encode("을수") == "ㅇㅡㄹ|ㅅㅜ|"
+    assert encode("ㄴ 후에") == "ㄴ|ㅎㅜ|ㅇㅔ|"
+
+
+def test_names_are_expanded_into_variants():
+    assert display_name("V/A + -(으)ㄴ/는데") == "-(으)ㄴ/는데"
+    assert display_name("V + -(으)ㄹ게요 «я сделаю…»") == "-(으)ㄹ게요"
+    assert set(expand_name("V/A + -(으)ㄴ/는데")) == {"으ㄴ데", "ㄴ데", "는데"}
+    assert {"아야 하다", "어야 하다", "해야 하다"} <= set(expand_name("V + -아/어야 하다"))
+    assert "ㄹ 거다" in expand_name("V/A + -(으)ㄹ 것이다")
+
+
+@pytest.mark.parametrize("text, pattern", [
+    ("가고 싶어요", "-고 싶다"),
+    ("объясни грамматику 는 동안", "-는 동안(에)"),
+    ("먹을 수 있어요", "-(으)ㄹ 수 있다/없다"),
+    ("공부해야 해요", "-아/어야 하다"),
+    ("갈 거예요", "-(으)ㄹ 것이다"),
+    ("가지 마세요", "-지 말다"),
+    ("한국에 가 본 적이 없어요", "-은 적이 있다/없다"),
+    ("грамматика 이/가", "이/가"),
+])
+def test_conjugated_forms_are_resolved(extractor, text, pattern):
+    assert extractor.extract(text) == pattern
+
+
+def test_short_patterns_must_be_the_whole_input(extractor):
+    assert extractor.extract("도") == "도"
+    # 가 (subject particle) and 에 (location) inside a sentence are left to the query rewriter
+    assert extractor.extract("학교에 가요") is None
+    assert extractor.extract("будущее время в корейском") is None
+
+
+@pytest.mark.parametrize("text", ["서울 가요", "친구를 기다려요", "한국어를 공부해요", "먹어 봤어요", "물을 주세요"])
+def test_ordinary_sentences_are_left_to_the_rewriter(extractor, text):
+    # "ㄹ 거다" must not match ㄹ + any ㄱ syllable, "-(으)세요" and "-아/어요" must not match inside a word
+    assert extractor.extract(text) is None
+
+
+def test_single_word_endings_match_the_whole_word(extractor):
+    assert extractor.extract("가세요") == "-(으)세요"
+    assert extractor.extract("объясни 세요") == "-(으)세요"
+
+
+def test_accuracy_against_logged_rewrites(extractor):
+    with open(GOLDEN_REWRITES, encoding="utf-8") as file:
+        rewrites = [json.loads(line) for line in file if line.strip()]
+
+    report = evaluate_rewrites(extractor, rewrites)
+
+    assert report["coverage"] >= 0.8
+    assert report["accuracy"] >= 0.95
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from src.llm_agent import hedging
+from src.llm_agent.hedging import HedgeClass, hedge_classes, hedged
+
+
+@pytest.fixture
+def hedge_class(monkeypatch) -> HedgeClass:
+    monkeypatch.setattr(hedging, "HEDGED_REQUESTS", True)
+    monkeypatch.setattr(hedging, "HEDGE_MIN_SAMPLES", 10)
+    monkeypatch.setattr(hedging, "HEDGE_BUDGET_PERCENT", 50)
+    hedge_class = HedgeClass("test")
+    # p95 of 20 ms, so calls are hedged after 20 ms
+    hedge_class.primary_latencies.extend([0.01] * 9 + [0.02] * 11)
+    hedge_class.calls = 20
+    monkeypatch.setitem(hedge_classes, "test", hedge_class)
+    return hedge_class
+
+
+def slow_first(delays: list[float], started: list[int]):
+    async def call():
+        attempt = len(started)
+        started.append(attempt)
+        await asyncio.sleep(delays[attempt])
+        return attempt
+
+    return call
+
+
+def test_slow_call_is_won_by_its_hedge(hedge_class):
+    started = []
+    result = asyncio.run(hedged("test", slow_first([1.0, 0.01], started)))
+
+    assert result == 1
+    assert started == [0, 1]
+    assert hedge_class.hedged == hedge_class.hedge_wins == 1
+    assert hedge_class.latencies[-1] < 0.5
+
+
+def test_fast_call_is_not_hedged(hedge_class):
+    started = []
+    assert asyncio.run(hedged("test", slow_first([0.001], started))) == 0
+    assert started == [0]
+    assert hedge_class.hedged == 0
+
+
+def test_budget_caps_the_hedges(hedge_class, monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_BUDGET_PERCENT", 0)
+    started = []
+    assert asyncio.run(hedged("test", slow_first([0.05], started))) == 0
+    assert started == [0]
+    assert hedge_class.hedged == 0
+
+
+def test_failed_attempt_waits_for_the_other(hedge_class):
+    started = []
+
+    async def call():
+        attempt = len(started)
+        started.append(attempt)
+        await asyncio.sleep(0.05 if attempt == 0 else 0.01)
+        if attempt == 1:
+            raise ConnectionError
+        return attempt
+
+    assert asyncio.run(hedged("test", call)) == 0
+    assert hedge_class.hedge_wins == 0
+
+
+def test_stats_compare_the_p99(hedge_class):
+    started = []
+    asyncio.run(hedged("test", slow_first([1.0, 0.01], started)))
+    stats = hedge_class.stats()
+    assert stats["hedged"] == 1
+    assert stats["extra_requests_percent"] == pytest.approx(100 / 21, abs=0.01)
+    assert stats["hedge_delay_ms"] == 20.0
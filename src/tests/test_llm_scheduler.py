@@ -0,0 +1,79 @@
+import asyncio
+
+import httpx
+
+from src.llm_agent.llm_scheduler import LLMScheduler, Priority, TokenBucket, estimate_request, llm_priority
+
+
+def test_token_bucket_wait_time():
+    bucket = TokenBucket(per_minute=60)
+    now = bucket._updated
+    bucket.take(60, now)
+
+    assert bucket.wait_time(1, now) == 1.0
+    # Amounts above the capacity only wait for a full bucket
+    assert bucket.wait_time(600, now) == 60.0
+    assert bucket.wait_time(1, now + 1) == 0.0
+
+
+def test_estimate_request():
+    request = httpx.Request(
+        "POST", "https://api.openai.com/v1/chat/completions",
+        json={"model": "gpt-4.1", "messages": [{"role": "user", "content": "Привет"}], "max_tokens": 100},
+    )
+    model, tokens = estimate_request(request)
+
+    assert model == "gpt-4.1"
+    assert tokens == len(request.content) // 4 + 100
+    assert estimate_request(httpx.Request("GET", "https://api.openai.com/v1/models")) == (None, 0)
+
+
+def test_interactive_calls_go_first():
+    async def run():
+        scheduler = LLMScheduler({"*": 6000}, {"*": 1_000_000})
+        scheduler.limiter("gpt-4.1").limit = 1
+        order = []
+
+        async def call(name, priority):
+            with llm_priority(priority):
+                async with scheduler.slot("gpt-4.1", 10) as slot:
+                    order.append(name)
+                    await asyncio.sleep(0.01)
+                    slot.response(200, httpx.Headers())
+
+        first = asyncio.create_task(call("evaluation 1", Priority.EVALUATION))
+        await asyncio.sleep(0)
+        await asyncio.gather(
+            first,
+            call("evaluation 2", Priority.EVALUATION),
+            call("summary", Priority.BACKGROUND),
+            call("invoke", Priority.INTERACTIVE),
+        )
+        return order, scheduler
+
+    order, scheduler = asyncio.run(run())
+
+    assert order == ["evaluation 1", "invoke", "summary", "evaluation 2"]
+    assert scheduler.stats()["queue_wait"]["interactive"]["count"] == 1
+
+
+def test_rate_limit_halves_concurrency_once():
+    async def run():
+        scheduler = LLMScheduler({"*": 6000}, {"*": 1_000_000})
+        limiter = scheduler.limiter("gpt-4.1")
+        limiter.limit = 8
+
+        async def call():
+            async with scheduler.slot("gpt-4.1", 10) as slot:
+                await asyncio.sleep(0.01)
+                slot.response(429, httpx.Headers({"retry-after-ms": "20"}))
+
+        # All of them saw the same overload, the limit is only halved once
+        await asyncio.gather(*(call() for _ in range(4)))
+        return limiter
+
+    limiter = asyncio.run(run())
+
+    assert limiter.limit == 4
+    assert limiter.rate_limited == 4
+    assert limiter.active == 0
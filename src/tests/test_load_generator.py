@@ -0,0 +1,35 @@
+import asyncio
+
+from src.benchmarks.load_generator import SimulatedTarget, build_report, percentile, run_load
+
+
+def test_percentile():
+    values = [float(value) for value in range(1, 101)]
+
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 99) == 99.0
+    assert percentile([], 99) == 0.0
+
+
+def test_report_of_a_simulated_run():
+    target = SimulatedTarget(latencies={"/invoke": 0.01, "/translate": 0.01, "/conversation": 0.01}, seed=1)
+    results = asyncio.run(run_load(target, rate=200, duration=0.5, user_ids=[1, 2], seed=1))
+    report = build_report(results, rate=200, duration=0.5)
+
+    # Poisson arrivals, about rate * duration requests
+    assert 60 <= report["total"]["requests"] <= 140
+    assert report["total"]["error_rate"] == 0.0
+    assert set(report["scenarios"]) == {"direct_grammar", "thinking", "translation", "conversation"}
+    assert {"single_grammar", "thinking_grammar_answer"} <= set(report["modes"])
+    assert sum(scenario["requests"] for scenario in report["scenarios"].values()) == report["total"]["requests"]
+    assert report["total"]["latency_ms"]["p99"] >= report["total"]["latency_ms"]["p50"] > 0
+
+
+def test_errors_are_counted():
+    target = SimulatedTarget(latencies={"/invoke": 0.001}, error_rate=1.0, seed=1)
+    results = asyncio.run(run_load(target, rate=100, duration=0.2, user_ids=[1], mix={"thinking": 1.0}, seed=1))
+    report = build_report(results, rate=100, duration=0.2)
+
+    assert report["total"]["error_rate"] == 1.0
+    assert report["total"]["throughput_rps"] == 0.0
+    assert report["total"]["statuses"] == {"500": report["total"]["requests"]}
@@ -0,0 +1,48 @@
+from src.tgbot.misc.metrics import SPARKLINE_BARS, MetricsSample, MetricsSampler, sparkline
+
+
+def sample(index: int, **queue_depths: int) -> MetricsSample:
+    return MetricsSample(
+        timestamp=float(index),
+        process_cpu=index * 10.0,
+        system_cpu=5.0,
+        rss_mb=100.0 + index,
+        system_memory_percent=50.0,
+        loop_lag_ms=0.5,
+        asyncio_tasks=7,
+        open_connections=2,
+        pending_api_calls=index,
+        queue_depths=queue_depths,
+    )
+
+
+def test_ring_buffer_keeps_the_last_samples():
+    sampler = MetricsSampler(history_size=3)
+    assert sampler.latest is None and sampler.history("rss_mb") == []
+
+    for index in range(5):
+        sampler.samples.append(sample(index, answers=index))
+
+    assert len(sampler.samples) == 3
+    assert sampler.history("rss_mb") == [102.0, 103.0, 104.0]
+    assert sampler.history("pending_api_calls") == [2, 3, 4]
+    assert sampler.latest.timestamp == 4.0
+
+
+def test_sparkline():
+    assert sparkline([]) == ""
+    assert sparkline([3, 3, 3]) == SPARKLINE_BARS[0] * 3
+    assert sparkline([0, 7, 3.5]) == "▁█▅"
+    # Only the last `width` values are rendered, scaled to their own range
+    assert sparkline(list(range(100)), width=8) == SPARKLINE_BARS
+
+
+def test_latest_values_leave_out_the_queue_depths():
+    sampler = MetricsSampler()
+    sampler.samples.append(sample(1, answers=3))
+
+    values = sampler.latest_values()
+
+    assert "queue_depths" not in values
+    assert values["process_cpu"] == 10.0 and values["pending_api_calls"] == 1 and values["asyncio_tasks"] == 7
+    assert sampler.latest_queue_depths() == {"answers": {"depth": 3}}
@@ -0,0 +1,96 @@
+import json
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+from src.benchmarks.openai_stub import StubConfig, create_app
+
+
+def stub_client(**config) -> TestClient:
+    return TestClient(create_app(StubConfig(latency=0.001, embedding_latency=0.001, tokens_per_second=1e6, **config)))
+
+
+def chat(client: TestClient, **body) -> dict:
+    response = client.post("/v1/chat/completions", json={"model": "gpt-4.1", **body})
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_embeddings_are_deterministic_unit_vectors():
+    client = stub_client()
+    body = {"model": "text-embedding-3-large", "input": ["грамматика -는데", "아/어 보이다", "грамматика -는데"]}
+    data = client.post("/v1/embeddings", json=body).json()["data"]
+
+    vectors = [np.asarray(item["embedding"]) for item in data]
+    assert len(vectors[0]) == 3072
+    assert np.isclose(np.linalg.norm(vectors[0]), 1.0, atol=1e-4)
+    assert vectors[0].tolist() == vectors[2].tolist() != vectors[1].tolist()
+
+
+def test_structured_output_follows_the_schema():
+    client = stub_client()
+    parameters = {
+        "type": "object",
+        "properties": {
+            "message_type": {"enum": ["direct_grammar_search", "thinking_grammar_answer", "casual_answer"]},
+            "translations": {"type": "array", "items": {"type": "string"}},
+        },
+    }
+    body = {
+        "messages": [{"role": "user", "content": 'Translate each of the 2 segments.\n\n["Привет.", "Как дела?"]'}],
+        "tools": [{"type": "function", "function": {"name": "final_result", "parameters": parameters}}],
+        "tool_choice": "required",
+    }
+    first, second = chat(client, **body), chat(client, **body)
+
+    call = first["choices"][0]["message"]["tool_calls"][0]
+    arguments = json.loads(call["function"]["arguments"])
+    assert call["function"]["name"] == "final_result"
+    assert arguments["message_type"] in parameters["properties"]["message_type"]["enum"]
+    assert len(arguments["translations"]) == 2
+    assert first["choices"][0] == second["choices"][0]
+
+
+def test_agent_tools_are_called_once_before_the_answer():
+    client = stub_client()
+    tools = [{"type": "function", "function": {
+        "name": "retrieve_docs", "parameters": {"type": "object", "properties": {"search_query": {"type": "string"}}},
+    }}]
+    messages = [{"role": "user", "content": "разница между 은/는 и 이/가"}]
+
+    first = chat(client, messages=messages, tools=tools)["choices"][0]
+    assert first["finish_reason"] == "tool_calls"
+
+    call = first["message"]["tool_calls"][0]
+    messages += [first["message"], {"role": "tool", "tool_call_id": call["id"], "content": "..."}]
+    second = chat(client, messages=messages, tools=tools)["choices"][0]
+    assert second["finish_reason"] == "stop"
+    assert second["message"]["content"]
+
+
+def test_canned_responses_and_streaming():
+    client = stub_client(responses=[{"match": "고 싶", "content": "-고 싶다"}])
+    body = {"messages": [{"role": "user", "content": "가고 싶어요"}], "stream": True}
+
+    with client.stream("POST", "/v1/chat/completions", json={"model": "gpt-4.1-mini", **body}) as response:
+        lines = [line for line in response.iter_lines() if line.startswith("data: ")]
+
+    assert lines[-1] == "data: [DONE]"
+    content = "".join(
+        json.loads(line[6:])["choices"][0]["delta"].get("content") or "" for line in lines[:-1]
+    )
+    assert content == "-고 싶다"
+
+
+def test_injected_faults():
+    client = stub_client(rate_limit_rate=1.0)
+    response = client.post("/v1/chat/completions", json={"model": "gpt-4.1", "messages": []})
+
+    assert response.status_code == 429
+    assert response.headers["retry-after-ms"] == "500"
+    assert response.json()["error"]["code"] == "rate_limit_exceeded"
+
+    client = stub_client(requests_per_minute=1)
+    statuses = [client.post("/v1/embeddings", json={"model": "text-embedding-3-large", "input": "a"}).status_code
+                for _ in range(2)]
+    assert statuses == [200, 429]
@@ -0,0 +1,66 @@
+import asyncio
+
+from prometheus_client import REGISTRY, CollectorRegistry, generate_latest
+
+from src.llm_agent.pipeline_metrics import measure_pipeline, pipeline_stage, timed_task
+from src.utils.prometheus import StatsCollector
+
+
+def stage_count(pipeline: str, stage: str, mode: str) -> float | None:
+    return REGISTRY.get_sample_value(
+        "korean_bot_stage_duration_seconds_count", {"pipeline": pipeline, "stage": stage, "mode": mode}
+    )
+
+
+def test_stages_are_labelled_with_the_final_mode():
+    background = []
+
+    @measure_pipeline("test_invoke")
+    async def endpoint():
+        with pipeline_stage("router"):
+            await asyncio.sleep(0)
+        with pipeline_stage("generation"):
+            await asyncio.sleep(0)
+        background.append(timed_task("history_write", asyncio.sleep))
+        return {"llm_response": "...", "mode": "thinking_grammar_answer"}
+
+    async def run():
+        response = await endpoint()
+        # Background tasks run after the response
+        await background[0](0)
+        return response
+
+    assert asyncio.run(run())["mode"] == "thinking_grammar_answer"
+    for stage in ("router", "generation", "history_write"):
+        assert stage_count("test_invoke", stage, "thinking_grammar_answer") == 1
+    assert REGISTRY.get_sample_value(
+        "korean_bot_request_duration_seconds_count", {"pipeline": "test_invoke", "mode": "thinking_grammar_answer"}
+    ) == 1
+
+
+def test_failed_requests_are_labelled_error():
+    @measure_pipeline("test_failing")
+    async def endpoint():
+        with pipeline_stage("router"):
+            raise RuntimeError("rate limited")
+
+    try:
+        asyncio.run(endpoint())
+    except RuntimeError:
+        pass
+
+    assert stage_count("test_failing", "router", "error") == 1
+
+
+def test_stats_collector():
+    registry = CollectorRegistry()
+    registry.register(StatsCollector("cache", lambda: {"hits": 3, "hit_rate": 0.75, "name": "lru"}, counters=("hits",)))
+    registry.register(StatsCollector(
+        "scheduler", lambda: {"gpt-4.1": {"active": 2}, "gpt-4.1-mini": {"active": 0}}, label="model"
+    ))
+    text = generate_latest(registry).decode()
+
+    assert "korean_bot_cache_hits_total 3.0" in text
+    assert "korean_bot_cache_hit_rate 0.75" in text
+    assert "name" not in text
+    assert 'korean_bot_scheduler_active{model="gpt-4.1"} 2.0' in text
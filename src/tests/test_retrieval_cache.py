@@ -0,0 +1,152 @@
+import asyncio
+
+from src.llm_agent.retrieval_cache import (
+    DAY_SECONDS,
+    REDIS_QUERIES_KEY,
+    RETRIEVAL_CACHE_QUERY_DAYS,
+    RetrievalCache,
+    RetrievalQuery,
+)
+from src.schemas.schemas import GrammarEntryV2, RetrievedGrammar
+
+
+def entry(name: str) -> GrammarEntryV2:
+    return GrammarEntryV2(grammar_name_kr=name, grammar_name_rus=name, level=1, content="", related_grammars=[])
+
+
+class FakeArtifact:
+    corpus_version = "v1"
+
+    def __init__(self, names: dict[str, str]):
+        self.names = names
+
+    def __contains__(self, grammar_id: str) -> bool:
+        return grammar_id in self.names
+
+    def entry(self, grammar_id: str) -> GrammarEntryV2:
+        return entry(self.names[grammar_id])
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+        self.scores: dict[str, dict[str, float]] = {}
+        self.expiries = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.values[key] = value
+
+    async def expire(self, key, seconds):
+        self.expiries[key] = seconds
+
+    async def zincrby(self, key, amount, member):
+        scores = self.scores.setdefault(key, {})
+        scores[member] = scores.get(member, 0) + amount
+        return scores[member]
+
+    async def zunionstore(self, dest, keys):
+        union = {}
+        for key in keys:
+            for member, score in self.scores.get(key, {}).items():
+                union[member] = union.get(member, 0) + score
+        self.scores[dest] = union
+
+    async def zrevrange(self, key, start, end):
+        scores = self.scores.get(key, {})
+        return sorted(scores, key=scores.get, reverse=True)[start:end + 1]
+
+
+def query(text: str, llm_filter: bool = True) -> RetrievalQuery:
+    return RetrievalQuery.create(text, "Что значит " + text, 15, llm_filter, "gpt-4.1", True)
+
+
+def test_query_is_normalized():
+    assert query("-고  싶다") == query("-고 싶다")
+    # Without the filter the prompt is not part of the key
+    assert RetrievalQuery.create("-고 싶다", "a", 15, False, "gpt-4.1", True) == \
+        RetrievalQuery.create("-고 싶다", "b", 15, False, "gpt-4.1-mini", True)
+    assert RetrievalQuery.from_member(query("-고 싶다").member()) == query("-고 싶다")
+
+
+def test_entries_are_keyed_by_corpus_version():
+    async def scenario():
+        cache = RetrievalCache()
+        await cache.put(query("-고 싶다"), "v1", [RetrievedGrammar(id="1", content=entry("-고 싶다"), score=0.5)])
+
+        cached = await cache.get(query("-고 싶다"), "v1")
+        assert cached.ids == ["1"] and cached.scores == [0.5]
+        assert await cache.get(query("-고 싶다"), "v2") is None
+        assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_lru_eviction():
+    async def scenario():
+        cache = RetrievalCache(max_size=2)
+        for text in ("a", "b"):
+            await cache.put(query(text), "v1", None)
+        await cache.get(query("a"), "v1")
+        await cache.put(query("c"), "v1", None)
+
+        assert await cache.get(query("b"), "v1") is None
+        assert await cache.get(query("a"), "v1") is not None
+
+    asyncio.run(scenario())
+
+
+def test_hydrate_from_the_artifact():
+    async def scenario():
+        cache = RetrievalCache()
+        cache.artifact = FakeArtifact({"1": "-고 싶다", "2": "-고 있다"})
+        await cache.put(query("-고"), "v1", [
+            RetrievedGrammar(id="2", content=entry("-고 있다"), score=0.9),
+            RetrievedGrammar(id="1", content=entry("-고 싶다"), score=0.4),
+        ])
+        # The filter rejected every candidate
+        await cache.put(query("-는데"), "v1", None)
+
+        docs = await cache.hydrate(None, "grammars", await cache.get(query("-고"), "v1"))
+        assert [(doc.id, doc.content.grammar_name_kr, doc.score) for doc in docs] == [
+            ("2", "-고 있다", 0.9), ("1", "-고 싶다", 0.4),
+        ]
+        assert await cache.hydrate(None, "grammars", await cache.get(query("-는데"), "v1")) is None
+
+    asyncio.run(scenario())
+
+
+def test_redis_shares_entries_and_warms_frequent_queries():
+    async def scenario():
+        redis = FakeRedis()
+        first, second = RetrievalCache(), RetrievalCache()
+        first.redis = second.redis = redis
+
+        await first.put(query("-고 싶다"), "v1", [RetrievedGrammar(id="1", content=entry("-고 싶다"), score=0.5)])
+        assert (await second.get(query("-고 싶다"), "v1")).ids == ["1"]
+        assert second.stats()["redis_hits"] == 1
+
+        for _ in range(3):
+            await first.get(query("-는데"), "v1")
+
+        recomputed = []
+
+        async def retrieve(retrieval_query):
+            recomputed.append(retrieval_query)
+            await third.put(retrieval_query, "v1", None)
+
+        third = RetrievalCache()
+        third.redis = redis
+        assert await third.warm("v1", retrieve) == 2
+        # The most frequent query first, the one already in Redis is not recomputed
+        assert recomputed == [query("-는데")]
+        assert len(third) == 2
+
+        # The lookups are counted per day and expire with it
+        days = [key for key in redis.scores if key.startswith(REDIS_QUERIES_KEY + ":")]
+        assert len(days) == 1 and redis.scores[days[0]][query("-는데").member()] == 3
+        assert redis.expiries[days[0]] == RETRIEVAL_CACHE_QUERY_DAYS * DAY_SECONDS
+
+    asyncio.run(scenario())
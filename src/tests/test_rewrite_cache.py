@@ -0,0 +1,15 @@
+from src.llm_agent.rewrite_cache import RewriteCache
+
+
+def test_rewrites_are_cached_per_normalized_prompt():
+    cache = RewriteCache(max_size=2)
+    cache.put("Что значит -고 싶다?", "-고 싶다")
+    cache.put("привет", "None")
+
+    assert cache.get("что  значит -고 싶다?") == "-고 싶다"
+    assert cache.get("пока") is None
+
+    cache.put("-는데", "-는데")
+    # "привет" was the least recently used
+    assert cache.get("привет") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
@@ -0,0 +1,40 @@
+from src.api.evaluation.router_fusion import RoutingCase, RoutingOutcome, compare_routing, normalize_pattern
+
+
+def test_normalize_pattern():
+    assert normalize_pattern("-(으)면") == normalize_pattern("(으)면")
+    assert normalize_pattern("-고 싶다") == normalize_pattern("-고싶다")
+    assert normalize_pattern("Будущее время") == normalize_pattern("будущее время")
+
+
+def test_compare_routing():
+    cases = [
+        RoutingCase("가고 싶어요", "direct_grammar_search", "-고 싶다"),
+        RoutingCase("грамматика 이/가", "direct_grammar_search", "이/가"),
+        RoutingCase("разница между 은/는 и 이/가", "thinking_grammar_answer"),
+        RoutingCase("привет", "casual_answer"),
+    ]
+    two_step = [
+        RoutingOutcome("direct_grammar_search", "-고 싶다", 1.2, 300),
+        RoutingOutcome("direct_grammar_search", "이/가", 1.0, 300),
+        RoutingOutcome("thinking_grammar_answer", "None", 0.6, 200),
+        RoutingOutcome("casual_answer", "None", 0.6, 200),
+    ]
+    fused = [
+        RoutingOutcome("direct_grammar_search", "고 싶다", 0.7, 250),
+        RoutingOutcome("direct_grammar_search", "가", 0.7, 250),
+        RoutingOutcome("direct_grammar_search", "은/는", 0.7, 250),
+        RoutingOutcome("casual_answer", "None", 0.6, 240),
+    ]
+
+    report = compare_routing(cases, two_step, fused)
+
+    assert report["classification_agreement"] == 0.75
+    assert report["pattern_agreement"] == 0.5
+    assert report["two_step"]["classification_accuracy"] == 1.0
+    assert report["fused"]["classification_accuracy"] == 0.75
+    assert report["two_step"]["pattern_accuracy"] == 1.0
+    assert report["fused"]["pattern_accuracy"] == 0.5
+    assert report["fused"]["latency_ms"]["mean"] < report["two_step"]["latency_ms"]["mean"]
+    assert report["two_step"]["mean_tokens"] == 250.0
+    assert len(report["disagreements"]) == 2
@@ -0,0 +1,97 @@
+import asyncio
+
+from src.llm_agent.single_flight import SingleFlight, normalize_key
+
+
+def test_normalize_key():
+    assert normalize_key("  Грамматика   -는데 ") == normalize_key("грамматика -는데")
+
+
+def test_concurrent_calls_are_coalesced():
+    async def run():
+        flight = SingleFlight("test")
+        executions = 0
+
+        async def work():
+            nonlocal executions
+            executions += 1
+            execution = executions
+            await asyncio.sleep(0.01)
+            return [execution]
+
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(5)), flight.do("other", work))
+        # Calls after the work is done run it again
+        later = await flight.do("key", work)
+        return flight, executions, results, later
+
+    flight, executions, results, later = asyncio.run(run())
+
+    assert executions == 3
+    assert results[:5] == [[1]] * 5
+    assert later == [3]
+    assert flight.stats() == {"calls": 7, "executed": 3, "coalesced": 4, "coalesced_rate": 0.571, "in_flight": 0}
+
+
+def test_exceptions_are_shared_and_not_cached():
+    async def run():
+        flight = SingleFlight("test")
+        attempts = 0
+
+        async def work():
+            nonlocal attempts
+            attempts += 1
+            await asyncio.sleep(0.01)
+            if attempts == 1:
+                raise RuntimeError("rate limited")
+            return "ok"
+
+        failed = await asyncio.gather(flight.do("key", work), flight.do("key", work), return_exceptions=True)
+        return failed, await flight.do("key", work)
+
+    failed, result = asyncio.run(run())
+
+    assert all(isinstance(error, RuntimeError) for error in failed)
+    assert result == "ok"
+
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    async def run():
+        flight = SingleFlight("test")
+
+        async def work():
+            await asyncio.sleep(0.02)
+            return "done"
+
+        leader = asyncio.create_task(flight.do("key", work))
+        follower = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0.005)
+        leader.cancel()
+        return await follower, leader
+
+    result, leader = asyncio.run(run())
+
+    assert result == "done"
+    assert leader.cancelled()
+
+
+def test_last_cancelled_caller_cancels_the_work():
+    async def run():
+        flight = SingleFlight("test")
+        started = asyncio.Event()
+        finished = []
+
+        async def work():
+            started.set()
+            await asyncio.sleep(0.05)
+            finished.append(True)
+
+        caller = asyncio.create_task(flight.do("key", work))
+        await started.wait()
+        caller.cancel()
+        await asyncio.sleep(0.08)
+        return finished, flight.in_flight
+
+    finished, in_flight = asyncio.run(run())
+
+    assert finished == []
+    assert in_flight == 0
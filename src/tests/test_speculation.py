@@ -0,0 +1,65 @@
+import asyncio
+from types import SimpleNamespace
+
+from src.llm_agent.pipeline_metrics import record_usage
+from src.llm_agent.speculation import speculate, speculation_stats
+
+
+def run_result(output, tokens=0):
+    usage = SimpleNamespace(request_tokens=tokens, response_tokens=0)
+    return SimpleNamespace(output=output, usage=lambda: usage)
+
+
+async def verdict(message_type: str, delay: float):
+    await asyncio.sleep(delay)
+    return message_type
+
+
+def test_accepted_speculation_overlaps_the_branch():
+    async def branch():
+        await asyncio.sleep(0.05)
+        return "grammars"
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        result = await speculate(verdict("direct_grammar_search", 0.05), branch, lambda v: v == "direct_grammar_search")
+        return result, loop.time() - started
+
+    saved_before = speculation_stats.saved_seconds
+    (message_type, grammars), elapsed = asyncio.run(run())
+
+    assert (message_type, grammars) == ("direct_grammar_search", "grammars")
+    assert elapsed < 0.09
+    assert speculation_stats.saved_seconds - saved_before > 0.03
+
+
+def test_rejected_speculation_is_cancelled_and_counts_wasted_tokens():
+    finished = []
+
+    async def branch():
+        record_usage("query_rewriter", run_result("-는데", tokens=120))
+        await asyncio.sleep(0.1)
+        finished.append(True)
+
+    before = speculation_stats.as_dict()
+    message_type, grammars = asyncio.run(
+        speculate(verdict("casual_answer", 0.01), branch, lambda v: v == "direct_grammar_search")
+    )
+    after = speculation_stats.as_dict()
+
+    assert (message_type, grammars) == ("casual_answer", None)
+    assert finished == []
+    assert after["rejected"] - before["rejected"] == 1
+    assert after["cancelled"] - before["cancelled"] == 1
+    assert after["wasted_tokens"] - before["wasted_tokens"] == 120
+
+
+def test_branch_failure_is_ignored_when_rejected():
+    async def branch():
+        raise RuntimeError("qdrant is down")
+
+    async def run():
+        return await speculate(verdict("thinking_grammar_answer", 0.01), branch, lambda v: False)
+
+    assert asyncio.run(run()) == ("thinking_grammar_answer", None)
@@ -0,0 +1,72 @@
+import json
+import re
+import time
+from pathlib import Path
+
+import pytest
+
+from src.utils.json_to_telegram_md import custom_telegram_format
+from src.utils.md_to_json import parse_entry_v2
+from src.utils.old.json_to_telegram_md_regex import custom_telegram_format as regex_telegram_format
+
+GOLDEN_ANSWERS_PATH = Path(__file__).parent / "golden" / "telegram_answers.json"
+GRAMMAR_LIST_PATH = Path(__file__).parents[2] / "data" / "grammar-level-1" / "final" / "grammar_list_clean_word2md.md"
+
+golden_answers = json.loads(GOLDEN_ANSWERS_PATH.read_text(encoding="utf-8"))
+
+
+def load_grammar_cards() -> list[str]:
+    """
+    Markdown of the grammar cards, the same way grammar_entry_to_markdown builds it
+    """
+    text = GRAMMAR_LIST_PATH.read_text(encoding="utf-8")
+    entries = [parse_entry_v2(entry) for entry in re.split(r"^## ", text, flags=re.MULTILINE) if entry.strip()]
+    return [f"**{entry['grammar_name_kr']} - {entry['grammar_name_rus']}**\n\n{entry['content']}" for entry in entries]
+
+
+@pytest.mark.parametrize("answer", golden_answers, ids=[answer["name"] for answer in golden_answers])
+def test_golden_answers(answer):
+    assert custom_telegram_format(answer["markdown"]) == answer["html"]
+
+
+def test_grammar_cards_match_regex_formatter():
+    cards = load_grammar_cards()
+    assert cards
+
+    for card in cards:
+        assert custom_telegram_format(card) == regex_telegram_format(card)
+
+
+@pytest.mark.parametrize("text", [
+    "[a [b] c] d](https://example.com)",
+    "![image](https://example.com/a.png) 【4:0†source】 [link](url)",
+    "-\n# Заголовок",
+    "*a*b* *c* snake_case_name 2*3",
+    "***жирный курсив*** ___подчёркнутый курсив___ ~~зачёркнутый~~ ||спойлер||",
+    "```python\nprint('<b>')\n```\n`a & b`",
+    "текст\n\n\n\n\nтекст <blockquote>цитата</blockquote>",
+    "**незакрытый `код",
+])
+def test_edge_cases_match_regex_formatter(text):
+    assert custom_telegram_format(text) == regex_telegram_format(text)
+
+
+def test_many_inline_code_spans():
+    text = " ".join(f"`c{i}`" for i in range(12))
+    assert custom_telegram_format(text) == " ".join(f"<code>c{i}</code>" for i in range(12))
+
+
+def test_linear_time():
+    base = "\n\n".join(answer["markdown"] for answer in golden_answers)
+    # Unmatched single asterisks made the italic regex quadratic
+    stars = "a *b " * 500
+
+    for text in (base, stars):
+        timings = []
+        for size in (4, 32):
+            start = time.perf_counter()
+            custom_telegram_format(text * size)
+            timings.append(time.perf_counter() - start)
+
+        # 8x the input, generous margin for noisy machines
+        assert timings[1] < timings[0] * 8 * 4
@@ -0,0 +1,39 @@
+"""
+Benchmarks of the markdown to Telegram HTML formatter against the previous regex pipeline.
+
+Run with:
+    pytest src/tests/test_telegram_format_benchmark.py --benchmark-group-by=param:size
+"""
+import json
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from src.utils.json_to_telegram_md import custom_telegram_format
+from src.utils.old.json_to_telegram_md_regex import custom_telegram_format as regex_telegram_format
+
+GOLDEN_ANSWERS_PATH = Path(__file__).parent / "golden" / "telegram_answers.json"
+
+golden_answers = json.loads(GOLDEN_ANSWERS_PATH.read_text(encoding="utf-8"))
+answers_text = "\n\n".join(answer["markdown"] for answer in golden_answers)
+
+TEXTS = {
+    "answer": golden_answers[0]["markdown"],
+    "answers_x1": answers_text,
+    "answers_x16": answers_text * 16,
+    "answers_x64": answers_text * 64,
+    "unmatched_asterisks": "a *b " * 2000,
+}
+FORMATTERS = {
+    "tokenizer": custom_telegram_format,
+    "regex": regex_telegram_format,
+}
+
+
+@pytest.mark.parametrize("size", TEXTS)
+@pytest.mark.parametrize("formatter", FORMATTERS)
+def test_format_benchmark(benchmark, formatter, size):
+    benchmark.group = size
+    benchmark(FORMATTERS[formatter], TEXTS[size])
@@ -0,0 +1,64 @@
+import json
+import re
+from collections import Counter
+from pathlib import Path
+
+import pytest
+
+from src.utils.json_to_telegram_md import custom_telegram_format
+from src.utils.telegram_html_splitter import TAG_PATTERN, split_telegram_html, utf16_length
+
+GOLDEN_ANSWERS_PATH = Path(__file__).parent / "golden" / "telegram_answers.json"
+
+golden_answers = json.loads(GOLDEN_ANSWERS_PATH.read_text(encoding="utf-8"))
+answers_html = "\n\n".join(custom_telegram_format(answer["markdown"]) for answer in golden_answers)
+
+
+def visible_length(chunk: str) -> int:
+    return utf16_length(re.sub(r"&#?\w+;", "&", TAG_PATTERN.sub("", chunk)))
+
+
+def words(html: str) -> list[str]:
+    return TAG_PATTERN.sub(" ", html).split()
+
+
+def test_short_message_is_not_split():
+    assert split_telegram_html("<b>Привет</b>\n") == ["<b>Привет</b>"]
+
+
+@pytest.mark.parametrize("limit", [4096, 500, 120])
+def test_chunks_fit_and_keep_text(limit):
+    html = answers_html * 3
+    chunks = split_telegram_html(html, limit)
+
+    assert len(chunks) > 1
+    assert all(visible_length(chunk) <= limit for chunk in chunks)
+    assert [word for chunk in chunks for word in words(chunk)] == words(html)
+
+    for chunk in chunks:
+        balance = Counter()
+        for tag in TAG_PATTERN.finditer(chunk):
+            balance[tag.group(2)] += -1 if tag.group(1) else 1
+        assert not +balance
+
+
+def test_prefers_paragraphs():
+    html = "первый абзац ответа\n\nвторой абзац " + "текст " * 10
+    assert split_telegram_html(html, 40)[0] == "первый абзац ответа"
+
+
+def test_code_block_is_reopened():
+    html = '<pre><code class="language-python">' + "print(1)\n" * 10 + "</code></pre>"
+    chunks = split_telegram_html(html, 40)
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunk.startswith('<pre><code class="language-python">')
+        assert chunk.endswith("</code></pre>")
+
+
+def test_links_are_not_split():
+    html = "слово " * 5 + '<a href="https://example.com">длинная ссылка на пример</a>' + " слово" * 5
+    chunks = split_telegram_html(html, 40)
+
+    assert any('<a href="https://example.com">длинная ссылка на пример</a>' in chunk for chunk in chunks)
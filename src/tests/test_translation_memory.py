@@ -0,0 +1,39 @@
+import pytest
+
+from src.llm_agent.translation_memory import segment_text, split_parts, translation_key
+
+TEXTS = [
+    "Привет! Как дела?",
+    "- 안녕하세요. 저는 학생이에요.\n- 감사합니다!\n",
+    "1) Это т.е. пример... Да.\n\n  > «Цитата.» Конец\n12345 🙂",
+]
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_segments_join_back_to_text(text):
+    assert "".join(segment.text for segment in segment_text(text)) == text
+
+
+def test_sentences_and_directions():
+    segments = segment_text("- 안녕하세요. 저는 학생이에요.\nЭто т.е. пример. 123")
+    sentences = [(segment.text, segment.direction) for segment in segments if segment.direction]
+
+    assert sentences == [
+        ("안녕하세요.", "ko-ru"),
+        ("저는 학생이에요.", "ko-ru"),
+        ("Это т.е. пример.", "ru-ko"),
+    ]
+
+
+def test_key_ignores_whitespace():
+    assert translation_key("Как  дела?", "ru-ko") == translation_key(" Как дела? ", "ru-ko")
+    assert translation_key("Как дела?", "ru-ko") != translation_key("Как дела?", "ko-ru")
+
+
+def test_parts_end_on_paragraphs():
+    text = "\n\n".join(f"Абзац {i}. Второе предложение абзаца {i}." for i in range(6))
+    parts = split_parts(segment_text(text), max_chars=80)
+
+    assert len(parts) == 3
+    assert "".join(segment.text for part in parts for segment in part) == text
+    assert all(part[-1].text == "\n" for part in parts[:-1])
@@ -0,0 +1,64 @@
+import asyncio
+
+from pydantic_ai.messages import ModelMessagesTypeAdapter, ModelRequest, ModelResponse, TextPart, UserPromptPart
+
+from src.llm_agent.warmup import WarmupJob, mine_history
+
+
+def blob(prompt: str, answer: str = "ответ") -> bytes:
+    return ModelMessagesTypeAdapter.dump_json([
+        ModelRequest(parts=[UserPromptPart(content=prompt)]),
+        ModelResponse(parts=[TextPart(content=answer)]),
+    ])
+
+
+def test_mine_history_counts_prompts_and_selections():
+    blobs = [
+        blob("-고 싶다"),
+        blob("Что значит -는데?"),
+        blob("-고  싶다"),
+        blob("Selected: -는데 - союз"),
+        blob("Selected: -는데 - союз"),
+        blob("Selected: -고 - и"),
+        b"not json",
+    ]
+
+    history = mine_history(blobs, top_prompts=1, top_selections=5)
+
+    # The normalized duplicates are counted together, the first spelling is kept
+    assert history.prompts == ["-고 싶다"]
+    assert history.selections == ["-는데 - союз", "-고 - и"]
+
+
+def test_warmup_reports_progress_and_failures():
+    async def scenario():
+        job = WarmupJob(budget_seconds=1, concurrency=2)
+
+        async def fail():
+            raise RuntimeError("qdrant is down")
+
+        steps = [("prompt", lambda: asyncio.sleep(0)), ("prompt", lambda: asyncio.sleep(0)), ("card", fail)]
+        assert not job.ready
+        await job.run(steps)
+        return job
+
+    job = asyncio.run(scenario())
+    progress = job.as_dict()
+
+    assert job.ready
+    assert progress["completed"] == 3 and progress["failed"] == 1
+    assert progress["warmed"] == {"prompt": 2}
+    assert progress["progress"] == 1.0
+
+
+def test_warmup_stops_at_the_budget():
+    async def scenario():
+        job = WarmupJob(budget_seconds=0.05, concurrency=1)
+        await job.run([("retrieval", lambda: asyncio.sleep(0.01)) for _ in range(20)])
+        return job
+
+    job = asyncio.run(scenario())
+
+    # The API reports ready once the budget is spent, with the remaining steps cancelled
+    assert job.ready and job.timed_out
+    assert 0 < job.completed < 20
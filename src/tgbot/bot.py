@@ -6,11 +6,17 @@ from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.storage.redis import RedisStorage, DefaultKeyBuilder
 from aiogram.client.default import DefaultBotProperties
+from prometheus_client import REGISTRY
 
 from src.config.settings import Config
 from src.tgbot.handlers import routers_list
 from src.tgbot.middlewares.config import ConfigMiddleware
+from src.utils.corpus_artifact import load_corpus_artifact
+from src.tgbot.misc.grammar_cache import grammar_card_cache
+from src.tgbot.misc.message_sender import message_sender
+from src.tgbot.misc.metrics import metrics_sampler, start_metrics_server
 from src.tgbot.misc.utils import send_admin_message
+from src.utils.prometheus import StatsCollector
 
 
 async def on_startup(bot: Bot, admin_ids: list[int]):
@@ -33,6 +39,7 @@ async def on_startup(bot: Bot, admin_ids: list[int]):
         BotCommand(command="status", description="Show bot and system status"),
         BotCommand(command="deleteuser", description="Delete user by ID"),
         BotCommand(command="history", description="Get user chat history by ID"),
+        BotCommand(command="answercache", description="Inspect or purge the answer cache"),
     ]
 
     admin_commands.extend(commands)
@@ -131,8 +138,29 @@ async def main():
 
     register_global_middlewares(dp, config)
 
+    # Serve grammar cards straight from the compiled corpus artifact when it is available
+    grammar_card_cache.artifact = load_corpus_artifact()
+
     await on_startup(bot, config.admin_ids)
-    await dp.start_polling(bot)
+
+    # Sample system metrics in the background, so that /status never blocks the event loop
+    metrics_sampler.register_queue("outgoing_answers", lambda: message_sender.pending)
+    metrics_sampler.start()
+
+    REGISTRY.register(StatsCollector("bot", metrics_sampler.latest_values))
+    REGISTRY.register(StatsCollector("bot_queue", metrics_sampler.latest_queue_depths, label="queue"))
+    REGISTRY.register(StatsCollector(
+        "grammar_card_cache",
+        lambda: {"hits": grammar_card_cache.hits, "misses": grammar_card_cache.misses, "size": len(grammar_card_cache)},
+        counters=("hits", "misses"),
+    ))
+    metrics_runner = await start_metrics_server()
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await metrics_sampler.stop()
+        if metrics_runner:
+            await metrics_runner.cleanup()
 
 
 if __name__ == "__main__":
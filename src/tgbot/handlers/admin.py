@@ -1,3 +1,5 @@
+import aiohttp
+import html
 import psutil
 import os
 from datetime import datetime
@@ -5,14 +7,21 @@ from aiogram import Router
 from aiogram.filters import CommandStart, Command
 from aiogram.types import Message
 
+from src.config.settings import Config
 from src.db.crud import add_user, get_all_users, delete_user_by_id, get_full_message_history
 from src.schemas.schemas import TelegramUser
 from src.tgbot.filters.admin import AdminFilter
+from src.tgbot.misc.metrics import metrics_sampler, sparkline
 from src.db.database import async_session
 
 admin_router = Router()
 admin_router.message.filter(AdminFilter())
 
+config = Config()
+
+ANSWER_CACHE_API_URL = f"http://{config.fastapi_host}:{config.fastapi_port}/answer-cache"
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN", "")
+
 
 def escape_markdown_v2(text: str) -> str:
     """Remove special characters that need escaping in MarkdownV2"""
@@ -136,47 +145,91 @@ async def get_user_history(message: Message):
 
 @admin_router.message(Command("status"))
 async def bot_status(message: Message):
-    """Show bot and system status"""
+    """Show bot and system status from the background metrics sampler"""
     try:
+        sample = metrics_sampler.latest
+        if sample is None:
+            await message.reply("⏳ Metrics are not collected yet, try again in a few seconds.")
+            return
+
         current_process = psutil.Process(os.getpid())
-        
-        # Bot process information
-        memory_info = current_process.memory_info()
-        memory_mb = memory_info.rss / (1024 * 1024)
-        cpu_percent = current_process.cpu_percent()
-        
-        # System information
-        system_memory = psutil.virtual_memory()
-        system_cpu = psutil.cpu_percent(interval=1)
-        
+
         # Uptime calculation
         process_start = datetime.fromtimestamp(current_process.create_time())
         uptime = datetime.now() - process_start
-        
-        status_text = f"""
-🤖 **Bot Status:**
+        sampled_at = datetime.fromtimestamp(sample.timestamp)
 
-**Process Info:**
-• PID: `{os.getpid()}`
-• Memory Usage: `{memory_mb:.1f} MB`
-• CPU Usage: `{cpu_percent:.1f}%`
-• Uptime: `{str(uptime).split('.')[0]}`
-• Started: `{process_start.strftime('%Y-%m-%d %H:%M:%S')}`
+        queues = ", ".join(f"{name}={depth}" for name, depth in sample.queue_depths.items()) or "-"
 
-**System Info:**
-• System Memory: `{system_memory.percent:.1f}% used`
-• System CPU: `{system_cpu:.1f}%`
-• Available Memory: `{system_memory.available / (1024**3):.1f} GB`
+        status_text = f"""
+🤖 <b>Bot Status:</b>
+
+<b>Process Info:</b>
+• PID: <code>{os.getpid()}</code>
+• Memory Usage: <code>{sample.rss_mb:.1f} MB</code> {sparkline(metrics_sampler.history("rss_mb"))}
+• CPU Usage: <code>{sample.process_cpu:.1f}%</code> {sparkline(metrics_sampler.history("process_cpu"))}
+• Event Loop Lag: <code>{sample.loop_lag_ms:.1f} ms</code> {sparkline(metrics_sampler.history("loop_lag_ms"))}
+• Asyncio Tasks: <code>{sample.asyncio_tasks}</code> {sparkline(metrics_sampler.history("asyncio_tasks"))}
+• Open Connections: <code>{sample.open_connections}</code>
+• Pending API Calls: <code>{sample.pending_api_calls}</code> {sparkline(metrics_sampler.history("pending_api_calls"))}
+• Queues: <code>{queues}</code>
+• Uptime: <code>{str(uptime).split('.')[0]}</code>
+• Started: <code>{process_start.strftime('%Y-%m-%d %H:%M:%S')}</code>
+
+<b>System Info:</b>
+• System Memory: <code>{sample.system_memory_percent:.1f}% used</code>
+• System CPU: <code>{sample.system_cpu:.1f}%</code> {sparkline(metrics_sampler.history("system_cpu"))}
+
+<i>Sampled at {sampled_at.strftime('%H:%M:%S')}, every {metrics_sampler.interval:.0f}s</i>
 
 ✅ Bot is running normally
         """
-        
-        await message.reply(escape_markdown_v2(status_text), parse_mode="MarkdownV2")
-        
+
+        await message.reply(status_text, parse_mode="HTML")
+
     except Exception as e:
         await message.reply(f"❌ Error getting bot status: {str(e)}")
 
 
+@admin_router.message(Command("answercache"))
+async def answer_cache_command(message: Message):
+    """Inspect or purge the semantic answer cache of the API"""
+    command_parts = message.text.split()
+    try:
+        headers = {"X-Admin-Token": ADMIN_API_TOKEN}
+        async with aiohttp.ClientSession(headers=headers) as session:
+            if len(command_parts) >= 2 and command_parts[1] == "purge":
+                url = ANSWER_CACHE_API_URL if len(command_parts) == 2 else f"{ANSWER_CACHE_API_URL}/{command_parts[2]}"
+                async with session.delete(url) as response:
+                    if response.status == 404:
+                        await message.reply(f"❌ Entry {html.escape(command_parts[2])} not found.")
+                        return
+                    response.raise_for_status()
+                    data = await response.json()
+                await message.reply(f"🗑 Removed {data['removed']} cached answers.")
+                return
+
+            async with session.get(ANSWER_CACHE_API_URL, params={"limit": 10}) as response:
+                response.raise_for_status()
+                data = await response.json()
+
+        stats = data["stats"]
+        text = (
+            "🧠 <b>Answer cache:</b>\n\n"
+            f"• Entries: <code>{stats['entries']}</code>\n"
+            f"• Hits / misses: <code>{stats['hits']} / {stats['misses']}</code> ({stats['hit_rate']:.0%})\n"
+            f"• Threshold: <code>{stats['threshold']}</code>\n\n"
+        )
+        for entry in data["entries"]:
+            text += f"<code>{entry['id']}</code> ({entry['hits']} hits) {html.escape(entry['question'][:100])}\n"
+        text += "\n<i>/answercache purge [id] - remove all entries or a single one</i>"
+
+        await message.reply(text, parse_mode="HTML")
+
+    except Exception as e:
+        await message.reply(f"❌ Error accessing the answer cache: {html.escape(str(e))}")
+
+
 @admin_router.message(Command("help"))
 async def admin_help(message: Message):
     """Show available admin commands"""
@@ -187,6 +240,7 @@ async def admin_help(message: Message):
 /deleteuser + user_id - Delete a user by their ID
 /history + user_id - Get message history for a user
 /status - Show bot and system status
+/answercache - Inspect the answer cache, /answercache purge + id to purge it
 /help - Show this help message
     """
     await message.reply(escape_markdown_v2(help_text), parse_mode="MarkdownV2")
\ No newline at end of file
@@ -12,9 +12,13 @@ import logging
 
 from src.config.settings import Config
 from src.schemas.schemas import TelegramMessage, TelegramUser
+from src.tgbot.misc.grammar_cache import grammar_card_cache
+from src.tgbot.misc.metrics import metrics_sampler
+from src.tgbot.misc.message_sender import message_sender
 from src.tgbot.misc.utils import animate_thinking, send_admin_message
 from src.tgbot.misc.states import TranslationState, ConversationState
 from src.utils.json_to_telegram_md import grammar_entry_to_markdown, custom_telegram_format
+from src.utils.telegram_html_splitter import split_telegram_html
 from src.db.crud import update_message_history, deactivate_last_grammar_selection
 from src.db.database import async_session
 from pydantic_ai.messages import ModelRequest, ModelResponse, UserPromptPart, TextPart
@@ -88,7 +92,7 @@ async def invoke(message: types.Message, state: FSMContext):
                 user_prompt=message.text,
                 user=user
             )
-            async with session.post(
+            async with metrics_sampler.track_api_call(), session.post(
                 API_URL, json=telegram_message.model_dump()
             ) as response:
                 await thinking_message.delete()
@@ -105,13 +109,15 @@ async def invoke(message: types.Message, state: FSMContext):
 
                     if mode == "single_grammar":
                         formatted_response = grammar_entry_to_markdown(llm_response[0])
-                        await message.answer(formatted_response)
+                        await message_sender.answer(message, formatted_response)
                         await state.clear()  # Clear processing state
 
                     elif mode == "multiple_grammars":
+                        # INFO: Only grammar IDs are kept in FSM state, cards are served by grammar_card_cache
                         await state.set_state(GrammarSelectionStates.waiting_for_selection)
                         await state.update_data(
-                            grammars=llm_response,
+                            grammar_ids=[grammar["id"] for grammar in llm_response],
+                            corpus_version=data["corpus_version"],
                             selection_timestamp=datetime.now().isoformat()
                         )
 
@@ -135,12 +141,12 @@ async def invoke(message: types.Message, state: FSMContext):
 
 
                     elif mode == "no_grammars":
-                        await message.answer("К сожалению, я не смог найти подходящие грамматики в своей базе. Позвольте мне ответить самостоятельно:")
-                        await message.answer(custom_telegram_format(llm_response))
+                        await message_sender.answer(message, "К сожалению, я не смог найти подходящие грамматики в своей базе. Позвольте мне ответить самостоятельно:")
+                        await message_sender.answer(message, custom_telegram_format(llm_response))
                         await state.clear()  # Clear processing state
 
                     else:
-                        await message.answer(custom_telegram_format(llm_response))
+                        await message_sender.answer(message, custom_telegram_format(llm_response))
                         await state.clear()  # Clear processing state
 
                 elif response.status == 403:
@@ -183,6 +189,20 @@ async def invoke(message: types.Message, state: FSMContext):
             await state.clear()  # Always clear processing state on error
 
 
+async def replace_response_messages(
+    callback: types.CallbackQuery, state: FSMContext, message_ids: list[int], text: str
+) -> None:
+    """Delete the previous response messages and send the new response instead"""
+    for message_id in message_ids:
+        try:
+            await callback.bot.delete_message(chat_id=callback.message.chat.id, message_id=message_id)
+        except TelegramBadRequest as e:
+            logging.warning(f"Failed to delete message {message_id}: {e}")
+
+    response_messages = await message_sender.answer(callback.message, text)
+    await state.update_data(response_message_ids=[response.message_id for response in response_messages])
+
+
 @chat_router.callback_query(F.data.startswith("grammar_select:"))
 async def handle_grammar_selection(callback: types.CallbackQuery, state: FSMContext):
     try:
@@ -191,7 +211,8 @@ async def handle_grammar_selection(callback: types.CallbackQuery, state: FSMCont
 
         # Get stored grammar data
         data = await state.get_data()
-        grammars = data.get("grammars", [])
+        grammar_ids = data.get("grammar_ids", [])
+        corpus_version = data.get("corpus_version", "")
         timestamp_str = data.get("selection_timestamp")
         
         # Check if selection has expired (10 minutes)
@@ -202,10 +223,13 @@ async def handle_grammar_selection(callback: types.CallbackQuery, state: FSMCont
                 await state.clear()
                 return
 
-        if 0 <= grammar_index < len(grammars):
-            selected_grammar = grammars[grammar_index]
-            formatted_response = grammar_entry_to_markdown(selected_grammar)
-            
+        card = None
+        if 0 <= grammar_index < len(grammar_ids):
+            card = await grammar_card_cache.get(grammar_ids[grammar_index], corpus_version)
+
+        if card is not None:
+            formatted_response = card.html
+
             # Update message history with the selection
             try:
                 user = TelegramUser(
@@ -217,7 +241,7 @@ async def handle_grammar_selection(callback: types.CallbackQuery, state: FSMCont
                 )
                 
                 # Create selection message pair
-                grammar_title = f"{selected_grammar['grammar_name_kr'].strip()} - {selected_grammar['grammar_name_rus'].strip()}"
+                grammar_title = card.title
                 user_selection = ModelRequest(parts=[UserPromptPart(content=f"Selected: {grammar_title}", part_kind="user-prompt")])
                 model_response = ModelResponse(parts=[TextPart(content=formatted_response, part_kind="text")])
                 
@@ -230,16 +254,16 @@ async def handle_grammar_selection(callback: types.CallbackQuery, state: FSMCont
             except Exception as e:
                 logging.error(f"Failed to update message history: {e}")
             
-            # Check if this user already has a response message
-            response_message_id = data.get("response_message_id")
+            # Check if this user already has a response message (several ones if the card was split)
+            response_message_ids = data.get("response_message_ids", [])
             
-            if response_message_id:
+            if len(response_message_ids) == 1 and len(split_telegram_html(formatted_response)) == 1:
                 # Edit the existing response message, not the options message
                 try:
                     await callback.bot.edit_message_text(
                         text=formatted_response,
                         chat_id=callback.message.chat.id,
-                        message_id=response_message_id
+                        message_id=response_message_ids[0]
                     )
 
                 except TelegramBadRequest:
@@ -247,21 +271,15 @@ async def handle_grammar_selection(callback: types.CallbackQuery, state: FSMCont
                     pass
 
                 except Exception as e:
-                    logging.warning(f"Failed to edit message {response_message_id}: {e}")
-                    await callback.bot.delete_message(
-                        chat_id=callback.message.chat.id,
-                        message_id=response_message_id
-                    )
-                    response_msg = await callback.message.answer(formatted_response)
-                    await state.update_data(response_message_id=response_msg.message_id)
+                    logging.warning(f"Failed to edit message {response_message_ids[0]}: {e}")
+                    await replace_response_messages(callback, state, response_message_ids, formatted_response)
             else:
-                # Send new response message and store its ID
-                response_msg = await callback.message.answer(formatted_response)
-                await state.update_data(response_message_id=response_msg.message_id)
+                # Send new response messages and store their IDs
+                await replace_response_messages(callback, state, response_message_ids, formatted_response)
         else:
             await callback.answer("Invalid selection", show_alert=True)
 
-    except (ValueError, IndexError) as e:
+    except (ValueError, IndexError, aiohttp.ClientError) as e:
         logging.error(f"Error processing grammar selection: {e}")
         await callback.answer("Error processing selection", show_alert=True)
 
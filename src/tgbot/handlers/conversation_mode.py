@@ -10,6 +10,8 @@ from src.db.crud import clear_chat_history
 from src.db.database import async_session
 from src.schemas.schemas import TelegramMessage, TelegramUser
 from src.tgbot.misc.states import ConversationState
+from src.tgbot.misc.metrics import metrics_sampler
+from src.tgbot.misc.message_sender import message_sender
 from src.tgbot.misc.utils import send_admin_message
 from src.utils.json_to_telegram_md import custom_telegram_format
 
@@ -85,12 +87,12 @@ async def handle_conversation_message(message: Message):
 
     try:
         async with aiohttp.ClientSession() as session:
-            async with session.post(
+            async with metrics_sampler.track_api_call(), session.post(
                 CONVERSATION_API_URL, json=telegram_message.model_dump()
             ) as response:
                 if response.status == 200:
                     result = await response.json()
-                    await message.answer(custom_telegram_format(result["response"]))
+                    await message_sender.answer(message, custom_telegram_format(result["response"]))
                 elif response.status == 403:
                     await message.answer(
                         "❌ Доступ запрещен. Обратитесь к администратору."
@@ -12,6 +12,8 @@ from src.db.crud import clear_chat_history
 from src.db.database import async_session
 from src.schemas.schemas import TelegramMessage, TelegramUser, GrammarEntryV2
 from src.tgbot.misc.states import LearningState
+from src.tgbot.misc.metrics import metrics_sampler
+from src.tgbot.misc.message_sender import message_sender
 from src.tgbot.misc.utils import send_admin_message
 from src.utils.json_to_telegram_md import custom_telegram_format
 from src.utils.old.json_to_telegram_md_old import grammar_entry_to_markdown
@@ -101,12 +103,12 @@ async def handle_learning_message(message: Message):
 
     try:
         async with aiohttp.ClientSession() as session:
-            async with session.post(
+            async with metrics_sampler.track_api_call(), session.post(
                 LEARNING_API_URL, json=telegram_message.model_dump()
             ) as response:
                 if response.status == 200:
                     result = await response.json()
-                    await message.answer(custom_telegram_format(result["response"]))
+                    await message_sender.answer(message, custom_telegram_format(result["response"]))
 
                 elif response.status == 403:
                     await message.answer(
@@ -1,4 +1,5 @@
 import aiohttp
+import json
 import logging
 from aiogram import Router, F
 from aiogram.filters import Command
@@ -8,13 +9,15 @@ from aiogram.fsm.context import FSMContext
 from src.config.settings import Config
 from src.schemas.schemas import TelegramMessage, TelegramUser
 from src.tgbot.misc.states import TranslationState
+from src.tgbot.misc.metrics import metrics_sampler
+from src.tgbot.misc.message_sender import message_sender
 from src.tgbot.misc.utils import send_admin_message
 from src.utils.json_to_telegram_md import custom_telegram_format
 
 translation_router = Router()
 config = Config()
 
-TRANSLATION_API_URL = f"http://{config.fastapi_host}:{config.fastapi_port}/translate"
+TRANSLATION_API_URL = f"http://{config.fastapi_host}:{config.fastapi_port}/translate/stream"
 
 
 @translation_router.message(Command("translate"))
@@ -59,10 +62,18 @@ async def handle_translation_message(message: Message):
 
     try:
         async with aiohttp.ClientSession() as session:
-            async with session.post(TRANSLATION_API_URL, json=telegram_message.model_dump()) as response:
+            async with metrics_sampler.track_api_call(), session.post(TRANSLATION_API_URL, json=telegram_message.model_dump()) as response:
                 if response.status == 200:
-                    result = await response.json()
-                    await message.answer(custom_telegram_format(result['translation']))
+                    # INFO: Long texts are translated in parts, each part is sent as soon as it is ready
+                    async for line in response.content:
+                        if not line.strip():
+                            continue
+                        result = json.loads(line)
+                        if "text" in result:
+                            await message_sender.answer(message, custom_telegram_format(result["text"]))
+                        elif "error" in result:
+                            await message.answer("⚠️ Произошла ошибка при переводе. Попробуйте позже.")
+                            logging.error(f"Translation stream error: {result['error']}")
                 elif response.status == 403:
                     await message.answer("❌ Доступ запрещен. Обратитесь к администратору.")
                 else:
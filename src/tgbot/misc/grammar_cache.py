@@ -0,0 +1,138 @@
+"""
+Read-through cache of rendered grammar cards shared by all users of the bot.
+
+FSM state only keeps grammar IDs, the cards themselves are read from the compiled corpus artifact
+(if its version matches) or fetched from the API on the first selection, and then served from memory,
+keyed by (corpus_version, grammar_id).
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import aiohttp
+
+from src.config.settings import Config
+from src.utils.corpus_artifact import CorpusArtifact
+from src.utils.json_to_telegram_md import grammar_entry_to_markdown
+
+config = Config()
+
+GRAMMARS_API_URL = f"http://{config.fastapi_host}:{config.fastapi_port}/grammars"
+
+
+@dataclass(frozen=True)
+class GrammarCard:
+    """
+    Grammar entry rendered to Telegram HTML
+    """
+    grammar_id: str
+    title: str
+    html: str
+
+
+class GrammarCardCache:
+    """
+    LRU cache of rendered grammar cards
+
+    Args:
+        max_size: Maximum number of cards kept in memory
+        artifact: Compiled corpus artifact to read cards from before asking the API
+    """
+
+    def __init__(self, max_size: int = 512, artifact: CorpusArtifact | None = None):
+        self.max_size = max_size
+        self.artifact = artifact
+        self.hits = 0
+        self.misses = 0
+
+        self._cards: OrderedDict[tuple[str, str], GrammarCard] = OrderedDict()
+        self._in_flight: dict[tuple[str, str], asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._cards)
+
+    def put(self, corpus_version: str, card: GrammarCard) -> None:
+        key = (corpus_version, card.grammar_id)
+        self._cards[key] = card
+        self._cards.move_to_end(key)
+
+        while len(self._cards) > self.max_size:
+            self._cards.popitem(last=False)
+
+    async def get(self, grammar_id: str, corpus_version: str) -> GrammarCard | None:
+        """
+        Return the rendered card, fetching it from the API on a cache miss.
+        Concurrent misses for the same card share a single API request.
+        """
+        key = (corpus_version, grammar_id)
+
+        card = self._cards.get(key)
+        if card is not None:
+            self.hits += 1
+            self._cards.move_to_end(key)
+            return card
+
+        self.misses += 1
+
+        if self.artifact and self.artifact.corpus_version == corpus_version and grammar_id in self.artifact:
+            card = GrammarCard(
+                grammar_id=grammar_id,
+                title=self.artifact.title(grammar_id),
+                html=self.artifact.card_html(grammar_id),
+            )
+            self.put(corpus_version, card)
+            return card
+
+        if key in self._in_flight:
+            try:
+                return await asyncio.shield(self._in_flight[key])
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    raise
+                # The request fetching the card was cancelled, not this one: fetch it again
+                return await self.get(grammar_id, corpus_version)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            card = await self._fetch(grammar_id, corpus_version)
+            future.set_result(card)
+            return card
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        except BaseException:
+            # Cancelled: the waiters must not hang on the future
+            future.cancel()
+            raise
+        finally:
+            del self._in_flight[key]
+            # Mark the exception as retrieved if nobody else was waiting for it
+            if future.done() and not future.cancelled():
+                future.exception()
+
+    async def _fetch(self, grammar_id: str, corpus_version: str) -> GrammarCard | None:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"{GRAMMARS_API_URL}/{grammar_id}") as response:
+                if response.status == 404:
+                    return None
+                response.raise_for_status()
+                data = await response.json()
+
+        grammar = data["grammar"]
+        card = GrammarCard(
+            grammar_id=grammar_id,
+            title=f"{grammar['grammar_name_kr'].strip()} - {grammar['grammar_name_rus'].strip()}",
+            html=data.get("card_html") or grammar_entry_to_markdown(grammar),
+        )
+
+        self.put(corpus_version, card)
+        if data["corpus_version"] != corpus_version:
+            logging.info(f"Corpus version changed from {corpus_version} to {data['corpus_version']}")
+            self.put(data["corpus_version"], card)
+
+        return card
+
+
+grammar_card_cache = GrammarCardCache()
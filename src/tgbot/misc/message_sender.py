@@ -0,0 +1,125 @@
+"""
+Ordered sending of long answers in several Telegram messages.
+
+Answers are split with split_telegram_html and put into the queue of their chat. A single worker per
+chat sends the chunks back to back, so the parts of one answer, and the answers sent one after another
+to the same chat, always arrive in order, while different chats are served concurrently.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import Message
+
+from src.utils.telegram_html_splitter import split_telegram_html
+
+
+@dataclass
+class OutgoingAnswer:
+    """
+    Chunks of a single answer waiting in the queue of a chat
+    """
+    bot: Bot
+    chat_id: int
+    chunks: list[str]
+    kwargs: dict[str, Any] = field(default_factory=dict)
+    future: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+
+
+class MessageSender:
+    """
+    Per-chat FIFO queues of outgoing answers, each one drained by its own worker task
+
+    Args:
+        max_retries: How many times a chunk is resent after Telegram's flood control
+    """
+
+    def __init__(self, max_retries: int = 3):
+        self.max_retries = max_retries
+
+        self._queues: dict[int, asyncio.Queue[OutgoingAnswer]] = {}
+        self._workers: dict[int, asyncio.Task] = {}
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of answers waiting to be sent in all chats
+        """
+        return sum(queue.qsize() for queue in self._queues.values())
+
+    async def answer(self, message: Message, text: str, **kwargs) -> list[Message]:
+        """
+        Reply to a message in the same chat, splitting the text if it is too long
+
+        Args:
+            message: Message to reply to
+            text: Answer in Telegram HTML
+            kwargs: Extra arguments of Bot.send_message, `reply_markup` is attached to the last chunk
+        """
+        return await self.send(message.bot, message.chat.id, text, **kwargs)
+
+    async def send(self, bot: Bot, chat_id: int, text: str, **kwargs) -> list[Message]:
+        """
+        Send a text to the chat, splitting it into several messages if it is too long
+
+        Returns:
+            Sent messages in order
+        """
+        outgoing = OutgoingAnswer(bot=bot, chat_id=chat_id, chunks=split_telegram_html(text), kwargs=kwargs)
+        self._queues.setdefault(chat_id, asyncio.Queue()).put_nowait(outgoing)
+
+        worker = self._workers.get(chat_id)
+        if worker is None or worker.done():
+            self._workers[chat_id] = asyncio.create_task(self._drain(chat_id), name=f"message_sender:{chat_id}")
+
+        return await outgoing.future
+
+    async def _drain(self, chat_id: int) -> None:
+        queue = self._queues[chat_id]
+        try:
+            while not queue.empty():
+                outgoing = queue.get_nowait()
+                # INFO: The future is already cancelled if the handler awaiting send() was, the worker
+                # keeps draining the other answers of the chat
+                try:
+                    sent = await self._send_answer(outgoing)
+                    if not outgoing.future.done():
+                        outgoing.future.set_result(sent)
+                except Exception as e:
+                    logging.error(f"Failed to send an answer to chat {chat_id}: {e}")
+                    if not outgoing.future.done():
+                        outgoing.future.set_exception(e)
+        finally:
+            self._queues.pop(chat_id, None)
+            self._workers.pop(chat_id, None)
+            # Only left over if the worker was cancelled on shutdown
+            while not queue.empty():
+                queue.get_nowait().future.cancel()
+
+    async def _send_answer(self, outgoing: OutgoingAnswer) -> list[Message]:
+        reply_markup = outgoing.kwargs.pop("reply_markup", None)
+
+        sent = []
+        for index, chunk in enumerate(outgoing.chunks):
+            kwargs = dict(outgoing.kwargs)
+            if index == len(outgoing.chunks) - 1 and reply_markup is not None:
+                kwargs["reply_markup"] = reply_markup
+            sent.append(await self._send_chunk(outgoing.bot, outgoing.chat_id, chunk, kwargs))
+
+        return sent
+
+    async def _send_chunk(self, bot: Bot, chat_id: int, text: str, kwargs: dict[str, Any]) -> Message:
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await bot.send_message(chat_id, text, **kwargs)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                logging.warning(f"Flood control in chat {chat_id}, retrying in {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+
+
+message_sender = MessageSender()
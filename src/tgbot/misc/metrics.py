@@ -0,0 +1,212 @@
+"""
+Background sampler for bot process and system metrics.
+
+The admin /status command must never block the event loop (psutil.cpu_percent(interval=1)
+used to freeze every update for a second), so metrics are collected by a background task
+into a fixed-size ring buffer and /status only renders what is already there. The same samples are
+exposed in Prometheus format on the BOT_METRICS_PORT sidecar.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Callable
+
+import psutil
+from aiohttp import web
+from prometheus_client import CONTENT_TYPE_LATEST, Histogram, generate_latest
+
+from src.utils.prometheus import METRICS_PREFIX
+
+SPARKLINE_BARS = "▁▂▃▄▅▆▇█"
+
+# Port of the Prometheus sidecar of the bot, 0 disables it
+BOT_METRICS_PORT = int(os.getenv("BOT_METRICS_PORT", "9101"))
+
+API_CALL_LATENCY = Histogram(
+    f"{METRICS_PREFIX}_bot_api_call_duration_seconds",
+    "Duration of the bot requests to the API",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80),
+)
+
+
+@dataclass
+class MetricsSample:
+    """
+    A single snapshot of bot process and system metrics
+    """
+    timestamp: float
+    process_cpu: float
+    system_cpu: float
+    rss_mb: float
+    system_memory_percent: float
+    loop_lag_ms: float
+    asyncio_tasks: int
+    open_connections: int
+    pending_api_calls: int
+    queue_depths: dict[str, int] = field(default_factory=dict)
+
+
+class MetricsSampler:
+    """
+    Periodically samples metrics into a ring buffer of the last `history_size` samples.
+
+    Args:
+        interval: Seconds between two samples
+        history_size: Number of samples kept in the ring buffer
+    """
+
+    def __init__(self, interval: float = 5.0, history_size: int = 60):
+        self.interval = interval
+        self.samples: deque[MetricsSample] = deque(maxlen=history_size)
+        self.pending_api_calls = 0
+
+        self._process = psutil.Process(os.getpid())
+        self._queues: dict[str, Callable[[], int]] = {}
+        self._task: asyncio.Task | None = None
+
+    def register_queue(self, name: str, depth: Callable[[], int]) -> None:
+        """
+        Register a callable returning the current depth of a queue to be sampled
+        """
+        self._queues[name] = depth
+
+    @asynccontextmanager
+    async def track_api_call(self):
+        """
+        Count a request to the API as pending while the block is running
+        """
+        self.pending_api_calls += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.pending_api_calls -= 1
+            API_CALL_LATENCY.observe(time.perf_counter() - started)
+
+    def start(self) -> None:
+        """
+        Start the sampling task on the running event loop
+        """
+        if self._task is not None and not self._task.done():
+            return
+
+        # The first non-blocking cpu_percent() call always returns 0.0, it only primes the counters
+        self._process.cpu_percent(interval=None)
+        psutil.cpu_percent(interval=None)
+
+        self._task = asyncio.create_task(self._run(), name="metrics_sampler")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected_wakeup = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            # Everything past the expected wake-up time was spent waiting for other callbacks
+            loop_lag_ms = max(0.0, loop.time() - expected_wakeup) * 1000
+
+            try:
+                # INFO: The tasks and the queues are read on the event loop, only psutil runs in the thread
+                asyncio_tasks = len(asyncio.all_tasks())
+                queue_depths = {name: depth() for name, depth in self._queues.items()}
+                sample = await asyncio.to_thread(self._collect, loop_lag_ms, asyncio_tasks, queue_depths)
+                self.samples.append(sample)
+            except Exception as e:
+                logging.error(f"Failed to collect metrics sample: {e}")
+
+    def _collect(self, loop_lag_ms: float, asyncio_tasks: int, queue_depths: dict[str, int]) -> MetricsSample:
+        with self._process.oneshot():
+            process_cpu = self._process.cpu_percent(interval=None)
+            rss_mb = self._process.memory_info().rss / (1024 * 1024)
+            open_connections = len(self._process.net_connections(kind="inet"))
+
+        return MetricsSample(
+            timestamp=time.time(),
+            process_cpu=process_cpu,
+            system_cpu=psutil.cpu_percent(interval=None),
+            rss_mb=rss_mb,
+            system_memory_percent=psutil.virtual_memory().percent,
+            loop_lag_ms=loop_lag_ms,
+            asyncio_tasks=asyncio_tasks,
+            open_connections=open_connections,
+            pending_api_calls=self.pending_api_calls,
+            queue_depths=queue_depths,
+        )
+
+    @property
+    def latest(self) -> MetricsSample | None:
+        return self.samples[-1] if self.samples else None
+
+    def latest_values(self) -> dict[str, float]:
+        """
+        Numeric values of the latest sample, without the queue depths
+        """
+        if self.latest is None:
+            return {}
+        values = asdict(self.latest)
+        del values["queue_depths"]
+        return values
+
+    def latest_queue_depths(self) -> dict[str, dict[str, int]]:
+        return {name: {"depth": depth} for name, depth in (self.latest.queue_depths if self.latest else {}).items()}
+
+    def history(self, metric: str) -> list[float]:
+        """
+        Return the recorded values of a MetricsSample attribute, oldest first
+        """
+        return [getattr(sample, metric) for sample in self.samples]
+
+
+async def start_metrics_server(port: int = BOT_METRICS_PORT) -> web.AppRunner | None:
+    """
+    Serve the Prometheus metrics of the bot on /metrics of a sidecar port, returns the runner to clean up
+    """
+    if not port:
+        return None
+
+    async def metrics(request: web.Request) -> web.Response:
+        response = web.Response(body=generate_latest())
+        response.headers["Content-Type"] = CONTENT_TYPE_LATEST
+        return response
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, port=port).start()
+    logging.info(f"Prometheus metrics are served on port {port}")
+    return runner
+
+
+def sparkline(values: list[float], width: int = 20) -> str:
+    """
+    Render the last `width` values as a unicode sparkline (e.g. "▁▂▅▇▃")
+    """
+    values = values[-width:]
+    if not values:
+        return ""
+
+    low, high = min(values), max(values)
+    if high == low:
+        return SPARKLINE_BARS[0] * len(values)
+
+    scale = (len(SPARKLINE_BARS) - 1) / (high - low)
+    return "".join(SPARKLINE_BARS[round((value - low) * scale)] for value in values)
+
+
+metrics_sampler = MetricsSampler()
@@ -0,0 +1,291 @@
+"""
+Compiled grammar corpus artifact.
+
+The build step compiles the final grammar collection into a single versioned binary file:
+parsed entries, pre-rendered Telegram HTML cards, titles, related grammars and dense embeddings.
+The API and the bot mmap the file at startup, so cards are served without re-running the
+markdown formatter and without a Qdrant round-trip.
+
+File layout (little-endian):
+    MAGIC (4 bytes) | format version (u32) | header length (u32) | header (JSON, utf-8) | data section
+
+The data section starts at the first 8-byte aligned offset after the header, column offsets in the
+header are relative to it and 8-byte aligned as well. String columns are stored as (count + 1) u32
+offsets followed by the utf-8 blob, numeric columns as raw arrays.
+
+Usage:
+    python -m src.utils.corpus_artifact --output data/grammar-level-1/final/grammar_corpus.bin
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+
+import logfire
+import numpy as np
+
+from src.schemas.schemas import GrammarEntryV2
+from src.utils.json_to_telegram_md import grammar_entry_to_markdown
+
+MAGIC = b"KGCA"
+FORMAT_VERSION = 1
+ALIGNMENT = 8
+
+CORPUS_ARTIFACT_PATH = os.getenv("CORPUS_ARTIFACT_PATH", "data/grammar-level-1/final/grammar_corpus.bin")
+
+STRING_COLUMNS = ["id", "grammar_name_kr", "grammar_name_rus", "content", "title", "card_html", "related_grammars"]
+
+
+def _pad(buffer: bytearray) -> None:
+    buffer.extend(b"\0" * (-len(buffer) % ALIGNMENT))
+
+
+def _encode_strings(values: list[str]) -> bytes:
+    blobs = [value.encode("utf-8") for value in values]
+    offsets = np.zeros(len(blobs) + 1, dtype="<u4")
+    offsets[1:] = np.cumsum([len(blob) for blob in blobs])
+    return offsets.tobytes() + b"".join(blobs)
+
+
+def write_corpus_artifact(
+        path: str,
+        corpus_version: str,
+        ids: list[str],
+        entries: list[GrammarEntryV2],
+        embeddings: np.ndarray | None = None,
+) -> None:
+    """
+    Compile grammar entries into the artifact file at `path`
+    """
+    count = len(entries)
+    columns: dict[str, bytes] = {
+        "id": _encode_strings(ids),
+        "grammar_name_kr": _encode_strings([entry.grammar_name_kr.strip() for entry in entries]),
+        "grammar_name_rus": _encode_strings([entry.grammar_name_rus.strip() for entry in entries]),
+        "content": _encode_strings([entry.content for entry in entries]),
+        "title": _encode_strings([
+            f"{entry.grammar_name_kr.strip()} - {entry.grammar_name_rus.strip()}" for entry in entries
+        ]),
+        "card_html": _encode_strings([grammar_entry_to_markdown(entry.model_dump()) for entry in entries]),
+        "related_grammars": _encode_strings([json.dumps(entry.related_grammars, ensure_ascii=False) for entry in entries]),
+        "level": np.asarray([entry.level for entry in entries], dtype="u1").tobytes(),
+    }
+
+    embedding_dim = 0
+    # An empty corpus has no embeddings to take the dimension from
+    if embeddings is not None and count:
+        embeddings = np.ascontiguousarray(embeddings, dtype="<f4")
+        if embeddings.shape[0] != count:
+            raise ValueError(f"Expected {count} embeddings, one per grammar, got {embeddings.shape[0]}")
+        embedding_dim = embeddings.shape[1]
+        columns["embeddings"] = embeddings.tobytes()
+
+    layout = {}
+    position = 0
+    for name, data in columns.items():
+        layout[name] = {"offset": position, "length": len(data)}
+        position += len(data) + (-len(data) % ALIGNMENT)
+
+    header = {
+        "corpus_version": corpus_version,
+        "count": count,
+        "embedding_dim": embedding_dim,
+        "columns": layout,
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+
+    buffer = bytearray()
+    buffer.extend(MAGIC)
+    buffer.extend(struct.pack("<II", FORMAT_VERSION, len(header_bytes)))
+    buffer.extend(header_bytes)
+    _pad(buffer)
+
+    for data in columns.values():
+        buffer.extend(data)
+        _pad(buffer)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(buffer)
+    os.replace(tmp_path, path)
+
+
+class CorpusArtifact:
+    """
+    Read-only, zero-copy view over a compiled corpus artifact.
+
+    Numeric columns are numpy arrays backed directly by the mmap, strings are only decoded on access.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = memoryview(self._mmap)
+
+        if self._buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a grammar corpus artifact")
+
+        format_version, header_length = struct.unpack_from("<II", self._buffer, len(MAGIC))
+        if format_version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported corpus artifact format version {format_version}")
+
+        header_start = len(MAGIC) + 8
+        header = json.loads(bytes(self._buffer[header_start:header_start + header_length]))
+        data_start = header_start + header_length
+        data_start += -data_start % ALIGNMENT
+
+        self.corpus_version: str = header["corpus_version"]
+        self.count: int = header["count"]
+        self._columns: dict[str, dict] = {
+            name: {"offset": data_start + column["offset"], "length": column["length"]}
+            for name, column in header["columns"].items()
+        }
+
+        self._string_offsets = {
+            name: np.frombuffer(self._buffer, dtype="<u4", count=self.count + 1, offset=self._columns[name]["offset"])
+            for name in STRING_COLUMNS
+        }
+        self.levels = np.frombuffer(self._buffer, dtype="u1", count=self.count, offset=self._columns["level"]["offset"])
+
+        self.embeddings: np.ndarray | None = None
+        if "embeddings" in self._columns:
+            self.embeddings = np.frombuffer(
+                self._buffer, dtype="<f4", count=self.count * header["embedding_dim"],
+                offset=self._columns["embeddings"]["offset"],
+            ).reshape(self.count, header["embedding_dim"])
+
+        self._row_by_id = {self._string("id", row): row for row in range(self.count)}
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, grammar_id: str) -> bool:
+        return grammar_id in self._row_by_id
+
+    def _string(self, column: str, row: int) -> str:
+        offsets = self._string_offsets[column]
+        blob_start = self._columns[column]["offset"] + (self.count + 1) * 4
+        return str(self._buffer[blob_start + offsets[row]:blob_start + offsets[row + 1]], "utf-8")
+
+    def row(self, grammar_id: str) -> int | None:
+        return self._row_by_id.get(grammar_id)
+
+    def ids(self) -> list[str]:
+        return list(self._row_by_id)
+
+    def title(self, grammar_id: str) -> str:
+        return self._string("title", self._row_by_id[grammar_id])
+
+    def titles(self) -> list[str]:
+        return [self._string("title", row) for row in range(self.count)]
+
+    def grammar_names(self) -> list[str]:
+        return [self._string("grammar_name_kr", row) for row in range(self.count)]
+
+    def card_html(self, grammar_id: str) -> str:
+        return self._string("card_html", self._row_by_id[grammar_id])
+
+    def related_grammars(self, grammar_id: str) -> list[str]:
+        return json.loads(self._string("related_grammars", self._row_by_id[grammar_id]))
+
+    def entry(self, grammar_id: str) -> GrammarEntryV2:
+        row = self._row_by_id[grammar_id]
+        return GrammarEntryV2(
+            grammar_name_kr=self._string("grammar_name_kr", row),
+            grammar_name_rus=self._string("grammar_name_rus", row),
+            level=int(self.levels[row]),
+            content=self._string("content", row),
+            related_grammars=json.loads(self._string("related_grammars", row)),
+        )
+
+    def close(self) -> None:
+        self._string_offsets.clear()
+        self.levels = None
+        self.embeddings = None
+        self._buffer.release()
+        self._mmap.close()
+        self._file.close()
+
+
+def load_corpus_artifact(path: str = CORPUS_ARTIFACT_PATH) -> CorpusArtifact | None:
+    """
+    Mmap the corpus artifact if it was built, otherwise return None
+    """
+    if not os.path.exists(path):
+        logfire.info(f"Corpus artifact {path} not found, falling back to Qdrant payloads")
+        return None
+
+    try:
+        artifact = CorpusArtifact(path)
+    except (OSError, ValueError) as e:
+        logfire.error(f"Failed to load corpus artifact {path}: {e}")
+        return None
+
+    if not len(artifact):
+        # The grammar names of the pattern extractor and the fuzzy lookup come from the artifact
+        logfire.warning(f"Corpus artifact {path} is empty, falling back to Qdrant payloads")
+        artifact.close()
+        return None
+
+    logfire.info(f"Loaded corpus artifact {path}: {len(artifact)} grammars, version {artifact.corpus_version}")
+    return artifact
+
+
+def build_corpus_artifact(output_path: str = CORPUS_ARTIFACT_PATH) -> None:
+    """
+    Compile the final grammar collection from Qdrant into the artifact.
+
+    Qdrant is used as the source, so that IDs and embeddings match the ones used for retrieval.
+    """
+    from qdrant_client import QdrantClient
+
+    from src.config.settings import Config
+
+    config = Config()
+    client = QdrantClient(host=config.qdrant_host, port=config.qdrant_port)
+    collection_name = config.qdrant_collection_name_final
+
+    ids, entries, payloads, vectors = [], [], [], []
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name,
+            limit=256,
+            offset=offset,
+            with_payload=True,
+            with_vectors=[config.embedding_model],
+        )
+        for point in points:
+            ids.append(str(point.id))
+            entries.append(GrammarEntryV2(**point.payload))
+            payloads.append(point.payload)
+            vectors.append(point.vector[config.embedding_model])
+        if offset is None:
+            break
+
+    if not ids:
+        # Usually a wrong collection name or Qdrant instance, keep the previous artifact
+        raise ValueError(f"Collection {collection_name} is empty, no corpus artifact written")
+
+    # Same digest as src.llm_agent.corpus.get_corpus_version, so the API and the bot agree on it
+    from src.llm_agent.corpus import corpus_digest
+
+    corpus_version = os.getenv("GRAMMAR_CORPUS_VERSION") or corpus_digest(collection_name, zip(ids, payloads))
+
+    write_corpus_artifact(output_path, corpus_version, ids, entries, np.asarray(vectors, dtype="<f4"))
+    logfire.info(f"Compiled {len(ids)} grammars into {output_path} (version {corpus_version})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile the grammar corpus artifact")
+    parser.add_argument("--output", default=CORPUS_ARTIFACT_PATH)
+    args = parser.parse_args()
+
+    logfire.configure(send_to_logfire="if-token-present")
+    try:
+        build_corpus_artifact(args.output)
+    except ValueError as e:
+        logfire.error(str(e))
+        raise SystemExit(1)
@@ -1,121 +1,595 @@
-# import re
-# import time
+"""
+Markdown to Telegram HTML formatter.
+
+The text is tokenized once: code spans and fences are cut out first, every line is matched against
+the heading / list item rules, and the inline markdown characters become delimiter tokens.
+Emphasis pairs are then matched on the token list (in the same precedence as the previous regex
+pipeline, see src/utils/old/json_to_telegram_md_regex.py) and the HTML is written in a single pass.
+
+The output is kept identical to the regex pipeline, which is checked by the golden tests. The only
+intended difference: texts with more than ten inline code spans are no longer garbled
+(the regex pipeline replaced INLINECODEPLACEHOLDER1 inside INLINECODEPLACEHOLDER10 as well).
+"""
 import re
 
-from chatgpt_md_converter.converters import convert_html_chars
-from chatgpt_md_converter.extractors import extract_and_convert_code_blocks, reinsert_code_blocks
 from chatgpt_md_converter.helpers import remove_blockquote_escaping, remove_spoiler_escaping
 
-def split_by_tag(out_text: str, md_tag: str, html_tag: str) -> str:
-    """
-    Splits the text by markdown tag and replaces it with the specified HTML tag.
-    """
-    tag_pattern = re.compile(
-        r"{}(.*?){}".format(re.escape(md_tag), re.escape(md_tag)),
+# Stands in for a code span / code block in the skeleton text that lines are matched against
+CODE_SENTINEL = "\ue000"
+
+HEADING_PATTERN = re.compile(r"(#{1,6})\s+(.+)$", re.MULTILINE)
+LIST_ITEM_PATTERN = re.compile(r"(\s*)[\-\*]\s+(.+)$", re.MULTILINE)
+# Line breaks followed by a line that may be a heading or a list item
+LINE_RULE_PATTERN = re.compile(r"\n(?=#|[\-\*]\s|[^\S\n])")
+CODE_LANGUAGE_PATTERN = re.compile(r"\w*")
+EXCESS_NEWLINES_PATTERN = re.compile(r"\n{3,}")
+
+# Inline characters that become separate tokens: delimiter runs, code sentinels and, only when needed,
+# link and storage reference characters. "![" and "](" are single tokens, a lone "!" or "(" only matters
+# when a removed storage reference can glue it to a bracket. The leading lookahead keeps the fast
+# character class scan
+INLINE_SPECIAL_PATTERNS = {
+    (links, storage_references): re.compile(
+        r"(?=[*_~|\ue000"
+        + (r"\[\])!" if links else "")
+        + ("(【】" if storage_references else "")
+        + r"])(?:\*+|_+|~+|\|+|!\[|\]\(|.)",
         re.DOTALL,
     )
+    for links in (False, True)
+    for storage_references in (False, True)
+}
+
+ASCII_ALNUM = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789")
+
+# Emphasis rules in the order they are applied: (delimiter char, run length, opening tag, closing tag, single line)
+EMPHASIS_RULES = [
+    ("*", 3, "<b><i>", "</i></b>", True),
+    ("_", 3, "<u><i>", "</i></u>", True),
+    ("*", 2, "<b>", "</b>", False),
+    ("_", 2, "<u>", "</u>", False),
+    ("~", 2, "<s>", "</s>", False),
+    ("|", 2, '<span class="tg-spoiler">', "</span>", False),
+]
+
+TEXT, CODE, MARKUP, DELIMITER, PUNCTUATION = range(5)
 
-    # Special handling for the tg-spoiler tag
-    if html_tag == 'span class="tg-spoiler"':
-        return tag_pattern.sub(r'<span class="tg-spoiler">\1</span>', out_text)
 
-    return tag_pattern.sub(r"<{}>\1</{}>".format(html_tag, html_tag), out_text)
+def escape_html(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
 
 
-def extract_inline_code_snippets(text: str):
+def extract_code(text: str) -> tuple[str, dict[int, str]]:
     """
-    Extracts inline code (single-backtick content) from the text,
-    replacing it with placeholders, returning modified text and a dict of placeholders -> code text.
-    This ensures characters like '*' or '_' inside inline code won't be interpreted as Markdown.
+    Cut code blocks and inline code out of the text and escape the rest of it.
+
+    Returns the escaped skeleton text with a single CODE_SENTINEL in place of every code region,
+    and the rendered HTML of the regions keyed by the sentinel position.
+    """
+    # Unmatched delimiters are closed at the end of the text
+    if text.count("```") % 2:
+        text += "```"
+    if text.count("`") % 2:
+        text += "`"
+
+    fences = []
+    position = 0
+    while (start := text.find("```", position)) != -1:
+        language_end = CODE_LANGUAGE_PATTERN.match(text, start + 3).end()
+        content_start = language_end + 1 if text.startswith("\n", language_end) else language_end
+        end = text.find("```", content_start)
+        if end == -1:
+            break
+
+        language = text[start + 3:language_end]
+        content = escape_html(text[content_start:end])
+        if language:
+            html = f'<pre><code class="language-{language}">{content}</code></pre>'
+        else:
+            html = f"<pre><code>{content}</code></pre>"
+        fences.append((start, end + 3, html))
+        position = end + 3
+
+    pieces = []
+    code_at = {}
+    skeleton_length = 0
+
+    def add_text(piece: str) -> None:
+        nonlocal skeleton_length
+        piece = escape_html(piece)
+        pieces.append(piece)
+        skeleton_length += len(piece)
+
+    def add_code(html: str) -> None:
+        nonlocal skeleton_length
+        code_at[skeleton_length] = html
+        pieces.append(CODE_SENTINEL)
+        skeleton_length += 1
+
+    fence_index = 0
+    position = 0
+    length = len(text)
+
+    while position < length:
+        next_fence = fences[fence_index][0] if fence_index < len(fences) else length
+        backtick = text.find("`", position, next_fence)
+
+        if backtick == -1:
+            add_text(text[position:next_fence])
+            if fence_index == len(fences):
+                break
+            add_code(fences[fence_index][2])
+            position = fences[fence_index][1]
+            fence_index += 1
+            continue
+
+        add_text(text[position:backtick])
+
+        # Inline code may span code blocks, those are kept inside of it.
+        # Its text is escaped twice, as the regex pipeline did
+        content = []
+        closing = -1
+        cursor = backtick + 1
+        span_fence = fence_index
+        while True:
+            next_fence = fences[span_fence][0] if span_fence < len(fences) else length
+            closing = text.find("`", cursor, next_fence)
+            if closing != -1:
+                if closing > cursor:
+                    content.append(escape_html(escape_html(text[cursor:closing])))
+                break
+            if span_fence == len(fences):
+                break
+            if next_fence > cursor:
+                content.append(escape_html(escape_html(text[cursor:next_fence])))
+            content.append(fences[span_fence][2])
+            cursor = fences[span_fence][1]
+            span_fence += 1
+
+        if closing == -1 or not content:
+            # Empty or unclosed inline code is kept as a literal backtick
+            add_text("`")
+            position = backtick + 1
+            continue
+
+        add_code(f"<code>{''.join(content)}</code>")
+        position = closing + 1
+        fence_index = span_fence
+
+    return "".join(pieces), code_at
+
+
+class Tokens:
     """
-    placeholders = []
-    code_snippets = {}
-    inline_code_pattern = re.compile(r"`([^`]+)`")
+    Token stream, stored as parallel lists
+
+    Attributes:
+        kinds: One of TEXT, CODE, MARKUP, DELIMITER, PUNCTUATION
+        texts: Escaped text, or ready HTML for CODE and MARKUP tokens
+        lines: Index of the source line
+        hidden: Whether the token is inside a 【...】 storage reference
+        cells: For every run of delimiter chars, what each char is rendered as: itself, a tag once matched, or nothing
+        delimiters: Indices of the delimiter runs by their char
+    """
+    __slots__ = ("kinds", "texts", "lines", "hidden", "cells", "delimiters", "has_hidden", "has_links")
 
-    def replacer(match):
-        snippet = match.group(1)
-        placeholder = f"INLINECODEPLACEHOLDER{len(placeholders)}"
-        placeholders.append(placeholder)
-        code_snippets[placeholder] = snippet
-        return placeholder
+    def __init__(self):
+        self.kinds: list[int] = []
+        self.texts: list[str] = []
+        self.lines: list[int] = []
+        self.hidden: list[bool] = []
+        self.cells: dict[int, list[str]] = {}
+        self.delimiters: dict[str, list[int]] = {"*": [], "_": [], "~": [], "|": []}
+        self.has_hidden = False
+        self.has_links = False
 
-    new_text = inline_code_pattern.sub(replacer, text)
-    return new_text, code_snippets
+    def __len__(self) -> int:
+        return len(self.kinds)
 
-def custom_telegram_format(text: str) -> str:
+    def text(self, index: int) -> str:
+        if self.kinds[index] == DELIMITER:
+            return "".join(self.cells[index])
+        return self.texts[index]
+
+
+class Lexer:
     """
-    Converts markdown in the provided text to HTML supported by Telegram.
+    Splits the skeleton text into tokens, applying the line level rules (headings and list items).
+
+    Newlines stay inside TEXT tokens, a line counter is kept for the single line emphasis rules.
     """
 
-    # Step 1: Convert HTML reserved symbols
-    text = convert_html_chars(text)
+    def __init__(self, skeleton: str, code_at: dict[int, str]):
+        self.skeleton = skeleton
+        self.code_at = code_at
+        self.tokens = Tokens()
+        self.line = 0
+        self.hidden_until = -1
+
+        # Link and storage reference characters only need their own tokens when those can occur at all
+        has_storage_references = "【" in skeleton
+        self.tokens.has_links = "](" in skeleton or (has_storage_references and "[" in skeleton)
+        self.pattern = INLINE_SPECIAL_PATTERNS[self.tokens.has_links, has_storage_references]
+        self.text_chars = "~|" if has_storage_references else "~|!("
+
+    def add(self, kind: int, text: str, start: int) -> None:
+        tokens = self.tokens
+        tokens.kinds.append(kind)
+        tokens.texts.append(text)
+        tokens.lines.append(self.line)
+        tokens.hidden.append(start <= self.hidden_until)
+        if kind == TEXT and "\n" in text:
+            self.line += text.count("\n")
+
+    def tokenize(self) -> Tokens:
+        skeleton = self.skeleton
+        length = len(skeleton)
+        position = 0
+
+        while True:
+            first = skeleton[position] if position < length else ""
+            heading = HEADING_PATTERN.match(skeleton, position) if first == "#" else None
+            list_item = None
+            if heading is None and first and (first in "-*" or (first.isspace() and first != "\n")):
+                list_item = LIST_ITEM_PATTERN.match(skeleton, position)
+
+            if heading:
+                position = self.lex_heading(position, heading)
+            elif list_item:
+                if list_item.end(1) > position:
+                    self.add(TEXT, list_item.group(1), position)
+                self.add(MARKUP, "• ", list_item.end(1))
+                content_start = list_item.start(2)
+                # A bare "-" line takes the next line as its content, which may be a heading on its own
+                heading = None
+                if skeleton[content_start - 1] == "\n" and skeleton[content_start] == "#":
+                    heading = HEADING_PATTERN.match(skeleton, content_start)
+                if heading:
+                    position = self.lex_heading(content_start, heading)
+                else:
+                    self.lex_inline(content_start, list_item.end(2))
+                    position = list_item.end()
+            else:
+                # Plain lines up to the next one that may be a heading or a list item
+                next_rule = LINE_RULE_PATTERN.search(skeleton, position)
+                end = next_rule.start() if next_rule else length
+                self.lex_inline(position, end)
+                position = end
+
+            if position >= length:
+                self.tokens.has_hidden = self.hidden_until >= 0
+                return self.tokens
+
+            self.add(TEXT, "\n", position)
+            position += 1
+
+    def lex_heading(self, start: int, heading: re.Match) -> int:
+        self.add(MARKUP, "<b>", start)
+        self.lex_inline(heading.start(2), heading.end(2))
+        self.add(MARKUP, "</b>", heading.end(2))
+        return heading.end()
+
+    def lex_inline(self, start: int, end: int) -> None:
+        skeleton = self.skeleton
+        tokens = self.tokens
+        add = self.add
+        text_chars = self.text_chars
+        position = start
+
+        for match in self.pattern.finditer(skeleton, start, end):
+            token = match.group()
+            char = token[0]
+            if len(token) == 1 and char in text_chars:
+                # Chars that can't start a pair or a link on their own stay a part of the text
+                continue
+
+            index = match.start()
+            if index > position:
+                add(TEXT, skeleton[position:index], position)
+            position = match.end()
+
+            if char in "*_~|":
+                tokens.delimiters[char].append(len(tokens))
+                tokens.cells[len(tokens)] = list(token)
+                add(DELIMITER, token, index)
+            elif char == CODE_SENTINEL and index in self.code_at:
+                add(CODE, self.code_at[index], index)
+            elif char == "【" and index > self.hidden_until:
+                closing = skeleton.find("】", index + 1)
+                if closing > index + 1:
+                    self.hidden_until = closing
+                add(TEXT, char, index)
+            elif char in "[]()!":
+                add(PUNCTUATION, token, index)
+            else:
+                add(TEXT, char, index)
+
+        if end > position:
+            add(TEXT, skeleton[position:end], position)
+
+
+def unmatched_segments(tokens: Tokens, runs: list[int], char: str) -> list[tuple[int, int, int]]:
+    """
+    Contiguous unmatched delimiter chars as (token index, offset, length)
+    """
+    segments = []
+    for index in runs:
+        cells = tokens.cells[index]
+        unmatched = cells.count(char)
+        if unmatched == len(cells):
+            segments.append((index, 0, unmatched))
+            continue
+        if not unmatched:
+            continue
+
+        start = None
+        for offset, cell in enumerate(cells):
+            if cell == char:
+                if start is None:
+                    start = offset
+            elif start is not None:
+                segments.append((index, start, offset - start))
+                start = None
+        if start is not None:
+            segments.append((index, start, len(cells) - start))
+    return segments
+
+
+def pair_runs(tokens: Tokens, segments: list[tuple[int, int, int]], run: int, open_tag: str, close_tag: str) -> None:
+    """
+    Match `run`-long delimiter sequences left to right, non-greedy, the same way `X(.*?)X` does.
 
-    # Step 2: Extract and convert triple-backtick code blocks first
-    output, triple_code_blocks = extract_and_convert_code_blocks(text)
+    Args:
+        segments: Contiguous unmatched delimiter chars, see unmatched_segments
+    """
+    opening = None
+    opening_position = 0
+
+    for index, start, length in segments:
+        cells = tokens.cells[index]
+        for position in range(start, start + length - run + 1, run):
+            if opening is None:
+                opening, opening_position = cells, position
+            else:
+                opening[opening_position:opening_position + run] = [open_tag] + [""] * (run - 1)
+                cells[position:position + run] = [close_tag] + [""] * (run - 1)
+                opening = None
+
+
+def pair_emphasis(tokens: Tokens) -> None:
+    delimiters = tokens.delimiters
+    longest_run = {
+        char: max((len(tokens.cells[index]) for index in runs), default=0)
+        for char, runs in delimiters.items()
+    }
+
+    for char, run, open_tag, close_tag, single_line in EMPHASIS_RULES:
+        runs = delimiters[char]
+        # Matched runs only get shorter, so a rule without a long enough run can never match
+        if longest_run[char] < run or len(runs) < 2 and longest_run[char] < 2 * run:
+            continue
+
+        segments = unmatched_segments(tokens, runs, char)
+        if not single_line:
+            pair_runs(tokens, segments, run, open_tag, close_tag)
+            continue
+
+        line_start = 0
+        for position in range(1, len(segments) + 1):
+            if position == len(segments) or \
+                    tokens.lines[segments[position][0]] != tokens.lines[segments[line_start][0]]:
+                pair_runs(tokens, segments[line_start:position], run, open_tag, close_tag)
+                line_start = position
+
+    pair_italic_asterisks(tokens, delimiters["*"])
+    pair_runs(tokens, unmatched_segments(tokens, delimiters["_"], "_"), 1, "<i>", "</i>")
+
+    for index, cells in tokens.cells.items():
+        tokens.texts[index] = "".join(cells)
+
+
+def char_before(tokens: Tokens, index: int, offset: int) -> str | None:
+    """
+    Last character written before the delimiter cell, as seen by the emphasis lookarounds
+    """
+    for cell in reversed(tokens.cells[index][:offset]):
+        if cell:
+            return cell[-1]
 
-    # Step 2.5: Extract inline code snippets (single backticks) so they won't be parsed as italics, etc.
-    output, inline_code_snippets = extract_inline_code_snippets(output)
+    for position in range(index - 1, -1, -1):
+        if tokens.kinds[position] == CODE:
+            # Code used to be replaced with an alphanumeric placeholder before matching emphasis
+            return "0"
+        text = tokens.text(position)
+        if text:
+            return text[-1]
+    return None
 
-    # Step 3: Escape HTML special characters in the output text (for non-code parts)
-    output = output.replace("<", "&lt;").replace(">", "&gt;")
 
-    # Convert headings (H1-H6)
-    output = re.sub(r"^(#{1,6})\s+(.+)$", r"<b>\2</b>", output, flags=re.MULTILINE)
+def char_after(tokens: Tokens, index: int, offset: int) -> str | None:
+    """
+    First character written after the delimiter cell, as seen by the emphasis lookarounds
+    """
+    for cell in tokens.cells[index][offset + 1:]:
+        if cell:
+            return cell[0]
 
-    # Convert unordered lists
-    output = re.sub(r"^(\s*)[\-\*]\s+(.+)$", r"\1• \2", output, flags=re.MULTILINE)
+    for position in range(index + 1, len(tokens)):
+        if tokens.kinds[position] == CODE:
+            return "C"
+        text = tokens.text(position)
+        if text:
+            return text[0]
+    return None
 
-    # Nested Bold and Italic
-    output = re.sub(r"\*\*\*(.*?)\*\*\*", r"<b><i>\1</i></b>", output)
-    output = re.sub(r"\_\_\_(.*?)\_\_\_", r"<u><i>\1</i></u>", output)
 
-    # Bold, underline, strikethrough, spoiler
-    output = split_by_tag(output, "**", "b")
-    output = split_by_tag(output, "__", "u")
-    output = split_by_tag(output, "~~", "s")
-    output = split_by_tag(output, "||", 'span class="tg-spoiler"')
-    
-    # Custom approach for single-asterisk italic
-    italic_pattern = re.compile(
-        r"(?<![A-Za-z0-9])\*(?=[^\s])(.*?)(?<!\s)\*(?![A-Za-z0-9])", re.DOTALL
-    )
-    output = italic_pattern.sub(r"<i>\1</i>", output)
+def pair_italic_asterisks(tokens: Tokens, runs: list[int]) -> None:
+    """
+    Single asterisk italic: the opening `*` must not follow an ASCII alphanumeric and must be followed
+    by a non-space, the closing one must follow a non-space and must not precede an ASCII alphanumeric.
+    """
+    cells = [
+        (index, offset)
+        for index in runs
+        for offset, cell in enumerate(tokens.cells[index])
+        if cell == "*"
+    ]
+    if len(cells) < 2:
+        return
+
+    can_open, can_close = [], []
+    for index, offset in cells:
+        previous_char = char_before(tokens, index, offset)
+        next_char = char_after(tokens, index, offset)
+        can_open.append(
+            (previous_char is None or previous_char not in ASCII_ALNUM)
+            and next_char is not None and not next_char.isspace()
+        )
+        can_close.append(
+            previous_char is not None and not previous_char.isspace()
+            and (next_char is None or next_char not in ASCII_ALNUM)
+        )
 
-    # Process single underscore-based italic (works the same)
-    output = split_by_tag(output, "_", "i")
+    opening, closing = 0, 0
+    while True:
+        while opening < len(cells) and not can_open[opening]:
+            opening += 1
+        if opening >= len(cells):
+            return
 
-    # Remove storage links
-    output = re.sub(r"【[^】]+】", "", output)
+        closing = max(closing, opening + 1)
+        while closing < len(cells) and not can_close[closing]:
+            closing += 1
+        if closing >= len(cells):
+            return
 
-    # Links and images
-    link_pattern = r"(?:!?)\[((?:[^\[\]]|\[.*?\])*)\]\(([^)]+)\)"
-    output = re.sub(link_pattern, r'<a href="\2">\1</a>', output)
+        index, offset = cells[opening]
+        tokens.cells[index][offset] = "<i>"
+        index, offset = cells[closing]
+        tokens.cells[index][offset] = "</i>"
+        opening = closing + 1
 
-    # Reinsert inline code snippets
-    for placeholder, snippet in inline_code_snippets.items():
-        escaped_snippet = (
-            snippet.replace("&", "&amp;")
-                   .replace("<", "&lt;")
-                   .replace(">", "&gt;")
-        )
-        output = output.replace(placeholder, f"<code>{escaped_snippet}</code>")
 
-    # Reinsert triple-backtick code blocks
-    output = reinsert_code_blocks(output, triple_code_blocks)
+def find_links(kinds: list[int], texts: list[str]) -> dict[int, tuple[int, int, int, int]]:
+    """
+    Find `[text](url)` and `![text](url)` links among the visible tokens.
 
-    # Unescape blockquotes and spoilers
-    output = remove_blockquote_escaping(output)
-    output = remove_spoiler_escaping(output)
+    Returns the link tokens keyed by the index of the first one:
+    (text start, text end, url start, url end).
+    """
+    def is_punctuation(index: int, *chars: str) -> bool:
+        return kinds[index] == PUNCTUATION and texts[index] in chars
+
+    def breaks_line(index: int) -> bool:
+        return kinds[index] == TEXT and "\n" in texts[index]
+
+    links = {}
+    count = len(kinds)
+    position = 0
+
+    while position < count:
+        if not is_punctuation(position, "[", "!["):
+            position += 1
+            continue
+
+        cursor = position + 1
+        link = None
+        # Whether the last nested [...] is on the current line, it can then be extended up to a later "]"
+        nested_on_line = False
+        while cursor < count:
+            if is_punctuation(cursor, "[", "!["):
+                # One level of nested brackets, closed on the same line
+                cursor += 1
+                while cursor < count and not is_punctuation(cursor, "]", "](") and not breaks_line(cursor):
+                    cursor += 1
+                if cursor == count or breaks_line(cursor):
+                    break
+                nested_on_line = True
+            elif is_punctuation(cursor, "]", "]("):
+                url_start = None
+                if texts[cursor] == "](":
+                    url_start = cursor + 1
+                elif cursor + 1 < count and is_punctuation(cursor + 1, "("):
+                    url_start = cursor + 2
+
+                if url_start is not None:
+                    url_end = url_start
+                    while url_end < count and not is_punctuation(url_end, ")"):
+                        url_end += 1
+                    if url_start < url_end < count:
+                        link = (cursor, url_start, url_end)
+                        break
+                if not nested_on_line:
+                    break
+            elif breaks_line(cursor):
+                nested_on_line = False
+            cursor += 1
+
+        if link is None:
+            position += 1
+            continue
+
+        text_end, url_start, url_end = link
+        first = position
+        if texts[position] == "[" and position > 0 and is_punctuation(position - 1, "!"):
+            first = position - 1
+        links[first] = (position + 1, text_end, url_start, url_end)
+        position = url_end + 1
+
+    return links
+
+
+def render(tokens: Tokens) -> str:
+    kinds, texts = tokens.kinds, tokens.texts
+    if tokens.has_hidden:
+        visible = [index for index, hidden in enumerate(tokens.hidden) if not hidden]
+        kinds = [kinds[index] for index in visible]
+        texts = [texts[index] for index in visible]
+
+    links = find_links(kinds, texts) if tokens.has_links else {}
+    if not links:
+        html = "".join(texts)
+    else:
+        parts = []
+        index = 0
+        while index < len(texts):
+            link = links.get(index)
+            if link is None:
+                parts.append(texts[index])
+                index += 1
+                continue
+
+            text_start, text_end, url_start, url_end = link
+            parts.append('<a href="')
+            parts.extend(texts[url_start:url_end])
+            parts.append('">')
+            parts.extend(texts[text_start:text_end])
+            parts.append("</a>")
+            index = url_end + 1
+        html = "".join(parts)
+
+    # Blockquote and spoiler tags written by the model are kept as real tags
+    if "&lt;" in html:
+        html = remove_spoiler_escaping(remove_blockquote_escaping(html))
+    if "\n\n\n" in html:
+        html = EXCESS_NEWLINES_PATTERN.sub("\n\n", html)
+
+    return html.strip()
 
-    # Cleanup
-    output = re.sub(r"\n{3,}", "\n\n", output)
 
-    return output.strip()
+def custom_telegram_format(text: str) -> str:
+    """
+    Converts markdown in the provided text to HTML supported by Telegram.
+    """
+    skeleton, code_at = extract_code(text)
+    tokens = Lexer(skeleton, code_at).tokenize()
+    pair_emphasis(tokens)
+    return render(tokens)
 
 
 def grammar_entry_to_markdown(entry: dict) -> str:
     lines = []
-    
+
     # Header: combine the Korean and Russian grammar names in a bold line.
     grammar_name_kr = entry["grammar_name_kr"].strip()
     grammar_name_rus = entry["grammar_name_rus"].strip()
@@ -133,12 +607,12 @@ def grammar_entry_to_markdown(entry: dict) -> str:
 
 
 if __name__ == '__main__':
-  
+
   foo =   {
-    'grammar_name_kr': '까지', 
-    'grammar_name_rus': '«до»', 
-    'level': 1, 
-    'content': '**Описание:**\nЧастица **까지** используется для обозначения предела действия или состояния в значении **«до»**. Может указывать как на **временные границы** (до какого времени), так и на **пространственные пределы** (до какого места).\n\n**Форма:**\n**Существительное + 까지**\nПрисоединяется непосредственно к существительному, обозначающему время или место.\n\n**Примеры:**\n학교**까지** 걸어서 갔어요.\nЯ пошёл до школы пешком.\n\n밤 12시**까지** 공부했어요.\nУчился до полуночи.\n\n부산**까지** 기차로 가요.\nДо Пусана еду на поезде.\n\n이번 주 금요일**까지** 숙제를 내세요.\nСдайте домашнее задание до этой пятницы.\n\n**Примечания:**\n\n1. Часто используется вместе с **부터** (с): **부터 … 까지** - «от … до» - если говорить о времени.\n    **Например:**\n\n오전 9시**부터** 오후 5시**까지** 일해요.\nРаботаю с 9 утра до 5 вечера.\n\n1. Часто используется вместе с **에서** (из): **에서 … 까지** - «из … до» - если говорить о местах.\n    **Например:**\n\n서울**에서** 경주**까지** 기차로 왔어요.\n\nДоехал из Сеула до Кёнджу на поезде.\n\n1. Может использоваться не только в буквальном, но и в переносном смысле.\n    **Например:**\n\n너**까지** 나를 의심해?\nДаже ты меня подозреваешь?\n', 
+    'grammar_name_kr': '까지',
+    'grammar_name_rus': '«до»',
+    'level': 1,
+    'content': '**Описание:**\nЧастица **까지** используется для обозначения предела действия или состояния в значении **«до»**. Может указывать как на **временные границы** (до какого времени), так и на **пространственные пределы** (до какого места).\n\n**Форма:**\n**Существительное + 까지**\nПрисоединяется непосредственно к существительному, обозначающему время или место.\n\n**Примеры:**\n학교**까지** 걸어서 갔어요.\nЯ пошёл до школы пешком.\n\n밤 12시**까지** 공부했어요.\nУчился до полуночи.\n\n부산**까지** 기차로 가요.\nДо Пусана еду на поезде.\n\n이번 주 금요일**까지** 숙제를 내세요.\nСдайте домашнее задание до этой пятницы.\n\n**Примечания:**\n\n1. Часто используется вместе с **부터** (с): **부터 … 까지** - «от … до» - если говорить о времени.\n    **Например:**\n\n오전 9시**부터** 오후 5시**까지** 일해요.\nРаботаю с 9 утра до 5 вечера.\n\n1. Часто используется вместе с **에서** (из): **에서 … 까지** - «из … до» - если говорить о местах.\n    **Например:**\n\n서울**에서** 경주**까지** 기차로 왔어요.\n\nДоехал из Сеула до Кёнджу на поезде.\n\n1. Может использоваться не только в буквальном, но и в переносном смысле.\n    **Например:**\n\n너**까지** 나를 의심해?\nДаже ты меня подозреваешь?\n',
     'related_grammars': ['부터', '에서 «из»']
   }
 
@@ -146,4 +620,4 @@ if __name__ == '__main__':
   md_output = grammar_entry_to_markdown(foo)
   print(md_output)
   # elapsed = time.perf_counter() - start_time
-  # print(f"\nRun time: {elapsed:.6f} seconds")
\ No newline at end of file
+  # print(f"\nRun time: {elapsed:.6f} seconds")
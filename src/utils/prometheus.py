@@ -0,0 +1,55 @@
+"""
+Prometheus exposition of the in-process stats of the API and the bot.
+
+Caches, queues and schedulers already keep their own counters for the stats endpoints and the
+admin commands. StatsCollector reads them at scrape time instead of mirroring every increment
+into a second set of metrics.
+"""
+from typing import Callable, Iterable
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+METRICS_PREFIX = "korean_bot"
+
+
+class StatsCollector(Collector):
+    """
+    Exposes the numeric values of a stats() dict as metrics named "<prefix>_<name>_<key>"
+
+    Args:
+        name: Name of the component, e.g. "answer_cache"
+        stats: Callable returning the stats dict, or a dict of stats dicts per `label` value
+        counters: Keys exposed as counters, the other numbers are exposed as gauges
+        label: Label for the keys of a nested stats dict, e.g. "model"
+    """
+
+    def __init__(
+            self,
+            name: str,
+            stats: Callable[[], dict],
+            counters: Iterable[str] = (),
+            label: str | None = None,
+    ):
+        self.name = name
+        self.stats = stats
+        self.counters = set(counters)
+        self.label = label
+
+    def collect(self):
+        stats = self.stats()
+        rows = stats.items() if self.label else [(None, stats)]
+
+        families = {}
+        for label_value, values in rows:
+            for key, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                if key not in families:
+                    metric_name = f"{METRICS_PREFIX}_{self.name}_{key}"
+                    labels = [self.label] if self.label else []
+                    family_type = CounterMetricFamily if key in self.counters else GaugeMetricFamily
+                    families[key] = family_type(metric_name, f"{self.name} {key.replace('_', ' ')}", labels=labels)
+                families[key].add_metric([label_value] if self.label else [], value)
+
+        yield from families.values()
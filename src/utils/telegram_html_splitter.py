@@ -0,0 +1,118 @@
+"""
+Splitting of Telegram HTML messages over the 4096 characters limit.
+
+Telegram counts the limit in UTF-16 code units of the text left after parsing the entities, so tags
+don't count, while `&lt;` counts as one character. Messages are split on the most natural boundary
+that fits: a paragraph, a line or a word outside any formatting, and only if there is none, inside
+<b>, <code>, <pre> or <blockquote>, closing the open tags at the end of a chunk and re-opening them
+at the start of the next one. Tags, entities and links are never cut in the middle.
+"""
+import re
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+TAG_PATTERN = re.compile(r"<(/?)([a-zA-Z][\w-]*)[^>]*>")
+ENTITY_PATTERN = re.compile(r"&#?\w+;")
+
+# Break point kinds, from the most to the least preferred one
+PARAGRAPH, LINE, TAGGED_LINE, WORD, TAGGED_WORD = range(5)
+
+
+def utf16_length(text: str) -> int:
+    return len(text) + sum(1 for char in text if ord(char) > 0xFFFF)
+
+
+def split_telegram_html(html: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list[str]:
+    """
+    Split Telegram HTML into messages of at most `limit` visible characters each.
+
+    Args:
+        html: Message text in Telegram HTML (e.g. the output of custom_telegram_format)
+        limit: Maximum number of visible UTF-16 code units per message
+
+    Returns:
+        Message chunks in order, each one with balanced tags
+    """
+    html = html.strip()
+    # Tags and entities only make the raw text longer than the visible one
+    if utf16_length(html) <= limit:
+        return [html] if html else []
+
+    chunks = []
+    # Open tags as (name, opening tag) at the current position
+    stack: list[tuple[str, str]] = []
+    # Tags open at the start of the current chunk, they were closed at the end of the previous one
+    stack_at_start: list[tuple[str, str]] = []
+    start = 0
+    position = 0
+    visible = 0
+    # The latest break point of each kind in the current chunk: (html position, visible length before it,
+    # separator length, open tags)
+    breaks: dict[int, tuple[int, int, int, tuple[tuple[str, str], ...]]] = {}
+
+    def cut(end: int, separator: int, open_tags: tuple[tuple[str, str], ...]) -> None:
+        nonlocal start, position, visible, stack
+        reopened = "".join(tag for _, tag in stack_at_start)
+        closing = "".join(f"</{name}>" for name, _ in reversed(open_tags))
+        chunk = reopened + html[start:end].rstrip() + closing
+        if TAG_PATTERN.sub("", chunk).strip():
+            chunks.append(chunk)
+
+        start = end + separator
+        if not open_tags:
+            while start < len(html) and html[start] in " \n":
+                start += 1
+        stack = list(open_tags)
+        stack_at_start[:] = stack
+        position = start
+        visible = 0
+        breaks.clear()
+
+    while position < len(html):
+        char = html[position]
+        width, end = 1, position + 1
+
+        if char == "<" and (match := TAG_PATTERN.match(html, position)):
+            name = match.group(2).lower()
+            if not match.group(1):
+                stack.append((name, match.group()))
+            else:
+                for index in range(len(stack) - 1, -1, -1):
+                    if stack[index][0] == name:
+                        del stack[index:]
+                        break
+            position = match.end()
+            continue
+
+        if char == "&" and (match := ENTITY_PATTERN.match(html, position)):
+            end = match.end()
+        elif ord(char) > 0xFFFF:
+            width = 2
+
+        if visible + width > limit:
+            # The most natural break point, unless it leaves a chunk under half of the limit
+            candidates = sorted(breaks.items())
+            long_enough = [item for item in candidates if item[1][1] >= limit // 2]
+            if candidates:
+                end_position, _, separator, open_tags = (long_enough or candidates)[0][1]
+                cut(end_position, separator, open_tags)
+            else:
+                # A single word, code line or link longer than the limit
+                cut(position, 0, tuple(stack))
+            continue
+
+        if char in " \n" and all(name != "a" for name, _ in stack):
+            separator = 1
+            if char == "\n":
+                kind = TAGGED_LINE if stack else LINE
+                if not stack and html.startswith("\n\n", position):
+                    kind, separator = PARAGRAPH, 2
+            else:
+                kind = TAGGED_WORD if stack else WORD
+            breaks[kind] = (position, visible, separator, tuple(stack))
+
+        visible += width
+        position = end
+
+    cut(len(html), 0, ())
+    return chunks